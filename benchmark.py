@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+
+import argparse
+import datetime
+import functools
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from http.server import (
+    BaseHTTPRequestHandler,
+    SimpleHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+
+from googleapiclient.http import HttpRequest, MediaFileUpload, build_http
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+import constants
+import pipeline
+import render
+import utils
+import yt
+
+# Synthetic clips cycle through these: width, height, fps, seconds, whether it has audio
+CLIP_SPECS = [
+    (1280, 720, 30, 6, True),
+    (1920, 1080, 60, 4, True),
+    (640, 480, 25, 8, False),
+    (1920, 1080, 30, 5, True),
+]
+RENDER_MODES = [
+    "moviepy",
+    "moviepy-streaming",
+    "ffmpeg",
+    "segments",
+    "segments-cached",
+    "overlap",
+]
+# Modules whose import time is measured, main first since it imports the others it needs
+STARTUP_MODULES = ["main", "daemon", "jobs", "twitch", "utils", "render", "yt"]
+
+
+def make_clips(count: int) -> list[str]:
+    # Clips are generated once and reused by later runs, so only the first run pays for them
+    clip_dir = os.path.join(constants.BENCHMARK_DIR, "clips")
+    os.makedirs(clip_dir, exist_ok=True)
+    clips = []
+    for i in range(count):
+        width, height, fps, seconds, audio = CLIP_SPECS[i % len(CLIP_SPECS)]
+        # A different test pattern per clip, so no two clips are the same file
+        clip = os.path.join(
+            clip_dir, f"{i}-{width}x{height}-{fps}-{seconds}-{int(audio)}.mp4"
+        )
+        if not os.path.exists(clip):
+            make_clip(clip, width, height, fps, seconds, audio, seed=i)
+        clips.append(clip)
+    return clips
+
+
+def make_clip(
+    path: str,
+    width: int,
+    height: int,
+    fps: int,
+    seconds: float,
+    audio: bool,
+    seed: int = 0,
+):
+    command = [get_setting("FFMPEG_BINARY"), "-y", "-hide_banner", "-loglevel", "error"]
+    command += [
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc2=size={width}x{height}:rate={fps}:duration={seconds},hue=h={seed * 37}",
+    ]
+    if audio:
+        command += [
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency={220 + seed * 20}:sample_rate=48000:duration={seconds}",
+        ]
+    command += ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p"]
+    command += ["-c:a", "aac"] if audio else []
+    subprocess.run(command + [path + ".part.mp4"], check=True)
+    os.replace(path + ".part.mp4", path)
+
+
+class ClipServer:
+    # Serves a directory over HTTP on a free local port, standing in for Twitch's clip CDN
+    def __init__(self, directory: str):
+        handler = functools.partial(ClipHandler, directory=directory)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/{os.path.basename(path)}"
+
+
+class ClipHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class FakeResumableHandler(BaseHTTPRequestHandler):
+    # Enough of YouTube's resumable upload protocol to drive yt.resumable_upload
+    def do_POST(self):
+        self.server.received = 0
+        self.send_response(200)
+        self.send_header("Location", f"http://127.0.0.1:{self.server.server_port}/s")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self):
+        length = int(self.headers.get("Content-Length", 0))
+        while length:
+            length -= len(self.rfile.read(min(length, constants.DOWNLOAD_CHUNK_SIZE)))
+        content_range = self.headers["Content-Range"]
+        if match := re.match(r"bytes (\d+)-(\d+)/", content_range):
+            self.server.received = int(match[2]) + 1
+        total = content_range.rsplit("/", 1)[-1]
+
+        if total != "*" and self.server.received == int(total):
+            content = json.dumps({"id": "benchmark"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_response(308)
+            self.send_header("Range", f"bytes=0-{self.server.received - 1}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(function, *args) -> tuple:
+    # Returns the function's result and its wall time, peak memory and peak ffmpeg processes
+    start = time.perf_counter()
+    with utils.ResourceMonitor() as monitor:
+        result = function(*args)
+    return result, {
+        "wall_seconds": time.perf_counter() - start,
+        "peak_rss_mb": monitor.peak_rss / 1024**2,
+        "peak_ffmpeg_processes": monitor.peak_ffmpeg_processes,
+    }
+
+
+def bench_download(urls: list[str], slugs: list[str], workers: int) -> dict:
+    # Always from an empty clip cache, so every clip is fetched over HTTP
+    shutil.rmtree(constants.CLIP_CACHE_DIR, ignore_errors=True)
+    _, metrics = measure(
+        utils.download_clips, urls, workers, slugs, constants.CLIP_CACHE_SIZE
+    )
+    total_bytes = sum(
+        os.path.getsize(clip) for clip in utils.list_clips(constants.TMP_DIR)
+    )
+    return {
+        **metrics,
+        "clips_per_second": len(urls) / metrics["wall_seconds"],
+        "mb_per_second": total_bytes / 1e6 / metrics["wall_seconds"],
+    }
+
+
+def bench_render(
+    mode: str,
+    urls: list[str],
+    slugs: list[str],
+    names: list[str],
+    workers: int,
+    cpus: int,
+    output: str,
+    profile: str = None,
+) -> dict:
+    if mode == "overlap":
+        # Downloads and renders together, so both caches start out empty
+        shutil.rmtree(constants.CLIP_CACHE_DIR, ignore_errors=True)
+        shutil.rmtree(constants.SEGMENT_CACHE_DIR, ignore_errors=True)
+        _, metrics = measure(
+            pipeline.download_and_render,
+            urls,
+            slugs,
+            names,
+            workers,
+            None,
+            constants.CLIP_CACHE_SIZE,
+            cpus,
+            None,
+            output,
+            profile,
+        )
+    else:
+        # Clips come from the clip cache, so only rendering is timed
+        utils.download_clips(urls, workers, slugs)
+        if mode == "moviepy":
+            _, metrics = measure(
+                utils.concatenate_clips, names, False, cpus, None, output, profile
+            )
+        elif mode == "moviepy-streaming":
+            _, metrics = measure(
+                utils.concatenate_clips, names, True, cpus, None, output, profile
+            )
+        elif mode == "ffmpeg":
+            _, metrics = measure(
+                render.concatenate_clips, names, cpus, None, output, profile
+            )
+        else:
+            if mode == "segments":
+                shutil.rmtree(constants.SEGMENT_CACHE_DIR, ignore_errors=True)
+            else:
+                # Warm the segment cache, then time a re-render
+                render.normalize_and_concatenate_clips(
+                    names,
+                    None,
+                    slugs,
+                    constants.SEGMENT_CACHE_SIZE,
+                    cpus,
+                    None,
+                    output,
+                    profile,
+                )
+            _, metrics = measure(
+                render.normalize_and_concatenate_clips,
+                names,
+                None,
+                slugs,
+                constants.SEGMENT_CACHE_SIZE,
+                cpus,
+                None,
+                output,
+                profile,
+            )
+
+    video_seconds = ffmpeg_parse_infos(output)["duration"]
+    return {
+        **metrics,
+        "clips_per_second": len(urls) / metrics["wall_seconds"],
+        "video_seconds_per_second": video_seconds / metrics["wall_seconds"],
+    }
+
+
+def bench_upload(video: str, chunk_size: int = constants.UPLOAD_CHUNK_SIZE) -> dict:
+    # Chunked resumable upload to a local endpoint, so this measures our side of the upload
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeResumableHandler)
+    server.received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    request = HttpRequest(
+        build_http(),
+        lambda resp, content: json.loads(content),
+        f"http://127.0.0.1:{server.server_port}/upload",
+        method="POST",
+        body="{}",
+        headers={"content-type": "application/json"},
+        resumable=MediaFileUpload(video, chunksize=chunk_size, resumable=True),
+    )
+    try:
+        _, metrics = measure(yt.resumable_upload, request)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {
+        **metrics,
+        "mb_per_second": os.path.getsize(video) / 1e6 / metrics["wall_seconds"],
+    }
+
+
+def import_seconds(module: str) -> float:
+    # Time to import a module and everything it imports in a fresh interpreter, as reported
+    # by python -X importtime in lines like "import time: 453 | 74292 | numpy" (microseconds)
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=constants.SCRIPT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    for line in stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1e6
+    raise ValueError(f"python -X importtime didn't report importing {module}")
+
+
+def bench_startup(runs: int = 5) -> dict:
+    # Best of a few runs of each, so the first run's cold disk cache doesn't count
+    results = {
+        f"import:{module}": {
+            "seconds": min(import_seconds(module) for _ in range(runs))
+        }
+        for module in STARTUP_MODULES
+    }
+    command = [sys.executable, os.path.join(constants.SCRIPT_DIR, "main.py"), "-h"]
+    wall_seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, capture_output=True, check=True)
+        wall_seconds.append(time.perf_counter() - start)
+    results["startup:main -h"] = {"wall_seconds": min(wall_seconds)}
+    return results
+
+
+def save_results(entry: dict, path: str = None):
+    path = path or constants.BENCHMARK_RESULTS_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "at") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def previous_results(params: dict, path: str = None) -> dict | None:
+    # Most recent earlier run with the same parameters, since only those are comparable
+    path = path or constants.BENCHMARK_RESULTS_PATH
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["params"] == params:
+                previous = entry
+    return previous
+
+
+def compare(current: dict, previous: dict | None) -> list[str]:
+    lines = []
+    for name, metrics in current["results"].items():
+        old_metrics = (previous or {}).get("results", {}).get(name, {})
+        cells = []
+        for metric, value in metrics.items():
+            cell = (
+                f"{metric}={value:.2f}"
+                if isinstance(value, float)
+                else f"{metric}={value}"
+            )
+            if old := old_metrics.get(metric):
+                cell += f" ({(value - old) / old:+.0%})"
+            cells.append(cell)
+        lines.append(f"{name:<26} " + "  ".join(cells))
+    return lines
+
+
+def run(args):
+    if args.startup:
+        params = {"startup": True}
+        results = bench_startup()
+    else:
+        params, results = __bench_pipeline(args)
+
+    entry = {
+        "started_at": datetime.datetime.now().isoformat(),
+        "commit": __git_commit(),
+        "machine": {
+            "cpus": os.cpu_count(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+        },
+        "params": params,
+        "results": results,
+    }
+    previous = previous_results(params)
+    save_results(entry)
+
+    print("\n".join(["", *compare(entry, previous), ""]))
+    if previous:
+        print(f"Compared with the run of {previous['started_at']}.")
+    print(f"Results appended to {constants.BENCHMARK_RESULTS_PATH}")
+    startup = results.get("startup:main -h", {}).get("wall_seconds", 0)
+    if startup > constants.STARTUP_TARGET:
+        print(
+            f"main.py -h took {startup:.2f}s, over the "
+            f"{constants.STARTUP_TARGET:g}s target. See which imports are slow with "
+            "python -X importtime main.py -h"
+        )
+
+
+def __bench_pipeline(args) -> tuple[dict, dict]:
+    # Everything happens in a scratch directory, leaving the real caches alone
+    work_dir = os.path.join(constants.BENCHMARK_DIR, "work")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    constants.TMP_DIR = os.path.join(work_dir, "tmp")
+    constants.CLIP_CACHE_DIR = os.path.join(work_dir, "clips")
+    constants.SEGMENT_CACHE_DIR = os.path.join(work_dir, "segments")
+    constants.OVERLAY_CACHE_DIR = os.path.join(work_dir, "overlays")
+    constants.PROBE_CACHE_PATH = os.path.join(work_dir, "probes.json")
+
+    print(f"Generating {args.clips} synthetic clips...")
+    clips = make_clips(args.clips)
+    slugs = [f"https://clips.twitch.tv/Benchmark{i}" for i in range(len(clips))]
+    names = [f"streamer{i}" for i in range(len(clips))]
+
+    params = {
+        "clips": args.clips,
+        "workers": args.workers,
+        "cpus": args.cpus,
+        "modes": args.modes,
+        "profile": args.profile,
+    }
+    results = {}
+    with ClipServer(os.path.dirname(clips[0])) as server:
+        urls = [server.url(clip) for clip in clips]
+
+        results["download"] = bench_download(urls, slugs, args.workers)
+        output = None
+        for mode in args.modes:
+            output = os.path.join(work_dir, f"{mode}.mp4")
+            results[f"render:{mode}"] = bench_render(
+                mode, urls, slugs, names, args.workers, args.cpus, output, args.profile
+            )
+    if output and not args.skip_upload:
+        results["upload"] = bench_upload(output)
+    return params, results
+
+
+def __git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=constants.SCRIPT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark downloading, rendering and uploading with synthetic clips, offline"
+    )
+    parser.add_argument(
+        "-n",
+        "--clips",
+        help="Number of synthetic clips (default: 8)",
+        type=int,
+        default=8,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help=f"Concurrent downloads (default: {constants.DOWNLOAD_WORKERS})",
+        type=int,
+        default=constants.DOWNLOAD_WORKERS,
+    )
+    parser.add_argument(
+        "--cpus",
+        help="CPUs given to each render (default: number of CPUs)",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "-m",
+        "--modes",
+        help="Render modes to benchmark (default: all)",
+        nargs="+",
+        choices=RENDER_MODES,
+        default=RENDER_MODES,
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        help=f"Render profile (default: {constants.DEFAULT_RENDER_PROFILE})",
+        choices=constants.RENDER_PROFILES,
+        default=constants.DEFAULT_RENDER_PROFILE,
+    )
+    parser.add_argument(
+        "--skip-upload", help="Don't benchmark the upload", action="store_true"
+    )
+    parser.add_argument(
+        "--startup",
+        help="Only benchmark how long modules take to import and main.py takes to start",
+        action="store_true",
+    )
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import datetime
+import json
+import os
+import threading
+
+import clip_cache
+import constants
+import files
+
+# Stages of a job in the order they complete
+STAGES = ["discover", "download", "render", "upload", "publish"]
+
+
+class Checkpoint:
+    # The jobs of one run and how far each got, saved after every completed stage so a run
+    # that died can be resumed without redoing finished work or asking Twitch for clips again
+    def __init__(self, run_id: str, jobs: list[dict], options: dict = None):
+        self.run_id = run_id
+        self.jobs = jobs
+        self.options = options or {}
+        self.finished = False
+        self.__lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return checkpoint_path(self.run_id)
+
+    def completed(self, job: dict, stage: str) -> bool:
+        return stage in job.get("completed", [])
+
+    def complete(self, job: dict, stage: str, **fields):
+        job.update(fields)
+        if not self.completed(job, stage):
+            job.setdefault("completed", []).append(stage)
+        self.save()
+
+    def finish(self):
+        self.finished = True
+        self.save()
+
+    def save(self):
+        with self.__lock:
+            os.makedirs(constants.CHECKPOINT_DIR, exist_ok=True)
+            files.write_json(
+                {
+                    "run_id": self.run_id,
+                    "updated_at": datetime.datetime.now().isoformat(),
+                    "finished": self.finished,
+                    "options": self.options,
+                    "jobs": self.jobs,
+                },
+                self.path,
+                indent=2,
+            )
+
+
+def checkpoint_path(run_id: str) -> str:
+    return os.path.join(constants.CHECKPOINT_DIR, f"{run_id}.json")
+
+
+def load(run_id: str) -> Checkpoint:
+    with open(checkpoint_path(run_id), "r") as f:
+        data = json.load(f)
+    checkpoint = Checkpoint(data["run_id"], data["jobs"], data["options"])
+    checkpoint.finished = data["finished"]
+    return checkpoint
+
+
+def video_matches(job: dict) -> bool:
+    # Whether the job's rendered video is still on disk, unchanged since it was rendered
+    output = job["output"]
+    return (
+        os.path.exists(output)
+        and os.path.getsize(output) == job.get("video_size")
+        and clip_cache.file_digest(output) == job.get("video_sha256")
+    )
@@ -0,0 +1,227 @@
+import contextlib
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows; downloads are then only shared within one process
+    fcntl = None
+
+import requests
+
+import constants
+import instrument
+import probe
+
+# Jobs running side by side share the cache, so each clip is downloaded by one thread at a time
+# path: [lock, number of threads holding or waiting for it]
+__path_locks = {}
+__path_locks_lock = threading.Lock()
+
+
+def clip_key(slug: str) -> str:
+    # Public clip URLs end in the clip's slug and download URLs end in its ID, either is unique
+    name = os.path.basename(urlparse(slug).path.rstrip("/"))
+    if name.endswith(".mp4"):
+        name = name[: -len(".mp4")]
+    return re.sub(r"[^\w-]", "_", name)
+
+
+def cached_clip_path(key: str, cache_dir: str = None) -> str:
+    return os.path.join(cache_dir or constants.CLIP_CACHE_DIR, f"{key}.mp4")
+
+
+def fetch_clip(
+    session: requests.Session, url: str, key: str, cache_dir: str = None
+) -> tuple[str | None, int]:
+    # Returns the cached clip's path (None if it couldn't be fetched) and the number of bytes downloaded
+    with instrument.span("download_clip", clip=key) as span:
+        clip_path, span["bytes"] = __fetch_clip(session, url, key, cache_dir)
+        span["ok"] = clip_path is not None
+    return clip_path, span["bytes"]
+
+
+def __fetch_clip(
+    session: requests.Session, url: str, key: str, cache_dir: str
+) -> tuple[str | None, int]:
+    # A thread or process waiting on another's download of the same clip then finds it cached
+    clip_path = cached_clip_path(key, cache_dir)
+    if __cache_hit(clip_path):
+        return clip_path, 0
+    with __path_lock(clip_path), __locked_part(clip_path + ".part") as part:
+        return __download_clip(session, url, clip_path, part)
+
+
+def __cache_hit(clip_path: str) -> bool:
+    if os.path.exists(clip_path):
+        # Touch the clip so it's treated as recently used
+        os.utime(clip_path)
+        return True
+    return False
+
+
+@contextlib.contextmanager
+def __path_lock(path: str):
+    # Locks are dropped once no thread wants them, so there's never more than one per download
+    with __path_locks_lock:
+        entry = __path_locks.setdefault(path, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with __path_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del __path_locks[path]
+
+
+@contextlib.contextmanager
+def __locked_part(part_path: str):
+    # Opens the partial download for appending under an exclusive lock, shared by every process
+    # using the cache. The holder may rename or remove the file before letting go, so the lock
+    # only counts once it's on the file that's at part_path
+    while True:
+        part = open(part_path, "ab", buffering=constants.DOWNLOAD_CHUNK_SIZE)
+        if not fcntl:
+            break
+        fcntl.flock(part, fcntl.LOCK_EX)
+        try:
+            if os.path.samestat(os.fstat(part.fileno()), os.stat(part_path)):
+                break
+        except FileNotFoundError:
+            pass
+        part.close()
+    with part:  # Closing the file releases the lock
+        yield part
+
+
+def __download_clip(
+    session: requests.Session, url: str, clip_path: str, part
+) -> tuple[str | None, int]:
+    if __cache_hit(clip_path):
+        # Downloaded while this waited for the lock; the part file left here is empty
+        os.remove(part.name)
+        return clip_path, 0
+
+    # Resume from a partial download left behind by an earlier run
+    part_path = part.name
+    offset = os.fstat(part.fileno()).st_size
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    written = 0
+    try:
+        response = session.get(url, headers=headers, stream=True, timeout=5)
+        if response.status_code == 416:
+            # Nothing left to download; the partial file is already complete
+            expected_size = __total_size(response)
+        else:
+            response.raise_for_status()
+            if response.status_code != 206:
+                # Server ignored the Range header, so start over
+                offset = 0
+                part.truncate(0)
+            expected_size = __total_size(response, offset)
+            for chunk in response.iter_content(
+                chunk_size=constants.DOWNLOAD_CHUNK_SIZE
+            ):
+                if chunk:
+                    written += part.write(chunk)
+            part.flush()
+    except requests.exceptions.HTTPError as err:
+        print(f"{url} returned HTTP Error")
+        print(err.args[0])
+        return None, written
+    except requests.exceptions.Timeout:
+        print(f"{url} timed out")
+        return None, written
+    except requests.exceptions.ConnectionError:
+        print(f"Error connecting to {url}")
+        return None, written
+    except requests.exceptions.RequestException:
+        print(f"{url} caused a catastrophic error")
+        return None, written
+
+    if not verify_clip(part_path, expected_size):
+        print(f"{url} failed integrity check")
+        os.remove(part_path)
+        return None, written
+
+    # Only verified clips ever get their final name
+    os.replace(part_path, clip_path)
+    return clip_path, written
+
+
+def __total_size(response: requests.Response, offset: int = 0) -> int | None:
+    # Content-Range looks like "bytes 100-199/200" (206) or "bytes */200" (416)
+    if content_range := response.headers.get("Content-Range"):
+        total = content_range.rsplit("/", 1)[-1]
+        return int(total) if total.isdigit() else None
+    if content_length := response.headers.get("Content-Length"):
+        return offset + int(content_length)
+    return None
+
+
+def verify_clip(clip_path: str, expected_size: int | None = None) -> bool:
+    if expected_size is not None and os.path.getsize(clip_path) != expected_size:
+        return False
+    return probe_duration(clip_path) > 0
+
+
+def probe_duration(clip_path: str) -> float:
+    try:
+        return probe.probe(clip_path)["duration"] or 0
+    except (IOError, KeyError):
+        return 0
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(constants.DOWNLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_clip(clip_path: str, dst: str):
+    # Hard links are free and survive eviction of the cached copy; fall back to copying across devices
+    try:
+        os.link(clip_path, dst)
+    except OSError:
+        shutil.copyfile(clip_path, dst)
+
+
+def evict(max_bytes: int, keep=(), cache_dir: str = None) -> int:
+    # Delete least recently used files until the cache fits in max_bytes. Returns the number evicted.
+    cache_dir = cache_dir or constants.CLIP_CACHE_DIR
+    entries = []
+    for file in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, file)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue  # Renamed or evicted by another job meanwhile
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        if path.endswith(".part") and time.time() - mtime < constants.PART_FILE_TTL:
+            continue  # Probably still being written by another worker or process
+        probe.forget(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        evicted += 1
+    return evicted
@@ -5,6 +5,109 @@ TMP_DIR = os.path.join(SCRIPT_DIR, "tmp")
 TWITCH_SECRET_PATH = os.path.join(SCRIPT_DIR, "twitch_client_secret.json")
 YOUTUBE_SECRET_PATH = os.path.join(SCRIPT_DIR, "yt_client_secret.json")
 GAME_IDS_PATH = os.path.join(SCRIPT_DIR, "game_ids.json")
+PLAYLIST_IDS_PATH = os.path.join(SCRIPT_DIR, "playlist_ids.json")
+TAGS_PATH = os.path.join(SCRIPT_DIR, "tags.json")
+TWITCH_TOKEN_PATH = os.path.join(SCRIPT_DIR, "twitch_token.json")
+LOGO_PATH = os.path.join(SCRIPT_DIR, "twitch.jpg")
+CACHE_DIR = os.path.join(SCRIPT_DIR, "cache")
+CLIP_CACHE_DIR = os.path.join(CACHE_DIR, "clips")
+SEGMENT_CACHE_DIR = os.path.join(CACHE_DIR, "segments")
+OVERLAY_CACHE_DIR = os.path.join(CACHE_DIR, "overlays")
+PROBE_CACHE_PATH = os.path.join(CACHE_DIR, "probes.json")  # Stream info of seen videos
+PROBE_CACHE_ENTRIES = 10000  # Oldest probes are dropped beyond this
+REVIEW_DIR = os.path.join(CACHE_DIR, "review")  # Clips and previews awaiting review
+REPORT_DIR = os.path.join(SCRIPT_DIR, "reports")  # JSON timing report of every run
+CHECKPOINT_DIR = os.path.join(SCRIPT_DIR, "runs")  # Progress of every run, for --resume
+BENCHMARK_DIR = os.path.join(CACHE_DIR, "benchmark")  # Synthetic clips, scratch space
+BENCHMARK_RESULTS_PATH = os.path.join(REPORT_DIR, "benchmarks.jsonl")
+STARTUP_TARGET = 1.0  # Seconds main.py -h should take, with every module imported
+SPOOL_DIR = os.path.join(SCRIPT_DIR, "spool")  # Jobs queued for the daemon
+DAEMON_STATUS_PATH = os.path.join(SPOOL_DIR, "status.json")
 
 TWITCH_OAUTH_URL = "https://id.twitch.tv/oauth2/token"
 BASE_HELIX_URL = "https://api.twitch.tv/helix"
+HELIX_GAMES_PER_REQUEST = 100  # Most names Helix accepts in one /games request
+# Abbreviations people use for games, by normalized name (see twitch.normalize_game_name)
+GAME_ALIASES = {
+    "csgo": "Counter-Strike: Global Offensive",
+    "cs go": "Counter-Strike: Global Offensive",
+    "cs2": "Counter-Strike",
+    "gta": "Grand Theft Auto V",
+    "gta v": "Grand Theft Auto V",
+    "gta 5": "Grand Theft Auto V",
+    "gta5": "Grand Theft Auto V",
+    "lol": "League of Legends",
+    "wow": "World of Warcraft",
+    "pubg": "PUBG: BATTLEGROUNDS",
+    "r6": "Tom Clancy's Rainbow Six Siege",
+    "r6s": "Tom Clancy's Rainbow Six Siege",
+    "rainbow six siege": "Tom Clancy's Rainbow Six Siege",
+    "apex": "Apex Legends",
+    "dota": "Dota 2",
+    "ow2": "Overwatch 2",
+    "tft": "Teamfight Tactics",
+    "mc": "Minecraft",
+}
+# Seconds before expiry that a cached OAuth token is replaced
+TWITCH_TOKEN_MARGIN = 60 * 60
+
+# Bytes per YouTube upload request, a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 32 * 1024**2
+STREAM_UPLOAD_POLL = 0.5  # Seconds between checks for newly encoded bytes to upload
+YOUTUBE_PROCESSING_TIMEOUT = 15 * 60  # Seconds to wait for YouTube to process an upload
+
+DOWNLOAD_WORKERS = 8  # Concurrent clip downloads
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes per read/write while downloading
+CLIP_CACHE_SIZE = 5 * 1024**3  # Bytes of downloaded clips to keep between runs
+SEGMENT_CACHE_SIZE = 5 * 1024**3  # Bytes of normalized segments to keep between runs
+PART_FILE_TTL = 60 * 60  # Seconds before an unfinished cache file may be evicted
+OVERLAY_CACHE_SIZE = 50 * 1024**2  # Bytes of rendered overlays to keep between runs
+REVIEW_PREFETCH = 8  # Clips downloaded and previewed ahead of the one being reviewed
+REVIEW_PROXY_HEIGHT = 360  # Height of low resolution review previews
+REVIEW_SHEET_TILES = (4, 3)  # Columns, rows of frames in review contact sheets
+# Fraction of the shorter clip two clips must share to count as duplicates
+DEDUP_MIN_OVERLAP = 0.5
+DEDUP_SAMPLE_FPS = 2  # Frames per second hashed when comparing clips' footage
+DEDUP_HASH_DISTANCE = 10  # Most bits two frame hashes (of 64) may differ by to match
+DAEMON_POLL = 1  # Seconds between the daemon's checks for new jobs
+# The daemon's report keeps the latest spans and resource samples (an hour of them), not all
+DAEMON_MAX_SPANS = 10000
+DAEMON_MAX_SAMPLES = 36000
+DAEMON_JOB_HISTORY = (
+    100  # Latest jobs whose run times the daemon's mean job time covers
+)
+# Seconds that changes to game_ids.json etc. are batched before writing
+STORE_FLUSH_DELAY = 2
+
+VIDEO_RESOLUTION = (1920, 1080)  # Width, height of the final video
+AUDIO_FPS = 44100  # Audio sample rate of the final video
+# Frame rate when rendering overlaps downloads, since not every clip has been probed yet
+PIPELINE_FPS = 60
+PIPELINE_POLL = (
+    0.1  # Seconds between a finished download's checks that rendering hasn't failed
+)
+# x264 preset, constant rate factor, keyframe interval (frames) and AAC bitrate of each
+# render profile. Lower CRF is higher quality; slower presets compress better
+RENDER_PROFILES = {
+    "draft": {"preset": "ultrafast", "crf": 30, "gop": 250, "audio_bitrate": "96k"},
+    "standard": {"preset": "medium", "crf": 23, "gop": 250, "audio_bitrate": "160k"},
+    "archive": {"preset": "slow", "crf": 17, "gop": 120, "audio_bitrate": "320k"},
+}
+DEFAULT_RENDER_PROFILE = "standard"
+# Guesses for --plan estimates: bits per second of a downloaded clip, and seconds of video each
+# profile renders per second until ./benchmark.py has measured it
+PLAN_CLIP_BITRATE = 6_000_000
+PLAN_ENCODE_SPEED = {"draft": 3.0, "standard": 1.0, "archive": 0.3}
+# Choosing clips for a --duration stops once the video is this many seconds from full,
+# or this many clips in a row (a Helix page) didn't fit
+SELECTION_SLACK = 15
+SELECTION_PATIENCE = 100
+LOGO_SCALE = 0.15  # Size of the Twitch logo relative to twitch.jpg
+BADGE_FONTS = [
+    "Helvetica-Bold",
+    "Helvetica-Bold.ttf",
+    "Arial Bold.ttf",
+    "arialbd.ttf",
+    "DejaVuSans-Bold.ttf",
+]
+BADGE_FONT_SIZE = 50
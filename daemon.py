@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import secrets
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+import constants
+import files
+import instrument
+import jobs
+import twitch
+import utils
+
+# A job file moves from queue to running, then to done or failed
+STATES = ["queue", "running", "done", "failed"]
+
+
+def spool_path(state: str, job_id: str = None) -> str:
+    directory = os.path.join(constants.SPOOL_DIR, state)
+    return os.path.join(directory, f"{job_id}.json") if job_id else directory
+
+
+def submit(entry: dict) -> str:
+    # Queues a job, given as a manifest entry (a game and any options to override), and returns its ID
+    # It's validated now so mistakes show up when submitting, not in the daemon's output
+    options = {key: value for key, value in entry.items() if key != "game"}
+    jobs.prepare_batch([jobs.make_job(entry["game"], options)])
+
+    job_id = f"{datetime.datetime.now():%Y%m%d-%H%M%S-%f}-{secrets.token_hex(2)}"
+    os.makedirs(spool_path("queue"), exist_ok=True)
+    files.write_json(
+        {
+            "id": job_id,
+            "entry": entry,
+            "submitted_at": datetime.datetime.now().isoformat(),
+        },
+        spool_path("queue", job_id),
+        indent=2,
+    )
+    return job_id
+
+
+class Daemon:
+    # Runs queued jobs as they arrive, reusing one Twitch client, one YouTube service and the
+    # in-memory overlay cache for every job instead of paying for them on each run
+    def __init__(
+        self,
+        client: twitch.HelixClient,
+        concurrency: int = 2,
+        cpu_budget: int = None,
+        poll: float = constants.DAEMON_POLL,
+    ):
+        self.client = client
+        self.concurrency = concurrency
+        self.cpus = max(1, (cpu_budget or psutil.cpu_count()) // concurrency)
+        self.poll = poll
+        self.uploads = jobs.Uploads()
+        self.running = {}  # job ID: job
+        self.counts = {"done": 0, "failed": 0}
+        self.job_seconds = collections.deque(maxlen=constants.DAEMON_JOB_HISTORY)
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__started = time.time()
+
+        for state in STATES:
+            os.makedirs(spool_path(state), exist_ok=True)
+        # Jobs that were running when the daemon last stopped start over
+        for file in os.listdir(spool_path("running")):
+            os.replace(
+                os.path.join(spool_path("running"), file),
+                os.path.join(spool_path("queue"), file),
+            )
+
+    def serve(self):
+        print(f"Waiting for jobs in {spool_path('queue')}...")
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            while not self.__stop.is_set():
+                for job_id in self.__claim(self.concurrency - len(self.running)):
+                    executor.submit(self.__run, job_id)
+                self.write_status()
+                self.__stop.wait(self.poll)
+            if self.running:
+                print(f"Stopping after {len(self.running)} running jobs finish...")
+        self.write_status()
+
+    def stop(self, *_):
+        self.__stop.set()
+
+    def status(self) -> dict:
+        now = time.time()
+        with self.__lock:
+            running = [
+                {
+                    "id": job_id,
+                    "game": job["game"],
+                    "stage": job.get("stage"),
+                    "clips": len(job.get("clips") or []),
+                    "running_seconds": now - job["started_at"],
+                }
+                for job_id, job in self.running.items()
+            ]
+            job_seconds = list(self.job_seconds)
+        return {
+            "pid": os.getpid(),
+            "updated_at": datetime.datetime.now().isoformat(),
+            "uptime_seconds": now - self.__started,
+            "concurrency": self.concurrency,
+            "queued": len(job_files("queue")),
+            "running": running,
+            **self.counts,
+            "mean_job_seconds": (
+                sum(job_seconds) / len(job_seconds) if job_seconds else None
+            ),
+        }
+
+    def write_status(self):
+        files.write_json(self.status(), constants.DAEMON_STATUS_PATH, indent=2)
+
+    def __claim(self, slots: int) -> list[str]:
+        # Oldest jobs first. Moving a job file is atomic, so no job is ever claimed twice
+        claimed = []
+        for file in job_files("queue")[: max(0, slots)]:
+            job_id = file[: -len(".json")]
+            try:
+                os.replace(spool_path("queue", job_id), spool_path("running", job_id))
+            except FileNotFoundError:
+                continue  # Claimed by another daemon
+            try:
+                record = read_record(spool_path("running", job_id))
+            except ValueError as err:
+                # Left in the queue, a broken file would stop the daemon on every start
+                print(f"{file} failed: {err}")
+                os.replace(spool_path("running", job_id), spool_path("failed", job_id))
+                with self.__lock:
+                    self.counts["failed"] += 1
+                continue
+            with self.__lock:
+                self.running[job_id] = {
+                    "game": record["entry"]["game"],
+                    "stage": "starting",
+                    "started_at": time.time(),
+                }
+            claimed.append(job_id)
+        return claimed
+
+    def __run(self, job_id: str):
+        path = spool_path("running", job_id)
+        job = self.running[job_id]
+        started_at = job["started_at"]
+        record = {"id": job_id}
+        try:
+            record = read_record(path)
+            entry = dict(record["entry"])
+            job = jobs.make_job(entry.pop("game"), entry)
+            job["started_at"] = started_at
+            with self.__lock:
+                self.running[job_id] = job
+
+            jobs.prepare_batch([job])
+            # Jobs of the same game can run side by side, so files are named after the job
+            job["tmp_dir"] = os.path.join(constants.TMP_DIR, job_id)
+            job["output"] = f"final_{job_id}.mp4"
+
+            job["stage"] = "discovering"
+            job["game_id"] = twitch.get_game_id(job["game"], self.client)
+            jobs.discover(job, self.client)
+            if not job["clips"]:
+                raise ValueError(f'No clips found for {job["game"]}.')
+
+            jobs.produce_and_publish(job, self.cpus, self.uploads)
+            state = "done"
+        except Exception as err:
+            print(f'{job["game"]} failed: {err!r}')
+            state, record["error"] = "failed", repr(err)
+
+        finished_at = time.time()
+        record.update(
+            {
+                "stage": job.get("stage"),
+                "clips": len(job.get("clips") or []),
+                "started_at": datetime.datetime.fromtimestamp(started_at).isoformat(),
+                "finished_at": datetime.datetime.fromtimestamp(finished_at).isoformat(),
+            }
+        )
+        try:
+            files.write_json(record, spool_path(state, job_id), indent=2)
+            os.remove(path)
+        finally:
+            # The job's slot is freed even if its file couldn't be moved
+            with self.__lock:
+                del self.running[job_id]
+                self.counts[state] += 1
+                self.job_seconds.append(finished_at - started_at)
+
+
+def read_record(path: str) -> dict:
+    # A job file from the spool, checked to have the manifest entry the daemon runs
+    try:
+        record = utils.read_json(path)
+    except json.JSONDecodeError as err:
+        raise ValueError(f"Invalid job file: {err}")
+    if not (
+        isinstance(record, dict)
+        and isinstance(record.get("entry"), dict)
+        and isinstance(record["entry"].get("game"), str)
+    ):
+        raise ValueError("Invalid job file: expected an entry with a game")
+    return record
+
+
+def job_files(state: str) -> list[str]:
+    # Job IDs start with their submission time, so sorting them puts the oldest first
+    try:
+        files = os.listdir(spool_path(state))
+    except FileNotFoundError:
+        return []
+    return sorted(file for file in files if file.endswith(".json"))
+
+
+def print_status():
+    try:
+        status = utils.read_json(constants.DAEMON_STATUS_PATH)
+    except FileNotFoundError:
+        print("The daemon hasn't run yet.")
+        return
+    state = "running" if psutil.pid_exists(status["pid"]) else "not running"
+    mean = status["mean_job_seconds"]
+    print(
+        f"Daemon {status['pid']} ({state}), up {datetime.timedelta(seconds=round(status['uptime_seconds']))}, "
+        f"last update {status['updated_at']}\n"
+        f"Queued: {status['queued']}  Running: {len(status['running'])}  "
+        f"Done: {status['done']}  Failed: {status['failed']}  "
+        f"Mean job time: {f'{mean:.0f}s' if mean is not None else '-'}"
+    )
+    for job in status["running"]:
+        print(
+            f"  {job['id']}  {job['game']}: {job['stage']}, {job['clips']} clips, "
+            f"{job['running_seconds']:.0f}s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run compilation jobs in the background as they're queued"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Run queued jobs until stopped")
+    serve.add_argument(
+        "-j",
+        "--concurrency",
+        help="Number of jobs run at the same time (default: 2)",
+        type=int,
+        default=2,
+    )
+    serve.add_argument(
+        "--cpu-budget",
+        help="Number of CPUs shared by all running jobs (default: number of CPUs)",
+        type=int,
+        default=os.cpu_count(),
+    )
+
+    queue = commands.add_parser("submit", help="Queue compilation jobs")
+    queue.add_argument("game", help="Game names", type=str, nargs="*")
+    queue.add_argument(
+        "-b",
+        "--batch",
+        help="JSON manifest of jobs, like main.py's --batch",
+        type=str,
+    )
+    queue.add_argument(
+        "-o",
+        "--options",
+        help='JSON object of options for every job, like \'{"num_clips": 20, "youtube": true}\'',
+        type=json.loads,
+        default={},
+    )
+
+    commands.add_parser("status", help="Show queued and running jobs")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print_status()
+    elif args.command == "submit":
+        entries = [{"game": game} for game in args.game]
+        if args.batch:
+            try:
+                entries += jobs.read_manifest(args.batch)
+            except ValueError as err:
+                parser.error(str(err))
+        if not entries:
+            parser.error("give at least one game or a --batch manifest")
+        for entry in entries:
+            try:
+                job_id = submit({**args.options, **entry})
+            except ValueError as err:
+                parser.error(str(err))
+            print(f'Queued {entry["game"]} as {job_id}.')
+    else:
+        twitch_secret = utils.read_json(constants.TWITCH_SECRET_PATH)
+        with twitch.HelixClient(twitch_secret) as client, instrument.recording(
+            f"daemon-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}",
+            {"concurrency": args.concurrency, "cpu_budget": args.cpu_budget},
+            max_spans=constants.DAEMON_MAX_SPANS,
+            max_samples=constants.DAEMON_MAX_SAMPLES,
+        ) as recorder:
+            daemon = Daemon(client, args.concurrency, args.cpu_budget)
+            # Finish the running jobs before exiting; unstarted ones stay queued
+            signal.signal(signal.SIGINT, daemon.stop)
+            signal.signal(signal.SIGTERM, daemon.stop)
+            daemon.serve()
+        print(f"Run report saved to {recorder.write_report()}")
+
+
+if __name__ == "__main__":
+    main()
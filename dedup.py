@@ -0,0 +1,99 @@
+import datetime
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+import constants
+import instrument
+import utils
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def is_duplicate(data: dict, kept: list[dict]) -> bool:
+    # Whether a clip, as returned by Helix, shows mostly the same moment as a clip already kept
+    return any(__same_moment(data, other) for other in kept)
+
+
+def __same_moment(a: dict, b: dict) -> bool:
+    if a.get("id") and a["id"] == b.get("id"):
+        return True
+    if not a.get("broadcaster_id") or a["broadcaster_id"] != b.get("broadcaster_id"):
+        return False
+    if a.get("video_id") and a["video_id"] == b.get("video_id"):
+        if a.get("vod_offset") is not None and b.get("vod_offset") is not None:
+            return __overlaps(a["vod_offset"], a, b["vod_offset"], b)
+    if not a.get("created_at") or not b.get("created_at"):
+        return False
+    # Without a VOD to place them in, a clip covers the seconds before it was created
+    return __overlaps(
+        __created_at(a) - a["duration"], a, __created_at(b) - b["duration"], b
+    )
+
+
+def __overlaps(start_a: float, a: dict, start_b: float, b: dict) -> bool:
+    overlap = min(start_a + a["duration"], start_b + b["duration"]) - max(
+        start_a, start_b
+    )
+    return overlap >= constants.DEDUP_MIN_OVERLAP * min(a["duration"], b["duration"])
+
+
+def __created_at(data: dict) -> float:
+    # Helix times look like 2023-01-01T12:00:00Z
+    return datetime.datetime.fromisoformat(
+        data["created_at"].replace("Z", "+00:00")
+    ).timestamp()
+
+
+def frame_hashes(clip_path: str) -> "np.ndarray":
+    # Difference hash of a few frames per second: 64 bits per frame saying whether each pixel of a
+    # 9x8 grayscale thumbnail is brighter than its right neighbour
+    import numpy as np
+
+    command = [
+        utils.ffmpeg_binary(),
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        clip_path,
+        "-vf",
+        f"fps={constants.DEDUP_SAMPLE_FPS},scale=9:8:flags=area,format=gray",
+        "-f",
+        "rawvideo",
+        "pipe:1",
+    ]
+    raw = subprocess.run(command, check=True, capture_output=True).stdout
+    frames = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 8, 9)
+    return (frames[:, :, 1:] > frames[:, :, :-1]).reshape(len(frames), 64)
+
+
+def footage_overlap(a: "np.ndarray", b: "np.ndarray") -> float:
+    # Fraction of the shorter clip's sampled frames that closely match some frame of the other
+    if not len(a) or not len(b):
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    distances = (a[:, None, :] != b[None, :, :]).sum(axis=2)
+    return float((distances.min(axis=1) <= constants.DEDUP_HASH_DISTANCE).mean())
+
+
+def duplicate_footage(clip_paths: list[str], groups: list = None) -> list[int]:
+    # Positions of clips whose footage mostly repeats an earlier clip's. Only clips in the same
+    # group (like the same broadcaster) are compared, so similar looking scenes aren't merged
+    groups = groups or [None] * len(clip_paths)
+    with instrument.span("frame_hashes", clips=len(clip_paths)):
+        with ThreadPoolExecutor() as executor:
+            hashes = list(executor.map(frame_hashes, clip_paths))
+
+    duplicates = []
+    for j in range(len(hashes)):
+        if any(
+            groups[k] == groups[j]
+            and footage_overlap(hashes[j], hashes[k]) >= constants.DEDUP_MIN_OVERLAP
+            for k in range(j)
+            if k not in duplicates
+        ):
+            duplicates.append(j)
+    return duplicates
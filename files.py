@@ -0,0 +1,27 @@
+import contextlib
+import json
+import os
+import threading
+
+# Only the standard library is imported here, so any module can write its files with these
+
+
+def write_json(json_dict, filename, indent: int = None):
+    with atomic_write(filename) as f:
+        json.dump(json_dict, f, indent=indent)
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "wt"):
+    # Written to a temporary file that replaces path once it's complete, so a reader or a crash
+    # never sees half a file. The name is unique to the thread, so concurrent writers don't clash
+    part = f"{path}.{os.getpid()}-{threading.get_ident()}.part"
+    try:
+        with open(part, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(part, path)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
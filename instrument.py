@@ -0,0 +1,216 @@
+import bisect
+import collections
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+
+import psutil
+
+import constants
+import utils
+
+
+class Recorder:
+    # Collects timed spans and resource samples for one run of the program
+    # A long-running process can keep only the latest max_spans spans and max_samples samples
+    def __init__(
+        self,
+        run_id: str = None,
+        options: dict = None,
+        max_spans: int = None,
+        max_samples: int = None,
+    ):
+        self.run_id = run_id or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.options = options or {}
+        self.spans = collections.deque(maxlen=max_spans)
+        self.monitor = utils.ResourceMonitor(max_samples=max_samples)
+        self.__lock = threading.Lock()
+        self.__start = time.time()
+        self.__end = None
+        self.__start_cpu_times = psutil.Process().cpu_times()
+        self.__end_cpu_times = None
+
+    def record(self, name: str, start: float, end: float, **attrs):
+        with self.__lock:
+            self.spans.append(
+                {
+                    "name": name,
+                    "start": start,
+                    "end": end,
+                    "thread": threading.get_ident(),
+                    **attrs,
+                }
+            )
+
+    def finish(self):
+        self.__end = time.time()
+        self.__end_cpu_times = psutil.Process().cpu_times()
+
+    def report(self) -> dict:
+        spans = []
+        stages = {}
+        # Samples are taken in time order, so each span's samples are found by bisection
+        all_samples = list(self.monitor.samples)
+        sample_times = [sample[0] for sample in all_samples]
+        for span in sorted(self.spans, key=lambda span: span["start"]):
+            # Per-span peaks come from the resource samples taken while the span was open
+            first = bisect.bisect_left(sample_times, span["start"])
+            last = bisect.bisect_right(sample_times, span["end"])
+            samples = all_samples[first:last]
+            entry = {
+                **{
+                    key: value
+                    for key, value in span.items()
+                    if key not in {"start", "end", "thread"}
+                },
+                "start_seconds": span["start"] - self.__start,
+                "wall_seconds": span["end"] - span["start"],
+                "peak_rss_bytes": max((rss for _, rss, _ in samples), default=None),
+                "peak_ffmpeg_processes": max(
+                    (ffmpeg for _, _, ffmpeg in samples), default=None
+                ),
+            }
+            spans.append(entry)
+
+            stage = stages.setdefault(
+                span["name"],
+                {
+                    "count": 0,
+                    "start": span["start"],
+                    "end": span["end"],
+                    # Summed over spans, so more than elapsed_seconds when they overlap
+                    "busy_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "child_cpu_seconds": 0.0,
+                    "bytes": 0,
+                    "peak_rss_bytes": None,
+                    "peak_ffmpeg_processes": None,
+                },
+            )
+            stage["count"] += 1
+            stage["end"] = max(stage["end"], span["end"])
+            stage["busy_seconds"] += entry["wall_seconds"]
+            for key in ["cpu_seconds", "child_cpu_seconds", "bytes"]:
+                stage[key] += entry.get(key, 0)
+            for key in ["peak_rss_bytes", "peak_ffmpeg_processes"]:
+                if entry[key] is not None:
+                    stage[key] = max(stage[key] or 0, entry[key])
+        for stage in stages.values():
+            stage["elapsed_seconds"] = stage.pop("end") - stage.pop("start")
+
+        end_cpu_times = self.__end_cpu_times or psutil.Process().cpu_times()
+        user, system, children_user, children_system = [
+            end - start
+            for start, end in zip(self.__start_cpu_times[:4], end_cpu_times[:4])
+        ]
+        return {
+            "run_id": self.run_id,
+            "started_at": datetime.datetime.fromtimestamp(self.__start).isoformat(),
+            "options": self.options,
+            "wall_seconds": (self.__end or time.time()) - self.__start,
+            "cpu_seconds": user + system,
+            "child_cpu_seconds": children_user + children_system,
+            "peak_rss_bytes": self.monitor.peak_rss,
+            "peak_ffmpeg_processes": self.monitor.peak_ffmpeg_processes,
+            "stages": stages,
+            "spans": spans,
+        }
+
+    def write_report(self, path: str = None) -> str:
+        path = path or os.path.join(constants.REPORT_DIR, f"{self.run_id}.json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wt") as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        return path
+
+    def write_trace(self, path: str):
+        # Chrome trace event format; open in chrome://tracing or https://ui.perfetto.dev
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = {
+                key: value
+                for key, value in span.items()
+                if key not in {"name", "start", "end", "thread"}
+            }
+            events.append(
+                {
+                    "name": span["name"],
+                    "ph": "X",
+                    "ts": (span["start"] - self.__start) * 1e6,
+                    "dur": (span["end"] - span["start"]) * 1e6,
+                    "pid": pid,
+                    "tid": span["thread"],
+                    "args": args,
+                }
+            )
+        for sample_time, rss, ffmpeg_processes in self.monitor.samples:
+            ts = (sample_time - self.__start) * 1e6
+            events.append(
+                {
+                    "name": "memory",
+                    "ph": "C",
+                    "ts": ts,
+                    "pid": pid,
+                    "args": {"rss_mb": rss / 1024**2},
+                }
+            )
+            events.append(
+                {
+                    "name": "ffmpeg",
+                    "ph": "C",
+                    "ts": ts,
+                    "pid": pid,
+                    "args": {"processes": ffmpeg_processes},
+                }
+            )
+        with open(path, "wt") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+__recorder = None
+
+
+@contextlib.contextmanager
+def recording(
+    run_id: str = None,
+    options: dict = None,
+    max_spans: int = None,
+    max_samples: int = None,
+):
+    # Spans anywhere in the program are recorded into the returned Recorder until the block exits
+    global __recorder
+    recorder = Recorder(run_id, options, max_spans, max_samples)
+    __recorder = recorder
+    try:
+        with recorder.monitor:
+            yield recorder
+    finally:
+        __recorder = None
+        recorder.finish()
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    # Times the block; the yielded dict can be given more attributes, like bytes transferred
+    # CPU time is the calling thread's. Child CPU time counts subprocesses (ffmpeg) reaped
+    # during the block, so it's approximate when blocks overlap
+    if __recorder is None:
+        yield attrs
+        return
+    recorder = __recorder
+    start, cpu, child_cpu = time.time(), time.thread_time(), __child_cpu()
+    try:
+        yield attrs
+    finally:
+        attrs["cpu_seconds"] = time.thread_time() - cpu
+        attrs["child_cpu_seconds"] = __child_cpu() - child_cpu
+        recorder.record(name, start, time.time(), **attrs)
+
+
+def __child_cpu() -> float:
+    times = os.times()
+    return times.children_user + times.children_system
@@ -0,0 +1,494 @@
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import checkpoints
+import clip_cache
+import constants
+import dedup
+import instrument
+import pipeline
+import plans
+import render
+import twitch
+import utils
+
+# Options every compilation job has, with the defaults used by main.py
+JOB_DEFAULTS = {
+    "num_clips": 0,
+    "duration": None,
+    "per_broadcaster": None,
+    "days_ago": 7,
+    "youtube": False,
+    "download_workers": constants.DOWNLOAD_WORKERS,
+    "cache_size": constants.CLIP_CACHE_SIZE,
+    "engine": "moviepy",
+    "streaming": False,
+    "overlap": False,
+    "render_workers": None,
+    "stream_upload": False,
+    "profile": constants.DEFAULT_RENDER_PROFILE,
+    "review": None,
+    "dedup": True,
+    "dedup_frames": False,
+}
+
+
+def make_job(game: str, options: dict = None) -> dict:
+    job = {**JOB_DEFAULTS, **(options or {}), "game": game}
+    job.setdefault("tmp_dir", constants.TMP_DIR)
+    job.setdefault("output", "final.mp4")
+    return job
+
+
+def load_manifest(path: str, options: dict = None) -> list[dict]:
+    jobs = []
+    for entry in read_manifest(path):
+        entry = dict(entry)
+        jobs.append(make_job(entry.pop("game"), {**(options or {}), **entry}))
+    return jobs
+
+
+def read_manifest(path: str) -> list[dict]:
+    # A manifest is a JSON list of games, each either a name or an object overriding the command line options
+    # It's the user's file, so a broken one is reported as a ValueError and left untouched
+    try:
+        manifest = utils.read_json(path)
+    except json.JSONDecodeError as err:
+        raise ValueError(f"Invalid manifest {path}: {err}")
+    if not isinstance(manifest, list):
+        raise ValueError(f"Invalid manifest {path}: expected a list of games")
+    entries = []
+    for entry in manifest:
+        if isinstance(entry, str):
+            entry = {"game": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("game"), str):
+            raise ValueError(
+                f"Invalid manifest {path}: {entry!r} isn't a game name or an object with a game"
+            )
+        entries.append(entry)
+    return entries
+
+
+def load_plan(path: str, options: dict = None) -> list[dict]:
+    # Jobs for the clips of a plan saved by main.py --plan, which don't need discovering again
+    jobs = []
+    try:
+        clip_plans = plans.read_plans(path)
+    except json.JSONDecodeError as err:
+        raise ValueError(f"Invalid plan {path}: {err}")
+    for plan in clip_plans:
+        job = make_job(
+            plan["game"],
+            {
+                **(options or {}),
+                "num_clips": len(plan["clips"]),
+                "days_ago": plan["days_ago"],
+            },
+        )
+        job["game_id"] = plan["game_id"]
+        job["clips"] = [clip["download_url"] for clip in plan["clips"]]
+        job["slugs"] = [clip["url"] for clip in plan["clips"]]
+        job["names"] = [clip["broadcaster_name"] for clip in plan["clips"]]
+        job["planned"] = True
+        jobs.append(job)
+    return jobs
+
+
+def prepare_batch(jobs: list[dict]):
+    # Jobs run side by side, so each needs its own tmp directory and final video
+    seen = set()
+    for job in jobs:
+        key = re.sub(r"\W+", "_", job["game"].lower()).strip("_")
+        while key in seen:
+            key += "_"
+        seen.add(key)
+        job["tmp_dir"] = os.path.join(constants.TMP_DIR, key)
+        job["output"] = f"final_{key}.mp4"
+
+        if job["num_clips"] <= 0 and not job["duration"]:
+            raise ValueError(
+                f'Batch jobs can\'t choose clips manually; give "{job["game"]}" a number of clips or a duration'
+            )
+        if job["profile"] not in constants.RENDER_PROFILES:
+            raise ValueError(
+                f'"{job["game"]}": unknown render profile "{job["profile"]}"'
+            )
+        if job["dedup_frames"] and job["overlap"]:
+            raise ValueError(
+                f'"{job["game"]}": comparing footage needs every clip downloaded before rendering, so it can\'t overlap'
+            )
+        if job["overlap"] and job["engine"] != "segments":
+            raise ValueError(f'"{job["game"]}": overlap requires the segments engine')
+        if job["stream_upload"] and (job["engine"] != "ffmpeg" or not job["youtube"]):
+            raise ValueError(
+                f'"{job["game"]}": stream upload requires the ffmpeg engine and YouTube upload'
+            )
+
+
+def discover(
+    job: dict, client: twitch.HelixClient, checkpoint: checkpoints.Checkpoint = None
+):
+    if checkpoint and checkpoint.completed(job, "discover"):
+        print(
+            f'Reusing the {len(job["clips"])} clips chosen earlier for {job["game"]}.'
+        )
+        return
+    if job.get("planned"):
+        print(f'Using the {len(job["clips"])} clips planned for {job["game"]}.')
+    else:
+        # Jobs whose game was resolved in bulk already have their game ID
+        if "game_id" not in job:
+            with instrument.span("game_id", game=job["game"]):
+                job["game_id"] = twitch.get_game_id(job["game"], client)
+        __discover_clips(job, client)
+    if checkpoint:
+        checkpoint.complete(job, "discover")
+
+
+def __discover_clips(job: dict, client: twitch.HelixClient):
+    with instrument.span("discover", game=job["game"]) as span:
+        job["clip_data"] = []
+        job["clips"], job["slugs"], job["names"] = twitch.get_clips_data(
+            job["game_id"],
+            client,
+            job["num_clips"],
+            job["days_ago"],
+            job["review"],
+            job["dedup"],
+            job["clip_data"],
+            job["duration"],
+            job["per_broadcaster"],
+        )
+        span["clips"] = len(job["clips"])
+
+
+def produce(job: dict, cpus: int = None, checkpoint: checkpoints.Checkpoint = None):
+    # Download the job's clips and render its video, unless an earlier attempt at the run
+    # already rendered (or even uploaded) it
+    if checkpoint and (
+        checkpoint.completed(job, "upload")
+        or checkpoint.completed(job, "render")
+        and checkpoints.video_matches(job)
+    ):
+        print(f'Reusing the video rendered earlier for {job["game"]}.')
+        return
+    with instrument.span(
+        "produce", game=job["game"], profile=job["profile"]
+    ), utils.ResourceMonitor() as monitor:
+        if job["overlap"]:
+            job["timestamps"] = pipeline.download_and_render(
+                job["clips"],
+                job["slugs"],
+                job["names"],
+                job["download_workers"],
+                job["render_workers"],
+                job["cache_size"],
+                cpus,
+                job["tmp_dir"],
+                job["output"],
+                job["profile"],
+            )
+            __drop_missing_clips(job)
+        else:
+            __download(job, checkpoint)
+            if job["engine"] == "ffmpeg":
+                job["timestamps"] = render.concatenate_clips(
+                    job["names"], cpus, job["tmp_dir"], job["output"], job["profile"]
+                )
+            elif job["engine"] == "segments":
+                job["timestamps"] = render.normalize_and_concatenate_clips(
+                    job["names"],
+                    job["render_workers"],
+                    job["slugs"],
+                    job["cache_size"],
+                    cpus,
+                    job["tmp_dir"],
+                    job["output"],
+                    job["profile"],
+                )
+            else:
+                job["timestamps"] = utils.concatenate_clips(
+                    job["names"],
+                    job["streaming"],
+                    cpus,
+                    job["tmp_dir"],
+                    job["output"],
+                    job["profile"],
+                )
+    print(monitor.report())
+
+    if checkpoint:
+        checkpoint.complete(
+            job,
+            "render",
+            video_size=os.path.getsize(job["output"]),
+            video_sha256=clip_cache.file_digest(job["output"]),
+        )
+
+
+def __download(job: dict, checkpoint: checkpoints.Checkpoint = None):
+    # Clips downloaded by an earlier attempt at the run are still in the tmp directory
+    if checkpoint and checkpoint.completed(job, "download"):
+        try:
+            if len(utils.list_clips(job["tmp_dir"])) == job["downloaded"]:
+                return
+        except FileNotFoundError:
+            pass
+
+    utils.download_clips(
+        job["clips"],
+        job["download_workers"],
+        job["slugs"],
+        job["cache_size"],
+        job["tmp_dir"],
+    )
+    __drop_missing_clips(job)
+    if job["dedup_frames"]:
+        __drop_duplicate_footage(job)
+    if checkpoint:
+        checkpoint.complete(
+            job, "download", downloaded=len(utils.list_clips(job["tmp_dir"]))
+        )
+
+
+def __drop_duplicate_footage(job: dict):
+    # Removes downloaded clips repeating an earlier clip of the same broadcaster
+    clips = utils.list_clips(job["tmp_dir"])
+    indices = [utils.clip_index(clip) for clip in clips]
+    duplicates = {
+        indices[j]
+        for j in dedup.duplicate_footage(clips, [job["names"][i] for i in indices])
+    }
+    if duplicates:
+        __drop_clips(job, duplicates)
+        print(f"Removed {len(duplicates)} clips repeating another clip's footage.")
+
+
+def __drop_missing_clips(job: dict):
+    # Clips that failed to download have no file. Their slugs and names are dropped too, so the
+    # video's description doesn't pair the next clips' timestamps with them
+    downloaded = {utils.clip_index(clip) for clip in utils.list_clips(job["tmp_dir"])}
+    if missing := set(range(len(job["clips"]))) - downloaded:
+        __drop_clips(job, missing)
+        print(f"Left out {len(missing)} clips that couldn't be downloaded.")
+
+
+def __drop_clips(job: dict, positions: set[int]):
+    # Removes clips from the tmp directory and the job's lists, then renumbers the rest so
+    # clip file i is still entry i of the job's lists
+    for clip in utils.list_clips(job["tmp_dir"]):
+        i = utils.clip_index(clip)
+        if i in positions:
+            os.remove(clip)
+        elif removed := sum(position < i for position in positions):
+            os.replace(clip, os.path.join(job["tmp_dir"], f"{i - removed}.mp4"))
+    for key in ["clips", "slugs", "names"]:
+        job[key] = [value for i, value in enumerate(job[key]) if i not in positions]
+
+
+def publish(job: dict, service=None, checkpoint: checkpoints.Checkpoint = None):
+    # Upload video to YouTube. A video uploaded by an earlier attempt is only added to its playlist
+    if checkpoint and checkpoint.completed(job, "publish"):
+        return  # Its files are already cleaned up too
+    if job["youtube"]:
+        import yt  # Google's API client is slow to import and only needed for uploads
+
+        yt.upload_video(
+            job["game_id"],
+            job["timestamps"],
+            job["slugs"],
+            job["names"],
+            service,
+            job["output"],
+            video_id=job.get("video_id"),
+            on_upload=__uploaded(job, checkpoint),
+        )
+
+    # Delete tmp files and final video if programmatically uploaded to YouTube
+    utils.delete_videos(job["youtube"], job["tmp_dir"], job["output"])
+    if checkpoint:
+        checkpoint.complete(job, "publish")
+
+
+def __uploaded(job: dict, checkpoint: checkpoints.Checkpoint = None):
+    # Records the video's ID the moment it's uploaded, so a resumed run never uploads it twice
+    def uploaded(video_id: str):
+        job["video_id"] = video_id
+        if checkpoint:
+            checkpoint.complete(job, "upload")
+
+    return uploaded
+
+
+def stream(
+    job: dict, cpus: int = None, service=None, checkpoint: checkpoints.Checkpoint = None
+):
+    # Download the job's clips, then upload the video to YouTube while ffmpeg is still encoding it
+    if checkpoint and checkpoint.completed(job, "upload"):
+        # Only adding the uploaded video to its playlist is left
+        publish(job, service, checkpoint)
+        return
+    __download(job, checkpoint)
+    import yt
+
+    with utils.ResourceMonitor() as monitor:
+        process, job["timestamps"] = render.start_concatenate_clips(
+            job["names"],
+            cpus,
+            job["tmp_dir"],
+            job["output"],
+            fragmented=True,
+            profile=job["profile"],
+        )
+        media = yt.GrowingFileUpload(job["output"])
+
+        def encode():
+            with instrument.span(
+                "encode", clips=len(job["names"]), profile=job["profile"]
+            ):
+                media.finish(process.wait())
+
+        encoder = threading.Thread(target=encode)
+        encoder.start()
+        try:
+            yt.upload_video(
+                job["game_id"],
+                job["timestamps"],
+                job["slugs"],
+                job["names"],
+                service,
+                job["output"],
+                media=media,
+                on_upload=__uploaded(job, checkpoint),
+            )
+        finally:
+            if process.poll() is None:
+                process.kill()  # The upload failed, so the rest of the video isn't needed
+            encoder.join()
+    print(monitor.report())
+
+    utils.delete_videos(True, job["tmp_dir"], job["output"])
+    if checkpoint:
+        checkpoint.complete(job, "publish")
+
+
+class Uploads:
+    # googleapiclient services aren't thread-safe, so jobs share one and take turns uploading
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.__service = None
+
+    def service(self):
+        # Call while holding the lock; the service is only built once it's first needed
+        if self.__service is None:
+            import yt
+
+            self.__service = yt.create_youtube_service()
+        return self.__service
+
+
+def produce_and_publish(
+    job: dict, cpus: int, uploads: Uploads, checkpoint: checkpoints.Checkpoint = None
+):
+    # Render and upload a discovered job; job["stage"] tracks how far it got
+    if not job["stream_upload"]:
+        job["stage"] = "rendering"
+        produce(job, cpus, checkpoint)
+    job["stage"] = "waiting to upload"
+    with uploads.lock:
+        service = uploads.service() if job["youtube"] else None
+        # A streamed upload holds the lock while it encodes, since the two happen together
+        job["stage"] = "uploading" if job["youtube"] else "cleaning up"
+        if job["stream_upload"]:
+            stream(job, cpus, service, checkpoint)
+        else:
+            publish(job, service, checkpoint)
+    job["stage"] = "done"
+    print(f'{job["game"]} done.')
+
+
+def plan_batch(jobs: list[dict], client: twitch.HelixClient) -> list[dict]:
+    # Only asks Helix which clips each job would include; nothing is downloaded or rendered
+    for job in jobs:
+        if job["num_clips"] <= 0 and not job["duration"]:
+            raise ValueError(
+                f'Plans can\'t choose clips manually; give "{job["game"]}" a number of clips or a duration'
+            )
+    jobs, _ = __resolve_game_ids(jobs, client)
+    with ThreadPoolExecutor(max(1, len(jobs))) as executor:
+        list(executor.map(discover, jobs, [client] * len(jobs)))
+
+    for job in [job for job in jobs if not job["clips"]]:
+        print(f'No clips found for {job["game"]}. Skipping...')
+    return [plans.make_plan(job) for job in jobs if job["clips"]]
+
+
+def run_batch(
+    jobs: list[dict],
+    client: twitch.HelixClient,
+    cpu_budget: int,
+    parallel_jobs: int,
+    checkpoint: checkpoints.Checkpoint = None,
+):
+    prepare_batch(jobs)
+    total = len(jobs)
+    jobs, failed = __resolve_game_ids(jobs, client)
+
+    # Discover every game's clips at once; requests share the client's connection pool and rate limit
+    with ThreadPoolExecutor(max(1, len(jobs))) as executor:
+        list(
+            executor.map(discover, jobs, [client] * len(jobs), [checkpoint] * len(jobs))
+        )
+
+    for job in [job for job in jobs if not job["clips"]]:
+        print(f'No clips found for {job["game"]}. Skipping...')
+    jobs = [job for job in jobs if job["clips"]]
+
+    # Render several videos at once, splitting the CPU budget between them
+    parallel_jobs = max(1, min(parallel_jobs, len(jobs)))
+    cpus = max(1, cpu_budget // parallel_jobs)
+    uploads = Uploads()
+
+    with ThreadPoolExecutor(parallel_jobs) as executor:
+        futures = [
+            (
+                job,
+                executor.submit(produce_and_publish, job, cpus, uploads, checkpoint),
+            )
+            for job in jobs
+        ]
+        for job, future in futures:
+            try:
+                future.result()
+            except Exception as err:
+                # One broken job shouldn't take the rest of the batch down with it
+                print(f'{job["game"]} failed: {err!r}')
+                failed.append(job["game"])
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {total} jobs failed: {failed}")
+
+
+def __resolve_game_ids(
+    jobs: list[dict], client: twitch.HelixClient
+) -> tuple[list[dict], list[str]]:
+    # Resolve every game ID up front in as few requests as possible. A batch runs unattended,
+    # so games Twitch doesn't recognize are reported with suggestions and skipped
+    # A resumed batch only needs the games that weren't found the first time
+    unresolved = [job["game"] for job in jobs if "game_id" not in job]
+    game_ids, suggestions = {}, {}
+    if unresolved:
+        with instrument.span("game_id", games=len(unresolved)):
+            game_ids, suggestions = twitch.get_game_ids(unresolved, client)
+    failed = []
+    for game, similar in suggestions.items():
+        hint = f' Did you mean: {", ".join(similar)}?' if similar else ""
+        print(f'Could not find "{game}".{hint} Skipping...')
+        failed += [job["game"] for job in jobs if job["game"] == game]
+    jobs = [job for job in jobs if "game_id" in job or job["game"] in game_ids]
+    for job in jobs:
+        job.setdefault("game_id", game_ids.get(job["game"]))
+    return jobs, failed
@@ -1,56 +1,155 @@
 #!/usr/bin/env python
 
 import argparse
-import platform
-import shutil
+import os
 from sys import exit as sys_exit
 
-from moviepy.config import change_settings
-
+import checkpoints
 import constants
+import instrument
+import jobs
+import plans
+import review
 import twitch
 import utils
-import yt
 
 
 def run(args=None):
-    game = args.game
-    num_clips = args.num_clips
-    days_ago = args.days_ago
-    yt_upload = args.youtube
+    checkpoint = None
+    if args.resume:
+        # A resumed run carries on with the jobs and options it was started with
+        try:
+            checkpoint = checkpoints.load(args.resume)
+        except FileNotFoundError:
+            sys_exit(f"There's no run {args.resume} in {constants.CHECKPOINT_DIR}.")
+        if checkpoint.finished:
+            sys_exit(f"Run {args.resume} already finished.")
+        options = checkpoint.options
+        games = [job["game"] for job in checkpoint.jobs]
+    else:
+        options = {
+            "num_clips": args.num_clips,
+            "duration": args.duration,
+            "per_broadcaster": args.per_broadcaster,
+            "days_ago": args.days_ago,
+            "youtube": args.youtube,
+            "download_workers": args.download_workers,
+            "cache_size": int(args.cache_size * 1024**3),
+            "engine": args.engine,
+            "streaming": args.streaming,
+            "overlap": args.overlap,
+            "render_workers": args.render_workers,
+            "stream_upload": args.stream_upload,
+            "profile": args.profile,
+            "review": args.review,
+            "dedup": not args.keep_duplicates,
+            "dedup_frames": args.dedup_frames,
+        }
+        games = args.game
 
-    # Change MoviePy settings if on Windows
-    if platform.system() == "Windows":
-        change_settings({"IMAGEMAGICK_BINARY": shutil.which("magick")})
+    # Time every stage of the run. The report is written even if the run fails
+    recording = instrument.recording(options={**options, "games": games})
+    recorder = None  # Stays None if the recording couldn't start
+    try:
+        with recording as recorder:
+            if args.plan:
+                __plan(args, options)
+                return
+            if checkpoint is None:
+                # Every completed stage is saved, so a run that dies can be resumed
+                batch = __load_batch(args, options)
+                checkpoint = checkpoints.Checkpoint(recorder.run_id, batch, options)
+                checkpoint.save()
+            __run(args, checkpoint)
+    finally:
+        if recorder:
+            print(f"Run report saved to {recorder.write_report()}")
+        if recorder and args.trace:
+            recorder.write_trace(args.trace)
+            print(f"Trace saved to {args.trace}")
+        if checkpoint and not checkpoint.finished:
+            print(f"To pick up where this run stopped: --resume {checkpoint.run_id}")
+
+
+def __load_batch(args, options: dict) -> list[dict]:
+    # Jobs for the games on the command line, in a --batch manifest and in a --from-plan plan
+    batch = [jobs.make_job(game, options) for game in args.game]
+    try:
+        if args.batch:
+            batch += jobs.load_manifest(args.batch, options)
+        if args.from_plan:
+            batch += jobs.load_plan(args.from_plan, options)
+    except ValueError as err:
+        sys_exit(str(err))
+    if not batch:
+        sys_exit(f"{args.batch or args.from_plan} has no games to compile.")
+    return batch
+
+
+def __plan(args, options: dict):
+    # Only look up which clips each game's video would have, for a later run to use
+    batch = __load_batch(args, options)
 
-    # Communicate with Twitch API
     twitch_secret = utils.read_json(constants.TWITCH_SECRET_PATH)
-    oauth = twitch.request_oauth(twitch_secret)
-    twitch_headers = {  # Headers for all Twitch API requests
-        "Authorization": f"Bearer {oauth}",
-        "Client-Id": twitch_secret["client_id"],
-    }
-    game_id = twitch.get_game_id(game, twitch_headers)
-    clips, slugs, names = twitch.get_clips_data(
-        game_id, twitch_headers, num_clips, days_ago
+    with twitch.HelixClient(twitch_secret) as client:
+        try:
+            clip_plans = jobs.plan_batch(batch, client)
+        except ValueError as err:
+            sys_exit(str(err))
+
+    for plan in clip_plans:
+        plans.print_plan(plan)
+    plans.write_plans(clip_plans, args.plan)
+    print(
+        f"Clip plan saved to {args.plan}. Make its videos with --from-plan {args.plan}"
     )
 
+
+def __run(args, checkpoint: checkpoints.Checkpoint):
+    batch = checkpoint.jobs
+
+    # Communicate with Twitch API
+    twitch_secret = utils.read_json(constants.TWITCH_SECRET_PATH)
+    with twitch.HelixClient(twitch_secret) as client:
+        if len(batch) > 1:
+            try:
+                jobs.run_batch(
+                    batch, client, args.cpu_budget, args.parallel_jobs, checkpoint
+                )
+            except ValueError as err:
+                checkpoint.finish()  # Resuming wouldn't fix the batch
+                sys_exit(str(err))
+            except RuntimeError as err:
+                # Some jobs failed; the checkpoint stays open so they can be resumed
+                sys_exit(str(err))
+            checkpoint.finish()
+            print("\n      DONE\n")
+            return
+
+        job = batch[0]
+        try:
+            jobs.discover(job, client, checkpoint)
+        except ValueError as err:
+            checkpoint.finish()  # Resuming wouldn't find the game either
+            sys_exit(str(err))
+
     # If user decided not to include any clips, exit
-    if not clips:
+    if not job["clips"]:
+        checkpoint.finish()
         print("No clips included. Exiting...")
         sys_exit(1)
 
-    # Get clips and prepare video
-    utils.download_clips(clips)
-    timestamps = utils.concatenate_clips(names)
-
-    # Upload video to YouTube
-    if yt_upload:
-        yt.upload_video(game_id, timestamps, slugs, names)
+    if job["stream_upload"]:
+        # Get clips, then encode and upload the video at the same time
+        jobs.stream(job, checkpoint=checkpoint)
+    else:
+        # Get clips and prepare video
+        jobs.produce(job, checkpoint=checkpoint)
 
-    # Delete tmp files and final video if programmatically uploaded to YouTube
-    utils.delete_videos(include_final=yt_upload)
+        # Upload video to YouTube and clean up
+        jobs.publish(job, checkpoint=checkpoint)
 
+    checkpoint.finish()
     print("\n      DONE\n")
 
 
@@ -58,7 +157,40 @@ def main():
     parser = argparse.ArgumentParser(
         description="Download, edit, concatenate, and upload Twitch clips"
     )
-    parser.add_argument("game", help="Game name", type=str)
+    parser.add_argument(
+        "game",
+        help="Game name. Give several to make one compilation per game in a single batch",
+        type=str,
+        nargs="*",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        help='JSON manifest of games to compile in one batch: a list of game names or objects like {"game": "Rust", "num_clips": 10} overriding the command line options',
+        type=str,
+    )
+    parser.add_argument(
+        "--plan",
+        help="Only look up the clips each video would have and save them to this JSON (or .jsonl) file, with estimated download size and render time",
+        type=str,
+    )
+    parser.add_argument(
+        "--from-plan",
+        help="Make the videos of a plan saved by --plan, with its clips, instead of looking clips up again",
+        type=str,
+    )
+    parser.add_argument(
+        "--cpu-budget",
+        help="In batch mode, number of CPUs shared by all render jobs (default: number of CPUs)",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--parallel-jobs",
+        help="In batch mode, number of videos rendered at the same time (default: 2)",
+        type=int,
+        default=2,
+    )
     parser.add_argument(
         "-n",
         "--num-clips",
@@ -66,6 +198,16 @@ def main():
         type=int,
         default=0,
     )
+    parser.add_argument(
+        "--duration",
+        help="Target length of the video in seconds. The most viewed clips that fit are included, with --num-clips (if given) as a limit on their number",
+        type=float,
+    )
+    parser.add_argument(
+        "--per-broadcaster",
+        help="Most clips included from any one broadcaster",
+        type=int,
+    )
     parser.add_argument(
         "-d",
         "--days-ago",
@@ -73,11 +215,105 @@ def main():
         type=int,
         default=7,
     )
+    parser.add_argument(
+        "--review",
+        help="When choosing clips manually, download clips ahead of time and show each one as a small local video (proxy) or a grid of its frames (sheet) instead of opening it on Twitch",
+        choices=review.PREVIEW_MODES,
+    )
+    parser.add_argument(
+        "--keep-duplicates",
+        help="Keep clips of the same moment by the same broadcaster instead of only the most viewed one",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--dedup-frames",
+        help="After downloading, also compare clips' frames and drop clips repeating another clip's footage",
+        action="store_true",
+    )
     parser.add_argument(
         "-yt", "--youtube", help="Whether to upload to YouTube", action="store_true"
     )
+    parser.add_argument(
+        "-w",
+        "--download-workers",
+        help=f"Number of clips to download concurrently (default: {constants.DOWNLOAD_WORKERS})",
+        type=int,
+        default=constants.DOWNLOAD_WORKERS,
+    )
+    parser.add_argument(
+        "--cache-size",
+        help=f"Gigabytes of downloaded clips (and of normalized segments) to keep cached between runs (default: {constants.CLIP_CACHE_SIZE / 1024**3:g})",
+        type=float,
+        default=constants.CLIP_CACHE_SIZE / 1024**3,
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        help="Renderer used to edit and concatenate clips (default: moviepy). ffmpeg renders the whole video in a single ffmpeg process. segments normalizes clips in parallel and joins them without re-encoding",
+        choices=["moviepy", "ffmpeg", "segments"],
+        default="moviepy",
+    )
+    parser.add_argument(
+        "--streaming",
+        help="With the moviepy engine, render clips one at a time so memory use doesn't grow with the number of clips",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--overlap",
+        help="With the segments engine, start normalizing each clip as soon as it's downloaded instead of waiting for every download",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--render-workers",
+        help="Number of clips to normalize concurrently with the segments engine (default: number of CPUs)",
+        type=int,
+    )
+    parser.add_argument(
+        "--stream-upload",
+        help="With -yt and the ffmpeg engine, upload the video to YouTube while it's being encoded",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        help=f"Render profile trading encoding speed for quality (default: {constants.DEFAULT_RENDER_PROFILE}). draft renders quick previews, archive keeps the most detail",
+        choices=constants.RENDER_PROFILES,
+        default=constants.DEFAULT_RENDER_PROFILE,
+    )
+    parser.add_argument(
+        "--resume",
+        help="ID of a run that stopped early, to pick up where it stopped with the same clips and options",
+        type=str,
+    )
+    parser.add_argument(
+        "--trace",
+        help="Also save the run's timings as a Chrome trace (open in chrome://tracing or ui.perfetto.dev)",
+        type=str,
+    )
     parser.set_defaults(func=run)
     args = parser.parse_args()
+    if args.resume and (args.game or args.batch or args.from_plan or args.plan):
+        parser.error("--resume continues a run with its own games; don't give any")
+    if args.plan and args.from_plan:
+        parser.error("--plan looks clips up again; it can't use --from-plan")
+    if not (args.game or args.batch or args.resume or args.from_plan):
+        parser.error(
+            "give at least one game, a --batch manifest, a --from-plan plan or a run to --resume"
+        )
+    if args.review and (args.num_clips > 0 or args.duration):
+        parser.error(
+            "--review is only for choosing clips manually (--num-clips 0, no --duration)"
+        )
+    if args.dedup_frames and args.overlap:
+        parser.error("--dedup-frames can't be used with --overlap")
+    if args.overlap and args.engine != "segments":
+        parser.error("--overlap requires --engine segments")
+    if args.stream_upload and (args.engine != "ffmpeg" or not args.youtube):
+        parser.error("--stream-upload requires -yt and --engine ffmpeg")
+    if len(args.game) > 1 and args.num_clips <= 0 and not args.duration:
+        parser.error(
+            "batch mode can't choose clips manually; give --num-clips or --duration"
+        )
     args.func(args)
 
 
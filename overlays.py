@@ -0,0 +1,122 @@
+import functools
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING
+
+from PIL import Image, ImageDraw, ImageFont
+
+import clip_cache
+import constants
+import files
+
+if TYPE_CHECKING:
+    import numpy as np
+
+BADGE_COLOR = (0, 0, 0)  # Streamer name
+BADGE_BG_COLOR = (255, 255, 255)
+
+
+def logo_path() -> str:
+    # twitch.jpg scaled down to the size it's shown at in the top left of every clip
+    path = __asset_path("logo", [__logo_digest(), constants.LOGO_SCALE])
+    if not __is_cached(path):
+        logo = Image.open(constants.LOGO_PATH).convert("RGBA")
+        logo = logo.resize(
+            (
+                round(logo.width * constants.LOGO_SCALE),
+                round(logo.height * constants.LOGO_SCALE),
+            )
+        )
+        __save(logo, path)
+    return path
+
+
+def badge_path(name: str) -> str:
+    # The streamer's name on a white badge as tall as the logo
+    height = overlay_array(logo_path()).shape[0]
+    path = __asset_path(
+        "badge",
+        [
+            name,
+            constants.BADGE_FONTS,
+            constants.BADGE_FONT_SIZE,
+            BADGE_COLOR,
+            BADGE_BG_COLOR,
+            height,
+        ],
+    )
+    if not __is_cached(path):
+        font = __load_font()
+        left, top, right, bottom = font.getbbox(name)
+        badge = Image.new("RGBA", (right - left + 8, height), BADGE_BG_COLOR)
+        ImageDraw.Draw(badge).text(
+            (4 - left, (height - (bottom - top)) // 2 - top),
+            name,
+            font=font,
+            fill=BADGE_COLOR,
+        )
+        __save(badge, path)
+    return path
+
+
+def header_path(name: str) -> str:
+    # Logo with the name badge to its right, so ffmpeg renderers need a single overlay per clip
+    logo, badge = logo_path(), badge_path(name)
+    path = __asset_path("header", [os.path.basename(logo), os.path.basename(badge)])
+    if not __is_cached(path):
+        logo_img, badge_img = Image.open(logo), Image.open(badge)
+        header = Image.new(
+            "RGBA", (logo_img.width + badge_img.width, logo_img.height), (0, 0, 0, 0)
+        )
+        header.paste(logo_img, (0, 0))
+        header.paste(badge_img, (logo_img.width, 0))
+        __save(header, path)
+    return path
+
+
+@functools.lru_cache(maxsize=256)
+def overlay_array(path: str) -> "np.ndarray":
+    # Decoded RGBA pixels, shared by every clip in this process that shows the same overlay
+    import numpy as np
+
+    return np.array(Image.open(path).convert("RGBA"))
+
+
+def __asset_path(kind: str, key: list) -> str:
+    digest = hashlib.sha256(json.dumps([kind, *key]).encode()).hexdigest()
+    return os.path.join(constants.OVERLAY_CACHE_DIR, f"{kind}-{digest[:32]}.png")
+
+
+def __is_cached(path: str) -> bool:
+    if os.path.exists(path):
+        os.utime(path)  # Mark as recently used
+        return True
+    return False
+
+
+def __save(image: Image.Image, path: str):
+    # Written atomically so concurrent renders never read a half-written asset
+    os.makedirs(constants.OVERLAY_CACHE_DIR, exist_ok=True)
+    with files.atomic_write(path, "wb") as f:
+        image.save(f, format="PNG")
+    clip_cache.evict(
+        constants.OVERLAY_CACHE_SIZE,
+        keep={path},
+        cache_dir=constants.OVERLAY_CACHE_DIR,
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def __logo_digest() -> str:
+    return clip_cache.file_digest(constants.LOGO_PATH)
+
+
+def __load_font() -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
+    # Helvetica-Bold isn't installed everywhere, so fall back through similar fonts
+    for font in constants.BADGE_FONTS:
+        try:
+            return ImageFont.truetype(font, constants.BADGE_FONT_SIZE)
+        except OSError:
+            continue
+    return ImageFont.load_default()
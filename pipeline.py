@@ -0,0 +1,155 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+import clip_cache
+import constants
+import instrument
+import overlays
+import probe
+import render
+import utils
+
+
+def download_and_render(
+    clip_urls,
+    slugs,
+    names,
+    download_workers: int = constants.DOWNLOAD_WORKERS,
+    render_workers: int = None,
+    cache_size: int = constants.CLIP_CACHE_SIZE,
+    cpus: int = None,
+    tmp_dir: str = None,
+    output: str = "final.mp4",
+    profile: str = None,
+):
+    # Each clip is normalized as soon as its download finishes, while the remaining clips keep downloading
+    print("Downloading and rendering clips...")
+    tmp_dir = tmp_dir or constants.TMP_DIR
+    cpus = cpus or psutil.cpu_count()
+    utils.reset_tmp_dir(tmp_dir)
+    os.makedirs(constants.CLIP_CACHE_DIR, exist_ok=True)
+    os.makedirs(constants.SEGMENT_CACHE_DIR, exist_ok=True)
+
+    download_workers = max(1, min(download_workers, len(clip_urls)))
+    render_workers = max(1, min(render_workers or cpus, len(clip_urls)))
+    threads = max(1, cpus // render_workers)
+
+    # Bounded hand-offs between stages: downloads wait while the encoders are behind, and
+    # no more than two clips per encoder are ever queued up
+    downloaded = queue.Queue(maxsize=render_workers)
+    encode_slots = threading.BoundedSemaphore(render_workers * 2)
+    stopped = threading.Event()
+
+    start = time.perf_counter()
+    total_bytes = 0
+    # clip index -> segment, so the final order doesn't depend on completion order
+    segments = {}
+    encodes = {}  # segment -> future
+    with utils.create_session(download_workers) as session, ThreadPoolExecutor(
+        download_workers
+    ) as downloader, ThreadPoolExecutor(render_workers) as encoder:
+        # Encoding happens in ffmpeg subprocesses, so threads are enough to keep every core busy
+
+        def download(i, url):
+            clip_path, written = None, 0
+            try:
+                clip_path, written = clip_cache.fetch_clip(
+                    session, url, clip_cache.clip_key(slugs[i])
+                )
+            finally:
+                # Always hand off, even on failure, so the encoding stage knows the clip is done
+                # Unless the encoding stage failed and stopped taking clips
+                while not stopped.is_set():
+                    try:
+                        downloaded.put(
+                            (i, clip_path, written), timeout=constants.PIPELINE_POLL
+                        )
+                        break
+                    except queue.Full:
+                        pass
+
+        def encode(i, clip, header, info, segment):
+            with instrument.span("normalize_clip", clip=i):
+                render.normalize_clip(
+                    clip,
+                    header,
+                    info,
+                    constants.PIPELINE_FPS,
+                    segment,
+                    threads,
+                    profile,
+                )
+
+        for i, url in enumerate(clip_urls):
+            downloader.submit(download, i, url)
+
+        try:
+            for _ in clip_urls:
+                i, clip_path, written = downloaded.get()
+                total_bytes += written
+                if not clip_path:
+                    continue
+
+                clip = os.path.join(tmp_dir, f"{i}.mp4")
+                clip_cache.link_clip(clip_path, clip)
+                info = probe.probe(clip)
+                steps = probe.clip_steps(info, constants.PIPELINE_FPS)
+                print(f"Clip {i} needs: {', '.join(steps) or 'no conversion'}")
+                header = overlays.header_path(names[i])
+                segment = render.segment_path(
+                    clip_cache.clip_key(slugs[i]),
+                    header,
+                    info,
+                    constants.PIPELINE_FPS,
+                    profile,
+                )
+                segments[i] = segment
+
+                if os.path.exists(segment):
+                    os.utime(segment)  # Mark as recently used
+                elif segment not in encodes:
+                    encode_slots.acquire()
+                    encodes[segment] = encoder.submit(
+                        encode, i, clip, header, info, segment
+                    )
+                    encodes[segment].add_done_callback(lambda _: encode_slots.release())
+        except BaseException:
+            # Nothing takes finished downloads any more, so stop the rest instead of waiting on them
+            stopped.set()
+            downloader.shutdown(wait=False, cancel_futures=True)
+            encoder.shutdown(wait=False, cancel_futures=True)
+            raise
+
+        # Surface any encoding errors
+        for future in encodes.values():
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"Clips downloaded and normalized: {total_bytes / 1e6:.1f} MB downloaded, "
+        f"{len(encodes)} clips encoded, {len(segments) - len(encodes)} reused, "
+        f"in {elapsed:.1f}s."
+    )
+
+    ordered = [segments[i] for i in sorted(segments)]
+    utils.concat_segments(ordered, output, tmp_dir)
+    print("Final video created.")
+
+    timestamps = [0]
+    for segment in ordered[:-1]:
+        timestamps.append(timestamps[-1] + probe.probe(segment)["duration"])
+
+    clip_cache.evict(
+        cache_size,
+        keep={clip_cache.cached_clip_path(clip_cache.clip_key(slug)) for slug in slugs},
+    )
+    clip_cache.evict(
+        cache_size, keep=set(ordered), cache_dir=constants.SEGMENT_CACHE_DIR
+    )
+
+    return timestamps
@@ -0,0 +1,112 @@
+import datetime
+import json
+import os
+
+import clip_cache
+import constants
+import files
+
+
+def make_plan(job: dict) -> dict:
+    # What a discovered job's video would contain, with rough costs of making it
+    clips = []
+    start = 0
+    for data, download_url in zip(job["clip_data"], job["clips"]):
+        clips.append(
+            {
+                "id": data.get("id"),
+                "url": data["url"],
+                "download_url": download_url,
+                "broadcaster_name": data["broadcaster_name"],
+                "broadcaster_id": data.get("broadcaster_id"),
+                "title": data.get("title"),
+                "duration": data["duration"],
+                "view_count": data.get("view_count"),
+                "created_at": data.get("created_at"),
+                "start": round(start, 3),  # Timestamp of the clip in the video
+            }
+        )
+        start += data["duration"]
+
+    # Clips already in the clip cache don't need downloading again
+    uncached = [
+        clip
+        for clip in clips
+        if not os.path.exists(
+            clip_cache.cached_clip_path(clip_cache.clip_key(clip["url"]))
+        )
+    ]
+    mode = render_mode(job)
+    return {
+        "game": job["game"],
+        "game_id": job["game_id"],
+        "days_ago": job["days_ago"],
+        "planned_at": datetime.datetime.now().isoformat(),
+        "duration": round(start, 3),
+        "clips": clips,
+        "estimates": {
+            "download_bytes": round(
+                sum(clip["duration"] for clip in uncached)
+                * constants.PLAN_CLIP_BITRATE
+                / 8
+            ),
+            "cached_clips": len(clips) - len(uncached),
+            "encode_seconds": round(start / encode_speed(job["profile"], mode)),
+            "profile": job["profile"],
+            "render_mode": mode,
+        },
+    }
+
+
+def render_mode(job: dict) -> str:
+    # The benchmark's name for how the job renders
+    if job["engine"] == "segments":
+        return "overlap" if job["overlap"] else "segments"
+    if job["engine"] == "moviepy" and job["streaming"]:
+        return "moviepy-streaming"
+    return job["engine"]
+
+
+def encode_speed(profile: str, mode: str, path: str = None) -> float:
+    # Seconds of video rendered per second, from the latest benchmark of the profile and mode
+    # on this machine, or a rough guess if it hasn't been benchmarked
+    path = path or constants.BENCHMARK_RESULTS_PATH
+    speed = None
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["params"].get("profile", profile) != profile:
+                    continue
+                if metrics := entry["results"].get(f"render:{mode}"):
+                    speed = metrics["video_seconds_per_second"]
+    return speed or constants.PLAN_ENCODE_SPEED[profile]
+
+
+def write_plans(plans: list[dict], path: str):
+    # A .jsonl path gets one plan per line, anything else a JSON list. Written atomically, so
+    # a run reading the plan never sees half of it
+    if not path.endswith(".jsonl"):
+        files.write_json(plans, path, indent=2)
+        return
+    with files.atomic_write(path) as f:
+        f.writelines(json.dumps(plan) + "\n" for plan in plans)
+
+
+def read_plans(path: str) -> list[dict]:
+    with open(path, "r") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def print_plan(plan: dict):
+    estimates = plan["estimates"]
+    print(
+        f'{plan["game"]}: {len(plan["clips"])} clips, '
+        f'{datetime.timedelta(seconds=round(plan["duration"]))} of video, '
+        f'~{estimates["download_bytes"] / 1024**2:.0f} MB to download '
+        f'({estimates["cached_clips"]} clips cached), '
+        f'~{datetime.timedelta(seconds=estimates["encode_seconds"])} to render '
+        f'({estimates["profile"]}, {estimates["render_mode"]})'
+    )
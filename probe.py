@@ -0,0 +1,99 @@
+import os
+
+import constants
+import instrument
+import store
+
+# The parts of ffmpeg's stream info that rendering decisions depend on
+PROBE_KEYS = [
+    "duration",
+    "video_size",
+    "video_fps",
+    "video_rotation",
+    "audio_found",
+    "audio_fps",
+]
+
+
+def probe(path: str) -> dict:
+    # Stream info of a video, read once and then served from the probe cache
+    # Keyed on the file's identity rather than its path, so a clip probed in the clip cache
+    # is already known once it's hard linked into the tmp directory
+    key = __probe_key(os.stat(path))
+    probes = __probes()
+    if (info := probes.get(key)) is None:
+        from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+        infos = ffmpeg_parse_infos(path)
+        info = {name: infos.get(name) for name in PROBE_KEYS}
+        probes.set(key, info)
+    return info
+
+
+def forget(path: str):
+    # Drops a file's probe before it's deleted, since a deleted file's key never comes back
+    try:
+        key = __probe_key(os.stat(path))
+    except FileNotFoundError:
+        return
+    probes = __probes()
+    if key in probes:
+        probes.delete(key)
+
+
+def __probe_key(stat: os.stat_result) -> str:
+    return f"{stat.st_dev}-{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def __probes() -> store.JsonStore:
+    # Files outside the caches (like streamed segments) aren't forgotten, so the store is bounded
+    return store.get_store(constants.PROBE_CACHE_PATH, constants.PROBE_CACHE_ENTRIES)
+
+
+def clip_steps(info: dict, fps: float) -> list[str]:
+    # Which conversions a clip needs to match the final video; unknown properties are converted
+    steps = []
+    width, height = info.get("video_size") or (None, None)
+    if info.get("video_rotation") in (90, 270):
+        width, height = height, width  # ffmpeg rotates the frames while decoding
+    if (width, height) != constants.VIDEO_RESOLUTION:
+        steps.append("scale")
+    if abs((info.get("video_fps") or 0) - fps) > 0.01:
+        steps.append("retime")
+    if not info.get("audio_found"):
+        steps.append("silence")
+    elif info.get("audio_fps") != constants.AUDIO_FPS:
+        steps.append("resample")
+    return steps
+
+
+def render_plan(clips: list[str], fps: float = None) -> dict:
+    # Probes every clip and decides how each one is converted; the video renders at the
+    # highest frame rate of all the clips unless fps is given, like MoviePy does
+    with instrument.span("probe", clips=len(clips)) as attrs:
+        infos = [probe(clip) for clip in clips]
+        fps = fps or max(info["video_fps"] for info in infos)
+        plan = {
+            "resolution": list(constants.VIDEO_RESOLUTION),
+            "fps": fps,
+            "audio_fps": constants.AUDIO_FPS,
+            "clips": [
+                {"clip": clip, **info, "steps": clip_steps(info, fps)}
+                for clip, info in zip(clips, infos)
+            ],
+        }
+        attrs["plan"] = plan
+    return plan
+
+
+def print_plan(plan: dict):
+    width, height = plan["resolution"]
+    print(f"Render plan: {width}x{height} at {plan['fps']:g} fps")
+    for entry in plan["clips"]:
+        size = "x".join(map(str, entry["video_size"] or ["?"]))
+        audio = f"{entry['audio_fps']} Hz" if entry["audio_found"] else "no audio"
+        steps = ", ".join(entry["steps"]) or "none"
+        print(
+            f"  {os.path.basename(entry['clip'])}: {size} at {entry['video_fps']:g} fps, "
+            f"{audio} -> {steps}"
+        )
@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+import clip_cache
+import constants
+import instrument
+import overlays
+import probe
+import utils
+
+
+def concatenate_clips(
+    names,
+    cpus: int = None,
+    tmp_dir: str = None,
+    output: str = "final.mp4",
+    profile: str = None,
+):
+    # Same output as utils.concatenate_clips, but composited and encoded by a single ffmpeg process
+    with instrument.span(
+        "encode", clips=len(names), profile=utils.render_profile(profile)["name"]
+    ):
+        process, timestamps = start_concatenate_clips(
+            names, cpus, tmp_dir, output, profile=profile
+        )
+        if returncode := process.wait():
+            raise subprocess.CalledProcessError(returncode, process.args)
+    print("Final video created.")
+    return timestamps
+
+
+def start_concatenate_clips(
+    names,
+    cpus: int = None,
+    tmp_dir: str = None,
+    output: str = "final.mp4",
+    fragmented: bool = False,
+    profile: str = None,
+) -> tuple[subprocess.Popen, list]:
+    # Starts the ffmpeg process without waiting for it, since the timestamps are known up front
+    # A fragmented video is only ever appended to, so it can be uploaded while it's being written
+    tmp_dir = tmp_dir or constants.TMP_DIR
+    clips = utils.list_clips(tmp_dir)
+    plan = probe.render_plan(clips)
+    probe.print_plan(plan)
+    infos = plan["clips"]
+
+    # Each clip's logo and name badge are pre-rendered into one image so it needs a single overlay
+    headers = [overlays.header_path(names[utils.clip_index(clip)]) for clip in clips]
+
+    filter_graph = os.path.join(tmp_dir, "filter_graph.txt")
+    with open(filter_graph, "wt") as f:
+        f.write(build_filter_graph(infos))
+
+    command = [utils.ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error"]
+    for input_file in clips + headers:
+        command += ["-i", input_file]
+    command += [
+        "-filter_complex_script",
+        filter_graph,
+        "-map",
+        "[v]",
+        "-map",
+        "[a]",
+        *__encoder_args(cpus or psutil.cpu_count(), profile),
+    ]
+    if fragmented:
+        # ffmpeg never seeks back in a pipe, so bytes already in the file don't change
+        command += ["-movflags", "frag_keyframe+empty_moov", "-f", "mp4", "pipe:1"]
+        with open(output, "wb") as f:
+            process = subprocess.Popen(command, stdout=f)
+    else:
+        process = subprocess.Popen(command + [output])
+
+    # Timestamps come from the same durations the filter graph trims each clip to
+    timestamps = [0]
+    for info in infos[:-1]:
+        timestamps.append(timestamps[-1] + info["duration"])
+    return process, timestamps
+
+
+def normalize_and_concatenate_clips(
+    names,
+    workers: int = None,
+    slugs=None,
+    cache_size: int = constants.SEGMENT_CACHE_SIZE,
+    cpus: int = None,
+    tmp_dir: str = None,
+    output: str = "final.mp4",
+    profile: str = None,
+):
+    # Phase one normalizes and overlays every clip in parallel, phase two joins the segments without re-encoding
+    tmp_dir = tmp_dir or constants.TMP_DIR
+    cpus = cpus or psutil.cpu_count()
+    clips = utils.list_clips(tmp_dir)
+    indices = [utils.clip_index(clip) for clip in clips]
+    plan = probe.render_plan(clips)
+    probe.print_plan(plan)
+    infos, fps = plan["clips"], plan["fps"]
+
+    # Normalized segments are cached, so re-rendering an edited clip list only encodes new or changed clips
+    os.makedirs(constants.SEGMENT_CACHE_DIR, exist_ok=True)
+    headers = [overlays.header_path(names[i]) for i in indices]
+    segments = []
+    for clip, i, header, info in zip(clips, indices, headers, infos):
+        clip_id = (
+            clip_cache.clip_key(slugs[i]) if slugs else clip_cache.file_digest(clip)
+        )
+        segments.append(segment_path(clip_id, header, info, fps, profile))
+
+    # A clip that appears twice only needs encoding once
+    missing = list(
+        {
+            segment: j
+            for j, segment in enumerate(segments)
+            if not os.path.exists(segment)
+        }.values()
+    )
+    for segment in set(segments) - {segments[j] for j in missing}:
+        os.utime(segment)  # Mark as recently used
+
+    if missing:
+        # Split the cores between the encoders rather than letting each one claim all of them
+        workers = max(1, min(workers or cpus, len(missing)))
+        threads = max(1, cpus // workers)
+        print(f"Normalizing {len(missing)} clips with {workers} workers...")
+
+        def encode(j):
+            with instrument.span("normalize_clip", clip=indices[j]):
+                normalize_clip(
+                    clips[j], headers[j], infos[j], fps, segments[j], threads, profile
+                )
+
+        # Encoding happens in ffmpeg subprocesses, so threads are enough
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(encode, missing))
+    print(
+        f"Clips normalized: {len(missing)} encoded, "
+        f"{len(clips) - len(missing)} reused from cache."
+    )
+
+    utils.concat_segments(segments, output, tmp_dir)
+    print("Final video created.")
+
+    # Segment durations are what actually ended up in the video, so timestamps come from them
+    timestamps = [0]
+    for segment in segments[:-1]:
+        timestamps.append(timestamps[-1] + probe.probe(segment)["duration"])
+
+    if evicted := clip_cache.evict(
+        cache_size, keep=set(segments), cache_dir=constants.SEGMENT_CACHE_DIR
+    ):
+        print(f"Evicted {evicted} segments from cache.")
+
+    return timestamps
+
+
+def segment_path(
+    clip_id: str, header: str, info: dict, fps: float, profile: str = None
+) -> str:
+    # Key on everything that changes a segment: the clip, its overlay and the render settings
+    # Overlay assets are content-addressed, so their file name stands in for the overlay itself
+    key = json.dumps(
+        [
+            clip_id,
+            os.path.basename(header),
+            __clip_filters(0, 1, info, fps),
+            # Thread count doesn't change the encoding settings
+            __encoder_args(0, profile),
+        ]
+    )
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return os.path.join(constants.SEGMENT_CACHE_DIR, f"{digest}.mp4")
+
+
+def normalize_clip(
+    clip: str,
+    header: str,
+    info: dict,
+    fps: float,
+    segment: str,
+    threads: int = 1,
+    profile: str = None,
+):
+    # Callers time it in a normalize_clip span, since they know the clip's index
+    __encode_segment(clip, header, info, fps, segment, threads, profile)
+
+
+def __encode_segment(
+    clip: str,
+    header: str,
+    info: dict,
+    fps: float,
+    segment: str,
+    threads: int,
+    profile: str,
+):
+    # Encode to a temporary file first so an interrupted run never leaves a truncated segment in the cache
+    # Jobs running side by side may encode the same segment, so each writes its own file
+    part = f"{segment}.{os.getpid()}-{threading.get_ident()}.part"
+    command = [
+        utils.ffmpeg_binary(),
+        "-y",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        clip,
+        "-i",
+        header,
+        "-filter_complex",
+        ";".join(__clip_filters(0, 1, info, fps)),
+        "-map",
+        "[v0]",
+        "-map",
+        "[a0]",
+        *__encoder_args(threads, profile),
+        "-f",
+        "mp4",
+        part,
+    ]
+    try:
+        subprocess.run(command, check=True)
+        os.replace(part, segment)
+    finally:
+        # Nothing is left behind in the cache if ffmpeg failed
+        if os.path.exists(part):
+            os.remove(part)
+
+
+def build_filter_graph(infos: list[dict]) -> str:
+    # Clip i is input i and its overlay image is input len(infos) + i
+    # MoviePy also renders at the highest fps of all the clips
+    fps = max(info["video_fps"] for info in infos)
+
+    filters = []
+    for i, info in enumerate(infos):
+        filters.extend(__clip_filters(i, len(infos) + i, info, fps))
+
+    streams = "".join(f"[v{i}][a{i}]" for i in range(len(infos)))
+    filters.append(f"{streams}concat=n={len(infos)}:v=1:a=1[v][a]")
+    return ";\n".join(filters)
+
+
+def __clip_filters(i: int, overlay_input: int, info: dict, fps: float) -> list[str]:
+    # Normalizes input i to the final video's format and overlays its header, producing [v{i}] and [a{i}]
+    # Only the conversions the clip needs are applied, so clips already in the final format
+    # aren't scaled or resampled for nothing
+    width, height = constants.VIDEO_RESOLUTION
+    duration = info["duration"]
+    steps = probe.clip_steps(info, fps)
+    video = f"[{i}:v]"
+    if "scale" in steps:
+        video += (
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,"
+        )
+    video += "setsar=1,"
+    if "retime" in steps:
+        video += f"fps={fps},"
+    filters = [
+        f"{video}trim=duration={duration}[bg{i}]",
+        f"[bg{i}][{overlay_input}:v]overlay=0:0[v{i}]",
+    ]
+
+    # Pad or trim audio to the video's length so later clips don't drift out of sync
+    if "silence" in steps:
+        audio_source = f"anullsrc=r={constants.AUDIO_FPS},"
+    elif "resample" in steps:
+        audio_source = f"[{i}:a]aresample={constants.AUDIO_FPS},"
+    else:
+        audio_source = f"[{i}:a]"
+    filters.append(
+        f"{audio_source}aformat=sample_fmts=fltp:channel_layouts=stereo,"
+        f"apad,atrim=duration={duration}[a{i}]"
+    )
+    return filters
+
+
+def __encoder_args(threads: int, profile: str = None) -> list[str]:
+    # Every engine (and every segment) must share these so segments can be joined without re-encoding
+    settings = utils.render_profile(profile)
+    return [
+        "-c:v",
+        "libx264",
+        "-preset",
+        settings["preset"],
+        "-crf",
+        str(settings["crf"]),
+        "-g",
+        str(settings["gop"]),
+        "-pix_fmt",
+        "yuv420p",
+        "-video_track_timescale",
+        "90000",
+        "-c:a",
+        "aac",
+        "-b:a",
+        settings["audio_bitrate"],
+        "-ar",
+        str(constants.AUDIO_FPS),
+        "-ac",
+        "2",
+        "-threads",
+        str(threads),
+    ]
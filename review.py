@@ -0,0 +1,166 @@
+import os
+import pathlib
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import clip_cache
+import constants
+import instrument
+import probe
+import utils
+
+PREVIEW_MODES = ["proxy", "sheet"]
+
+
+def prefetch_clips(
+    pages,
+    download_url,
+    mode: str = "proxy",
+    prefetch: int = constants.REVIEW_PREFETCH,
+):
+    # Yields (clip data, preview URL, downloaded clip) for each clip in pages, in order. Pages
+    # are requested and clips downloaded and previewed in the background, up to prefetch clips
+    # ahead of the one being reviewed. Each review gets its own directory, so reviews running
+    # at the same time keep their files; downloads that weren't promoted are deleted with it
+    # once the generator is closed
+    os.makedirs(constants.REVIEW_DIR, exist_ok=True)
+    review_dir = tempfile.mkdtemp(dir=constants.REVIEW_DIR)
+    os.makedirs(os.path.join(review_dir, "previews"))
+    ready = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    done = object()
+
+    def offer(item):
+        # Waits for room in the queue, unless reviewing has finished
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce(session, executor):
+        try:
+            for data in pages:
+                if stop.is_set():
+                    return
+                url = download_url(data)
+                offer(
+                    (
+                        data,
+                        executor.submit(
+                            __prepare, session, data, url, mode, review_dir
+                        ),
+                    )
+                )
+            offer(done)
+        except Exception as err:
+            offer(err)  # Raised in the reviewing thread
+
+    workers = max(1, min(constants.DOWNLOAD_WORKERS, prefetch))
+    with utils.create_session(workers) as session, ThreadPoolExecutor(
+        workers
+    ) as executor:
+        producer = threading.Thread(
+            target=produce, args=(session, executor), daemon=True
+        )
+        producer.start()
+        try:
+            while (item := ready.get()) is not done:
+                if isinstance(item, Exception):
+                    raise item
+                data, future = item
+                if prepared := future.result():
+                    yield data, *prepared
+                else:
+                    print(f"Skipping {data['url']}, which couldn't be downloaded.")
+        finally:
+            stop.set()
+            # Unblock the producer if it's waiting on a full queue, then drop what it prefetched
+            while not ready.empty():
+                item = ready.get_nowait()
+                if isinstance(item, tuple):
+                    item[1].cancel()
+            producer.join()
+            executor.shutdown(cancel_futures=True)
+            shutil.rmtree(review_dir, ignore_errors=True)
+
+
+def promote_clip(slug: str, reviewed: str) -> str | None:
+    # Moves an accepted clip, downloaded for its review, into the clip cache so it isn't
+    # downloaded again
+    clip_path = clip_cache.cached_clip_path(clip_cache.clip_key(slug))
+    if reviewed == clip_path:
+        return clip_path  # It was cached already
+    if not os.path.exists(reviewed):
+        return None
+    os.makedirs(constants.CLIP_CACHE_DIR, exist_ok=True)
+    os.replace(reviewed, clip_path)
+    return clip_path
+
+
+def make_preview(clip_path: str, preview: str, mode: str = "proxy"):
+    # A small, fast encode to watch (proxy) or a grid of frames from across the clip (sheet)
+    command = [utils.ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error"]
+    if mode == "proxy":
+        command += [
+            "-i",
+            clip_path,
+            "-vf",
+            f"scale=-2:{constants.REVIEW_PROXY_HEIGHT}",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-crf",
+            "32",
+            "-c:a",
+            "aac",
+            "-b:a",
+            "64k",
+            "-threads",
+            "1",
+        ]
+    else:
+        # Frames are sampled evenly across the whole clip to fill the grid
+        columns, rows = constants.REVIEW_SHEET_TILES
+        duration = probe.probe(clip_path)["duration"] or 1
+        command += [
+            "-i",
+            clip_path,
+            "-vf",
+            f"fps={columns * rows}/{duration},scale=320:-2,tile={columns}x{rows}",
+            "-frames:v",
+            "1",
+            "-q:v",
+            "4",
+        ]
+    subprocess.run(command + [preview], check=True)
+
+
+def __prepare(
+    session, data: dict, url: str, mode: str, review_dir: str
+) -> tuple[str, str] | None:
+    # Downloads the clip unless it's cached already and renders its preview. Returns the
+    # preview's URL (the clip's page if the preview failed) and the clip's path, or None if the
+    # download failed
+    key = clip_cache.clip_key(data["url"])
+    clip_path = clip_cache.cached_clip_path(key)
+    if not os.path.exists(clip_path):
+        clip_path, _ = clip_cache.fetch_clip(session, url, key, review_dir)
+        if not clip_path:
+            return None
+
+    extension = ".mp4" if mode == "proxy" else ".jpg"
+    preview = os.path.join(review_dir, "previews", key + extension)
+    with instrument.span("preview", clip=key, mode=mode):
+        try:
+            make_preview(clip_path, preview, mode)
+        except subprocess.CalledProcessError:
+            print(f"Couldn't preview {data['url']}; opening it on Twitch instead.")
+            return data["url"], clip_path
+    return pathlib.Path(preview).as_uri(), clip_path
@@ -0,0 +1,41 @@
+import collections
+
+import constants
+
+
+class DurationBudget:
+    # Chooses clips for a video of about duration seconds, with at most per_broadcaster clips
+    # from each broadcaster. Helix lists clips by view count, so taking every clip that still
+    # fits, in order, greedily favours the most viewed ones. A clip taken is never swapped out
+    # for a later one, so paging can stop as soon as the video is (nearly) full
+    def __init__(self, duration: float = None, per_broadcaster: int = None):
+        self.duration = duration
+        self.per_broadcaster = per_broadcaster
+        self.length = 0
+        self.broadcasters = collections.Counter()
+        self.misses = 0  # Clips in a row that didn't fit
+
+    def take(self, data: dict) -> bool:
+        # Whether to include a clip, as returned by Helix; included clips use up the budget
+        broadcaster = data.get("broadcaster_id") or data["broadcaster_name"]
+        capped = (
+            self.per_broadcaster
+            and self.broadcasters[broadcaster] >= self.per_broadcaster
+        )
+        too_long = self.duration and self.length + data["duration"] > self.duration
+        if capped or too_long:
+            self.misses += 1
+            return False
+        self.misses = 0
+        self.length += data["duration"]
+        self.broadcasters[broadcaster] += 1
+        return True
+
+    def full(self) -> bool:
+        # Nearly full, or a page's worth of clips in a row didn't fit, so more pages won't help
+        if not self.duration:
+            return False
+        return (
+            self.duration - self.length < constants.SELECTION_SLACK
+            or self.misses >= constants.SELECTION_PATIENCE
+        )
@@ -0,0 +1,164 @@
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows; stores then only stay consistent within one process
+    fcntl = None
+
+import constants
+import files
+
+# Marks a key deleted in this process until the deletion is written
+DELETED = object()
+
+
+class JsonStore:
+    # A JSON object on disk, loaded once per process and served from memory
+    # Changes are written back in the background, a batch at a time, by replacing the file
+    # atomically under a file lock so concurrent runs never lose each other's keys
+    # With max_keys, the oldest keys are dropped once there are more than that
+    def __init__(
+        self,
+        path: str,
+        flush_delay: float = constants.STORE_FLUSH_DELAY,
+        max_keys: int = None,
+    ):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.max_keys = max_keys
+        self.__lock = threading.RLock()
+        self.__pending = {}  # Keys changed since the last flush
+        self.__timer = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.__file_lock():
+            self.__load()
+
+    def get(self, key: str, default=None):
+        with self.__lock:
+            if key not in self.__data and self.__changed_on_disk():
+                # Another process may have added it since this one loaded the file
+                with self.__file_lock():
+                    self.__load()
+            return self.__data.get(key, default)
+
+    def __getitem__(self, key: str):
+        if (value := self.get(key)) is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def keys(self) -> list[str]:
+        with self.__lock:
+            return list(self.__data)
+
+    def set(self, key: str, value):
+        with self.__lock:
+            self.__data[key] = value
+            self.__pending[key] = value
+            self.__schedule_flush()
+
+    __setitem__ = set
+
+    def delete(self, key: str):
+        with self.__lock:
+            self.__data.pop(key, None)
+            self.__pending[key] = DELETED
+            self.__schedule_flush()
+
+    def update(self, key: str, function, default=None):
+        # Read-modify-write against the newest copy on disk, e.g. to increment a counter
+        with self.__lock, self.__file_lock():
+            self.__load()
+            value = function(self.__data.get(key, default))
+            self.__data[key] = value
+            self.__pending[key] = value
+            self.__write()
+            return value
+
+    def flush(self):
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            if not self.__pending:
+                return
+            with self.__file_lock():
+                self.__load()
+                self.__write()
+
+    def __schedule_flush(self):
+        if self.__timer is None:
+            self.__timer = threading.Timer(self.flush_delay, self.flush)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def __load(self):
+        # Keys changed in this process but not yet written win over the file
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.__mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            data, self.__mtime = {}, None
+        except json.decoder.JSONDecodeError:
+            # Keep the broken file around rather than silently throwing its contents away
+            backup = f"{self.path}.corrupt-{int(time.time())}"
+            os.replace(self.path, backup)
+            print(f"{self.path} is corrupt; moved it to {backup} and starting empty.")
+            data, self.__mtime = {}, None
+        self.__data = {
+            key: value
+            for key, value in {**data, **self.__pending}.items()
+            if value is not DELETED
+        }
+
+    def __write(self):
+        if self.max_keys and len(self.__data) > self.max_keys:
+            # Keys are kept in the order they were added, so the oldest come first
+            for key in list(self.__data)[: len(self.__data) - self.max_keys]:
+                del self.__data[key]
+        files.write_json(self.__data, self.path, indent=2)
+        self.__mtime = os.stat(self.path).st_mtime_ns
+        self.__pending.clear()
+
+    def __changed_on_disk(self) -> bool:
+        try:
+            return os.stat(self.path).st_mtime_ns != self.__mtime
+        except FileNotFoundError:
+            return False
+
+    @contextlib.contextmanager
+    def __file_lock(self):
+        # Exclusive lock on a sidecar file, shared by every process using the same store
+        with open(self.path + ".lock", "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield  # Closing the file releases the lock
+
+
+__stores = {}
+__stores_lock = threading.Lock()
+
+
+def get_store(path: str, max_keys: int = None) -> JsonStore:
+    # One store per file per process, so every module shares the same in-memory copy
+    path = os.path.abspath(path)
+    with __stores_lock:
+        if path not in __stores:
+            __stores[path] = JsonStore(path, max_keys=max_keys)
+        return __stores[path]
+
+
+def flush_all():
+    for json_store in list(__stores.values()):
+        json_store.flush()
+
+
+atexit.register(flush_all)
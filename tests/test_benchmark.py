@@ -0,0 +1,52 @@
+import subprocess
+import sys
+
+import benchmark
+import constants
+
+
+def test_compare_with_previous_run(tmp_path):
+    path = str(tmp_path / "benchmarks.jsonl")
+    params = {"clips": 4}
+    benchmark.save_results(
+        {"params": {"clips": 8}, "results": {"download": {"wall_seconds": 9.0}}}, path
+    )
+    benchmark.save_results(
+        {"params": params, "results": {"download": {"wall_seconds": 2.0}}}, path
+    )
+    current = {"params": params, "results": {"download": {"wall_seconds": 3.0}}}
+
+    previous = benchmark.previous_results(params, path)
+
+    assert previous["results"]["download"]["wall_seconds"] == 2.0
+    assert benchmark.compare(current, previous) == [
+        f"{'download':<26} wall_seconds=3.00 (+50%)"
+    ]
+
+
+def test_bench_upload_sends_whole_video(tmp_path):
+    video = tmp_path / "final.mp4"
+    video.write_bytes(b"x" * (3 * 256 * 1024 + 5))
+
+    metrics = benchmark.bench_upload(str(video), chunk_size=256 * 1024)
+
+    assert metrics["mb_per_second"] > 0
+
+
+def test_import_seconds_reads_importtime():
+    assert 0 < benchmark.import_seconds("constants") < 5
+
+
+def test_main_starts_without_heavy_imports():
+    # MoviePy, numpy and Google's API client are only imported when rendering or uploading
+    code = "import sys, main; print(sorted(sys.modules))"
+    modules = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=constants.SCRIPT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+    for heavy in ["'moviepy'", "'numpy'", "'googleapiclient'", "'yt'"]:
+        assert heavy not in modules
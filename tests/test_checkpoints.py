@@ -0,0 +1,98 @@
+import hashlib
+import json
+
+import pytest
+
+import checkpoints
+import constants
+import jobs
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "CHECKPOINT_DIR", str(tmp_path / "runs"))
+    return tmp_path / "runs"
+
+
+def test_complete_saves_progress(checkpoint_dir):
+    job = jobs.make_job("Rust", {"num_clips": 10})
+    checkpoint = checkpoints.Checkpoint("run-1", [job], {"num_clips": 10})
+
+    checkpoint.complete(job, "discover", clips=["clip"])
+    checkpoint.complete(job, "discover")
+
+    saved = json.loads((checkpoint_dir / "run-1.json").read_text())
+    assert not saved["finished"]
+    assert saved["jobs"][0]["completed"] == ["discover"]
+    assert saved["jobs"][0]["clips"] == ["clip"]
+
+
+def test_load_round_trip():
+    job = jobs.make_job("Rust", {"num_clips": 10})
+    checkpoint = checkpoints.Checkpoint("run-1", [job], {"num_clips": 10})
+    checkpoint.complete(job, "discover")
+    checkpoint.finish()
+
+    loaded = checkpoints.load("run-1")
+
+    assert loaded.finished
+    assert loaded.options == {"num_clips": 10}
+    assert loaded.completed(loaded.jobs[0], "discover")
+    assert not loaded.completed(loaded.jobs[0], "download")
+
+
+def test_video_matches_only_unchanged_video(tmp_path):
+    output = tmp_path / "final_rust.mp4"
+    output.write_bytes(b"video")
+    job = {
+        "output": str(output),
+        "video_size": 5,
+        "video_sha256": hashlib.sha256(b"video").hexdigest(),
+    }
+    assert checkpoints.video_matches(job)
+
+    output.write_bytes(b"vide0")
+    assert not checkpoints.video_matches(job)
+
+    output.unlink()
+    assert not checkpoints.video_matches(job)
+
+
+def test_produce_skips_rendered_video(tmp_path, monkeypatch):
+    output = tmp_path / "final_rust.mp4"
+    output.write_bytes(b"video")
+    job = jobs.make_job("Rust", {"num_clips": 10})
+    job.update(
+        output=str(output),
+        video_size=5,
+        video_sha256=hashlib.sha256(b"video").hexdigest(),
+        completed=["discover", "download", "render"],
+    )
+    checkpoint = checkpoints.Checkpoint("run-1", [job])
+    # Nothing is downloaded or rendered again
+    monkeypatch.setattr(jobs.utils, "download_clips", pytest.fail)
+    monkeypatch.setattr(jobs.render, "concatenate_clips", pytest.fail)
+
+    jobs.produce(job, checkpoint=checkpoint)
+
+
+@pytest.mark.parametrize("stream_upload", [False, True])
+def test_resumed_run_skips_published_job(tmp_path, monkeypatch, stream_upload):
+    job = jobs.make_job(
+        "Rust", {"num_clips": 10, "youtube": True, "stream_upload": stream_upload}
+    )
+    # The earlier attempt already deleted the job's tmp dir and video
+    job.update(
+        tmp_dir=str(tmp_path / "tmp"),
+        output=str(tmp_path / "final_rust.mp4"),
+        video_id="abc123",
+        completed=list(checkpoints.STAGES),
+    )
+    checkpoint = checkpoints.Checkpoint("run-1", [job])
+    uploads = jobs.Uploads()
+    monkeypatch.setattr(uploads, "service", lambda: None)
+    monkeypatch.setattr(jobs.utils, "download_clips", pytest.fail)
+
+    jobs.produce_and_publish(job, 1, uploads, checkpoint)
+
+    assert job["stage"] == "done"
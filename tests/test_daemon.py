@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+
+import pytest
+
+import constants
+import daemon
+import jobs
+import twitch
+
+
+@pytest.fixture(autouse=True)
+def spool_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(
+        constants, "DAEMON_STATUS_PATH", str(tmp_path / "spool" / "status.json")
+    )
+    monkeypatch.setattr(constants, "TMP_DIR", str(tmp_path / "tmp"))
+    return tmp_path / "spool"
+
+
+def test_submit_queues_job(spool_dir):
+    job_id = daemon.submit({"game": "Rust", "num_clips": 10})
+
+    queued = json.loads((spool_dir / "queue" / f"{job_id}.json").read_text())
+    assert queued["entry"] == {"game": "Rust", "num_clips": 10}
+
+
+def test_submit_rejects_invalid_job(spool_dir):
+    with pytest.raises(ValueError):
+        daemon.submit({"game": "Rust"})
+    assert not daemon.job_files("queue")
+
+
+def test_daemon_requeues_interrupted_jobs(spool_dir):
+    job_id = daemon.submit({"game": "Rust", "num_clips": 10})
+    (spool_dir / "running").mkdir()
+    (spool_dir / "queue" / f"{job_id}.json").rename(
+        spool_dir / "running" / f"{job_id}.json"
+    )
+
+    daemon.Daemon(client=None)
+
+    assert daemon.job_files("queue") == [f"{job_id}.json"]
+
+
+def test_daemon_runs_queued_jobs(spool_dir, monkeypatch):
+    monkeypatch.setattr(
+        twitch,
+        "get_game_ids",
+        lambda games, client: ({"Rust": "1"}, {}) if "Rust" in games else ({}, {}),
+    )
+    monkeypatch.setattr(
+        jobs, "discover", lambda job, client: job.update(clips=["clip"] * 3)
+    )
+    produced = []
+    monkeypatch.setattr(
+        jobs,
+        "produce_and_publish",
+        lambda job, cpus, uploads: produced.append(job["output"]),
+    )
+    rust = daemon.submit({"game": "Rust", "num_clips": 10})
+    unknown = daemon.submit({"game": "Not a game", "num_clips": 10})
+
+    server = daemon.Daemon(client=None, poll=0.01)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    while len(daemon.job_files("done") + daemon.job_files("failed")) < 2:
+        time.sleep(0.01)
+    server.stop()
+    thread.join()
+
+    assert produced == [f"final_{rust}.mp4"]
+    assert daemon.job_files("done") == [f"{rust}.json"]
+    assert daemon.job_files("failed") == [f"{unknown}.json"]
+    status = json.loads((spool_dir / "status.json").read_text())
+    assert (status["queued"], status["done"], status["failed"]) == (0, 1, 1)
+
+
+def test_daemon_fails_broken_job_files(spool_dir, monkeypatch):
+    monkeypatch.setattr(twitch, "get_game_ids", lambda games, client: ({}, {}))
+    (spool_dir / "queue").mkdir(parents=True)
+    (spool_dir / "queue" / "1-broken.json").write_text('{"entry": {"game": "Rust",}}')
+    (spool_dir / "queue" / "2-no-game.json").write_text('{"entry": {}}')
+    unknown = daemon.submit({"game": "Not a game", "num_clips": 10})
+
+    server = daemon.Daemon(client=None, poll=0.01)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    while len(daemon.job_files("failed")) < 3:
+        time.sleep(0.01)
+    server.stop()
+    thread.join()
+
+    assert daemon.job_files("failed") == [
+        "1-broken.json",
+        "2-no-game.json",
+        f"{unknown}.json",
+    ]
+    assert not server.running
+    status = json.loads((spool_dir / "status.json").read_text())
+    assert (status["queued"], status["failed"]) == (0, 3)
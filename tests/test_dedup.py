@@ -0,0 +1,59 @@
+import numpy as np
+
+import dedup
+
+
+def example_clip(i, **data):
+    return {
+        "id": f"Clip{i}",
+        "broadcaster_id": "1",
+        "video_id": "100",
+        "vod_offset": 0,
+        "duration": 30,
+        "created_at": "2023-01-01T12:00:00Z",
+        **data,
+    }
+
+
+def test_is_duplicate_when_vod_windows_overlap():
+    kept = [example_clip(0, vod_offset=100)]
+
+    assert dedup.is_duplicate(example_clip(1, vod_offset=110), kept)
+    assert not dedup.is_duplicate(example_clip(2, vod_offset=125), kept)
+    assert not dedup.is_duplicate(
+        example_clip(3, vod_offset=110, broadcaster_id="2"), kept
+    )
+
+
+def test_is_duplicate_falls_back_to_creation_time_without_vod():
+    kept = [example_clip(0, video_id="", vod_offset=None)]
+
+    assert dedup.is_duplicate(
+        example_clip(1, video_id="", created_at="2023-01-01T12:00:05Z"), kept
+    )
+    assert not dedup.is_duplicate(
+        example_clip(2, video_id="", created_at="2023-01-01T12:05:00Z"), kept
+    )
+
+
+def test_footage_overlap_matches_shifted_frames():
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 2, size=(20, 64)).astype(bool)
+    other = rng.integers(0, 2, size=(10, 64)).astype(bool)
+
+    assert dedup.footage_overlap(frames[5:15], frames) == 1.0
+    assert dedup.footage_overlap(other, frames) < 0.5
+
+
+def test_duplicate_footage_only_compares_within_groups(monkeypatch):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 2, size=(10, 64)).astype(bool)
+    other = rng.integers(0, 2, size=(10, 64)).astype(bool)
+    hashes = {"a.mp4": frames, "b.mp4": other, "c.mp4": frames, "d.mp4": frames}
+    monkeypatch.setattr(dedup, "frame_hashes", hashes.get)
+
+    duplicates = dedup.duplicate_footage(
+        list(hashes), ["streamer0", "streamer0", "streamer0", "streamer1"]
+    )
+
+    assert duplicates == [2]
@@ -0,0 +1,17 @@
+import json
+import os
+
+import pytest
+
+import files
+
+
+def test_write_json_keeps_old_file_when_write_fails(tmp_path):
+    path = str(tmp_path / "state.json")
+    files.write_json({"saved": 1}, path)
+
+    with pytest.raises(TypeError):
+        files.write_json({"saved": object()}, path)
+
+    assert json.loads(open(path).read()) == {"saved": 1}
+    assert os.listdir(tmp_path) == ["state.json"]
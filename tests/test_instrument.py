@@ -0,0 +1,73 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import instrument
+
+
+def test_span_without_recording_is_a_no_op():
+    with instrument.span("download", clip="a") as span:
+        span["bytes"] = 10
+
+    assert span == {"clip": "a", "bytes": 10}
+
+
+def test_recording_reports_stages(tmp_path):
+    with instrument.recording(options={"engine": "ffmpeg"}) as recorder:
+        threads = [
+            threading.Thread(target=lambda i=i: fake_download(i)) for i in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with instrument.span("encode"):
+            pass
+
+    report = json.loads(open(recorder.write_report(str(tmp_path / "run.json"))).read())
+
+    assert report["options"] == {"engine": "ffmpeg"}
+    assert report["stages"]["download_clip"]["count"] == 3
+    assert report["stages"]["download_clip"]["bytes"] == 3 * 100
+    assert report["stages"]["encode"]["count"] == 1
+    assert sorted(
+        span["clip"] for span in report["spans"] if span["name"] == "download_clip"
+    ) == [0, 1, 2]
+    assert report["peak_rss_bytes"] > 0
+
+
+def fake_download(i):
+    with instrument.span("download_clip", clip=i) as span:
+        span["bytes"] = 100
+
+
+def test_trace_has_spans_from_worker_threads(tmp_path):
+    def encode(i):
+        with instrument.span("normalize_clip", clip=i):
+            pass
+
+    with instrument.recording() as recorder:
+        with ThreadPoolExecutor(2) as executor:
+            list(executor.map(encode, range(2)))
+
+    recorder.write_trace(str(tmp_path / "trace.json"))
+    trace = json.loads((tmp_path / "trace.json").read_text())
+
+    events = [e for e in trace["traceEvents"] if e["name"] == "normalize_clip"]
+    assert all(event["ph"] == "X" for event in events)
+    assert sorted(event["args"]["clip"] for event in events) == [0, 1]
+
+
+def test_recorder_keeps_latest_spans_and_samples():
+    recorder = instrument.Recorder(max_spans=2, max_samples=3)
+    for i in range(5):
+        recorder.monitor.samples.append((100.0 + i, 10 * (i + 1), i))
+        recorder.record("download_clip", 100.0 + i, 100.5 + i, clip=i)
+
+    report = recorder.report()
+
+    assert len(recorder.monitor.samples) == 3
+    assert [span["clip"] for span in report["spans"]] == [3, 4]
+    # Each span's peaks still come from the samples taken while it was open
+    assert [span["peak_rss_bytes"] for span in report["spans"]] == [40, 50]
+    assert report["stages"]["download_clip"]["peak_ffmpeg_processes"] == 4
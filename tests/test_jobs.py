@@ -0,0 +1,89 @@
+import json
+import os
+
+import pytest
+
+import jobs
+
+
+def test_load_manifest_overrides_options(tmp_path):
+    manifest = tmp_path / "batch.json"
+    manifest.write_text(json.dumps(["Rust", {"game": "Minecraft", "num_clips": 5}]))
+
+    rust, minecraft = jobs.load_manifest(str(manifest), {"num_clips": 10})
+
+    assert (rust["game"], rust["num_clips"]) == ("Rust", 10)
+    assert (minecraft["game"], minecraft["num_clips"]) == ("Minecraft", 5)
+
+
+@pytest.mark.parametrize(
+    "text", ['["Rust", "Minecraft",]', '{"game": "Rust"}', '[{"num_clips": 5}]']
+)
+def test_load_manifest_rejects_invalid_manifest(tmp_path, text):
+    manifest = tmp_path / "batch.json"
+    manifest.write_text(text)
+
+    with pytest.raises(ValueError, match="Invalid manifest"):
+        jobs.load_manifest(str(manifest))
+
+    assert manifest.read_text() == text  # The user's file is never rewritten
+
+
+def test_prepare_batch_separates_outputs():
+    batch = [
+        jobs.make_job(game, {"num_clips": 10}) for game in ["Rust", "rust", "FIFA 23"]
+    ]
+
+    jobs.prepare_batch(batch)
+
+    assert len({job["tmp_dir"] for job in batch}) == 3
+    assert [job["output"] for job in batch] == [
+        "final_rust.mp4",
+        "final_rust_.mp4",
+        "final_fifa_23.mp4",
+    ]
+
+
+def test_prepare_batch_rejects_manual_mode():
+    with pytest.raises(ValueError):
+        jobs.prepare_batch([jobs.make_job("Rust")])
+
+
+def test_prepare_batch_rejects_unknown_profile():
+    with pytest.raises(ValueError):
+        jobs.prepare_batch(
+            [jobs.make_job("Rust", {"num_clips": 10, "profile": "fast"})]
+        )
+
+
+def test_produce_drops_clips_that_failed_to_download(tmp_path, monkeypatch):
+    job = jobs.make_job("Rust", {"num_clips": 3, "engine": "ffmpeg"})
+    job.update(
+        tmp_dir=str(tmp_path / "tmp"),
+        output=str(tmp_path / "final.mp4"),
+        clips=["a.mp4", "b.mp4", "c.mp4"],
+        slugs=["slug-a", "slug-b", "slug-c"],
+        names=["a", "b", "c"],
+    )
+
+    def download_clips(clips, workers, slugs, cache_size, tmp_dir):
+        os.makedirs(tmp_dir)
+        for i in [0, 2]:  # The second clip failed
+            with open(os.path.join(tmp_dir, f"{i}.mp4"), "wb") as f:
+                f.write(b"clip")
+
+    rendered = []
+    monkeypatch.setattr(jobs.utils, "download_clips", download_clips)
+    monkeypatch.setattr(
+        jobs.render,
+        "concatenate_clips",
+        lambda names, cpus, tmp_dir, output, profile: rendered.append(
+            (names, sorted(os.listdir(tmp_dir)))
+        ),
+    )
+
+    jobs.produce(job)
+
+    assert job["slugs"] == ["slug-a", "slug-c"]
+    assert job["names"] == ["a", "c"]
+    assert rendered == [(["a", "c"], ["0.mp4", "1.mp4"])]
@@ -0,0 +1,42 @@
+import pytest
+from PIL import Image
+
+import constants
+import overlays
+
+
+@pytest.fixture(autouse=True)
+def tmp_overlay_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "OVERLAY_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_badge_matches_logo_height():
+    logo = Image.open(overlays.logo_path())
+    badge = Image.open(overlays.badge_path("streamer"))
+
+    assert badge.height == logo.height
+    assert badge.mode == "RGBA"
+
+
+def test_badge_is_rendered_once(monkeypatch):
+    path = overlays.badge_path("streamer")
+
+    def fail(image, path):
+        raise AssertionError("badge was rendered again")
+
+    monkeypatch.setattr(overlays, "__save", fail)
+
+    assert overlays.badge_path("streamer") == path
+
+
+def test_badge_depends_on_text():
+    assert overlays.badge_path("streamer") != overlays.badge_path("other streamer")
+
+
+def test_header_places_badge_right_of_logo():
+    logo = Image.open(overlays.logo_path())
+    badge = Image.open(overlays.badge_path("streamer"))
+    header = Image.open(overlays.header_path("streamer"))
+
+    assert header.size == (logo.width + badge.width, logo.height)
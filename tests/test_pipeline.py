@@ -0,0 +1,120 @@
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+import constants
+import pipeline
+
+
+@pytest.fixture(autouse=True)
+def pipeline_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "TMP_DIR", str(tmp_path / "tmp"))
+    monkeypatch.setattr(constants, "CLIP_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(constants, "SEGMENT_CACHE_DIR", str(tmp_path / "segments"))
+
+
+def fake_probe(path):
+    # Test clips and segments hold their duration in seconds
+    with open(path) as f:
+        return {"duration": float(f.read()), "video_fps": 30.0, "audio_found": True}
+
+
+def test_download_and_render_keeps_order_and_skips_failed_clip(monkeypatch):
+    count = 12
+    failed = 3
+
+    def fetch_clip(session, url, key):
+        i = int(key)
+        time.sleep(0.01 * (count - i))  # Later clips finish downloading first
+        if i == failed:
+            return None, 0
+        clip_path = os.path.join(constants.CLIP_CACHE_DIR, f"{key}.mp4")
+        with open(clip_path, "wt") as f:
+            f.write(str(i + 1))
+        return clip_path, 1
+
+    encoding = []
+
+    def normalize_clip(clip, header, info, fps, segment, threads, profile):
+        encoding.append(segment)
+        time.sleep(0.01)  # Slower than downloading, so downloads have to wait
+        shutil.copyfile(clip, segment)
+
+    concatenated = []
+    monkeypatch.setattr(pipeline.clip_cache, "fetch_clip", fetch_clip)
+    monkeypatch.setattr(pipeline.probe, "probe", fake_probe)
+    monkeypatch.setattr(pipeline.overlays, "header_path", lambda name: f"{name}.png")
+    monkeypatch.setattr(pipeline.render, "normalize_clip", normalize_clip)
+    monkeypatch.setattr(
+        pipeline.utils,
+        "concat_segments",
+        lambda segments, output, tmp_dir: concatenated.extend(segments),
+    )
+
+    results = []
+    runner = threading.Thread(
+        target=lambda: results.append(
+            pipeline.download_and_render(
+                [f"https://clips.example/{i}.mp4" for i in range(count)],
+                [f"https://clips.twitch.tv/{i}" for i in range(count)],
+                [f"streamer{i}" for i in range(count)],
+                download_workers=4,
+                render_workers=1,
+                cpus=1,
+            )
+        )
+    )
+    runner.start()
+    runner.join(timeout=30)
+
+    assert not runner.is_alive(), "the pipeline deadlocked"
+    kept = [i for i in range(count) if i != failed]
+    assert [fake_probe(segment)["duration"] for segment in concatenated] == [
+        i + 1 for i in kept
+    ]
+    assert len(encoding) == len(kept)
+    starts = [0]
+    for i in kept[:-1]:
+        starts.append(starts[-1] + i + 1)
+    assert results == [starts]
+
+
+def test_download_and_render_fails_instead_of_hanging(monkeypatch):
+    count = 12
+
+    def fetch_clip(session, url, key):
+        clip_path = os.path.join(constants.CLIP_CACHE_DIR, f"{key}.mp4")
+        with open(clip_path, "wt") as f:
+            f.write("1")
+        return clip_path, 1
+
+    def broken_probe(path):
+        raise ValueError(f"can't probe {path}")
+
+    monkeypatch.setattr(pipeline.clip_cache, "fetch_clip", fetch_clip)
+    monkeypatch.setattr(pipeline.probe, "probe", broken_probe)
+
+    errors = []
+
+    def run():
+        try:
+            pipeline.download_and_render(
+                [f"https://clips.example/{i}.mp4" for i in range(count)],
+                [f"https://clips.twitch.tv/{i}" for i in range(count)],
+                [f"streamer{i}" for i in range(count)],
+                download_workers=4,
+                render_workers=1,
+                cpus=1,
+            )
+        except ValueError as err:
+            errors.append(err)
+
+    runner = threading.Thread(target=run, daemon=True)
+    runner.start()
+    runner.join(timeout=30)
+
+    assert not runner.is_alive(), "the pipeline hung"
+    assert len(errors) == 1
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+import constants
+import jobs
+import plans
+
+
+@pytest.fixture(autouse=True)
+def plan_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "CLIP_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(
+        constants, "BENCHMARK_RESULTS_PATH", str(tmp_path / "benchmarks.jsonl")
+    )
+
+
+def discovered_job():
+    job = jobs.make_job("Rust", {"num_clips": 2})
+    job["game_id"] = "263490"
+    job["clip_data"] = [
+        {
+            "id": f"Clip{i}",
+            "url": f"https://clips.twitch.tv/Clip{i}",
+            "broadcaster_name": f"streamer{i}",
+            "duration": 30.0,
+            "view_count": 100 - i,
+        }
+        for i in range(2)
+    ]
+    job["clips"] = [f"https://clips-media.example/clip-{i}.mp4" for i in range(2)]
+    return job
+
+
+def test_make_plan_previews_timestamps_and_skips_cached_downloads(tmp_path):
+    (tmp_path / "cache").mkdir()
+    (tmp_path / "cache" / "Clip1.mp4").write_bytes(b"clip")
+
+    plan = plans.make_plan(discovered_job())
+
+    assert [clip["start"] for clip in plan["clips"]] == [0, 30.0]
+    assert plan["clips"][1]["download_url"] == "https://clips-media.example/clip-1.mp4"
+    assert plan["duration"] == 60.0
+    assert plan["estimates"]["cached_clips"] == 1
+    assert plan["estimates"]["download_bytes"] == 30 * constants.PLAN_CLIP_BITRATE / 8
+
+
+def test_encode_speed_prefers_benchmark(tmp_path):
+    entry = {
+        "params": {"profile": "draft"},
+        "results": {"render:moviepy": {"video_seconds_per_second": 5.0}},
+    }
+    (tmp_path / "benchmarks.jsonl").write_text(json.dumps(entry) + "\n")
+
+    assert plans.encode_speed("draft", "moviepy") == 5.0
+    assert plans.encode_speed("draft", "ffmpeg") == constants.PLAN_ENCODE_SPEED["draft"]
+
+
+@pytest.mark.parametrize("name", ["plan.json", "plan.jsonl"])
+def test_load_plan_skips_discovery(tmp_path, name):
+    path = str(tmp_path / name)
+    plans.write_plans([plans.make_plan(discovered_job())], path)
+
+    [job] = jobs.load_plan(path, {"profile": "draft"})
+    jobs.discover(job, client=None)
+
+    assert job["profile"] == "draft"
+    assert (job["game_id"], job["num_clips"]) == ("263490", 2)
+    assert job["slugs"] == [
+        "https://clips.twitch.tv/Clip0",
+        "https://clips.twitch.tv/Clip1",
+    ]
+    assert job["names"] == ["streamer0", "streamer1"]
@@ -0,0 +1,77 @@
+from moviepy.video.io import ffmpeg_reader
+
+import clip_cache
+import constants
+import probe
+import store
+
+
+def test_probe_reads_each_file_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "PROBE_CACHE_PATH", str(tmp_path / "probes.json"))
+    calls = []
+
+    def fake_parse_infos(path):
+        calls.append(path)
+        return {"duration": 3.0, "video_size": [1920, 1080], "video_fps": 60.0}
+
+    monkeypatch.setattr(ffmpeg_reader, "ffmpeg_parse_infos", fake_parse_infos)
+    clip = tmp_path / "clip.mp4"
+    clip.write_bytes(b"clip")
+    link = tmp_path / "0.mp4"
+    link.hardlink_to(clip)
+
+    assert probe.probe(str(clip))["duration"] == 3.0
+    assert probe.probe(str(link))["video_fps"] == 60.0
+    assert calls == [str(clip)]
+
+
+def test_evicted_clip_is_forgotten(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "PROBE_CACHE_PATH", str(tmp_path / "probes.json"))
+    monkeypatch.setattr(
+        ffmpeg_reader, "ffmpeg_parse_infos", lambda path: {"duration": 3.0}
+    )
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    clip = cache_dir / "clip.mp4"
+    clip.write_bytes(b"clip")
+    probe.probe(str(clip))
+
+    clip_cache.evict(0, cache_dir=str(cache_dir))
+
+    assert not clip.exists()
+    assert store.get_store(constants.PROBE_CACHE_PATH).keys() == []
+
+
+def test_clip_steps_skips_conversions_for_matching_clips():
+    info = {
+        "video_size": [1920, 1080],
+        "video_fps": 60.0,
+        "audio_found": True,
+        "audio_fps": constants.AUDIO_FPS,
+    }
+
+    assert probe.clip_steps(info, 60.0) == []
+
+
+def test_clip_steps_lists_every_needed_conversion():
+    info = {"video_size": [1280, 720], "video_fps": 30.0, "audio_found": False}
+
+    assert probe.clip_steps(info, 60.0) == ["scale", "retime", "silence"]
+    assert probe.clip_steps(
+        {**info, "audio_found": True, "audio_fps": 48000}, 30.0
+    ) == [
+        "scale",
+        "resample",
+    ]
+
+
+def test_clip_steps_accounts_for_rotation():
+    info = {
+        "video_size": [1080, 1920],
+        "video_rotation": 90,
+        "video_fps": 60.0,
+        "audio_found": True,
+        "audio_fps": constants.AUDIO_FPS,
+    }
+
+    assert probe.clip_steps(info, 60.0) == []
@@ -0,0 +1,148 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import constants
+import render
+
+example_infos = [
+    {"duration": 10.5, "video_fps": 30.0, "audio_found": True},
+    {"duration": 4.0, "video_fps": 60.0, "audio_found": False},
+]
+
+
+def test_build_filter_graph_concatenates_every_clip():
+    filter_graph = render.build_filter_graph(example_infos)
+
+    assert filter_graph.endswith("[v0][a0][v1][a1]concat=n=2:v=1:a=1[v][a]")
+
+
+def test_build_filter_graph_overlays_each_clip_with_its_own_image():
+    filter_graph = render.build_filter_graph(example_infos)
+
+    assert "[bg0][2:v]overlay" in filter_graph
+    assert "[bg1][3:v]overlay" in filter_graph
+
+
+def test_build_filter_graph_uses_highest_fps():
+    assert "fps=60.0" in render.build_filter_graph(example_infos)
+
+
+def test_build_filter_graph_fills_missing_audio_with_silence():
+    filter_graph = render.build_filter_graph(example_infos)
+
+    assert "[0:a]aresample" in filter_graph
+    assert "[1:a]" not in filter_graph
+    assert "anullsrc" in filter_graph
+
+
+def test_segment_path_changes_with_overlay():
+    info = example_infos[0]
+
+    assert render.segment_path("clip", "header-a.png", info, 30.0) == (
+        render.segment_path("clip", "header-a.png", info, 30.0)
+    )
+    assert render.segment_path("clip", "header-a.png", info, 30.0) != (
+        render.segment_path("clip", "header-b.png", info, 30.0)
+    )
+
+
+def test_segment_path_changes_with_render_settings():
+    info = example_infos[0]
+
+    assert render.segment_path("clip", "header-a.png", info, 30.0) != (
+        render.segment_path("clip", "header-a.png", info, 60.0)
+    )
+
+
+def test_build_filter_graph_skips_conversions_clips_dont_need():
+    info = {
+        "duration": 5.0,
+        "video_size": [1920, 1080],
+        "video_fps": 60.0,
+        "audio_found": True,
+        "audio_fps": 44100,
+    }
+    filter_graph = render.build_filter_graph([info])
+
+    assert "scale=" not in filter_graph
+    assert "fps=" not in filter_graph
+    assert "aresample" not in filter_graph
+
+
+def test_segment_path_changes_with_profile():
+    info = example_infos[0]
+
+    assert render.segment_path("clip", "header.png", info, 30.0, "draft") != (
+        render.segment_path("clip", "header.png", info, 30.0, "archive")
+    )
+    assert render.segment_path("clip", "header.png", info, 30.0) == (
+        render.segment_path("clip", "header.png", info, 30.0, "standard")
+    )
+
+
+def fake_probe(path):
+    # Test clips and segments hold their duration in seconds
+    with open(path) as f:
+        duration = float(f.read())
+    return {
+        "duration": duration,
+        "video_size": [1920, 1080],
+        "video_fps": 30.0,
+        "video_rotation": 0,
+        "audio_found": True,
+        "audio_fps": 44100,
+    }
+
+
+def fake_encode_segment(clip, header, info, fps, segment, threads, profile):
+    shutil.copyfile(clip, segment)
+
+
+def test_normalize_and_concatenate_clips_keeps_clip_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "SEGMENT_CACHE_DIR", str(tmp_path / "segments"))
+    monkeypatch.setattr(render.probe, "probe", fake_probe)
+    monkeypatch.setattr(render.overlays, "header_path", lambda name: f"{name}.png")
+    # Inherited by the forked encoding workers
+    monkeypatch.setattr(render, "__encode_segment", fake_encode_segment)
+    concatenated = []
+    monkeypatch.setattr(
+        render.utils,
+        "concat_segments",
+        lambda segments, output, tmp_dir: concatenated.extend(segments),
+    )
+    tmp_dir = tmp_path / "tmp"
+    tmp_dir.mkdir()
+    # Clip 1 failed to download
+    for i, duration in [(0, 3.0), (2, 5.0), (10, 4.0)]:
+        (tmp_dir / f"{i}.mp4").write_text(str(duration))
+    names = [f"streamer{i}" for i in range(11)]
+
+    timestamps = render.normalize_and_concatenate_clips(
+        names, 2, cpus=2, tmp_dir=str(tmp_dir), output=str(tmp_path / "final.mp4")
+    )
+
+    assert [fake_probe(segment)["duration"] for segment in concatenated] == [
+        3.0,
+        5.0,
+        4.0,
+    ]
+    assert timestamps == [0, 3.0, 8.0]
+
+
+def test_failed_encode_leaves_no_part_file(tmp_path, monkeypatch):
+    def failing_ffmpeg(command, check):
+        # Writes part of its output, then fails
+        with open(command[-1], "wb") as f:
+            f.write(b"partial")
+        raise subprocess.CalledProcessError(1, command)
+
+    monkeypatch.setattr(render.subprocess, "run", failing_ffmpeg)
+    segment = str(tmp_path / "segment.mp4")
+
+    with pytest.raises(subprocess.CalledProcessError):
+        render.normalize_clip("clip.mp4", "header.png", example_infos[0], 30.0, segment)
+
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+import responses
+
+import clip_cache
+import constants
+import review
+
+example_pages = [
+    {
+        "url": f"https://clips.twitch.tv/Clip{i}",
+        "download": f"https://clips-media-assets2.twitch.tv/clip-{i}.mp4",
+    }
+    for i in range(6)
+]
+
+
+@pytest.fixture
+def review_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "CLIP_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(constants, "REVIEW_DIR", str(tmp_path / "review"))
+    # Test clips aren't real videos, so treat anything non-empty as playable
+    monkeypatch.setattr(
+        clip_cache, "probe_duration", lambda clip_path: os.path.getsize(clip_path)
+    )
+    monkeypatch.setattr(
+        review,
+        "make_preview",
+        lambda clip_path, preview, mode: open(preview, "wb").close(),
+    )
+    return tmp_path
+
+
+@responses.activate
+def test_prefetch_clips_keeps_page_order(review_dirs):
+    for i, data in enumerate(example_pages):
+        responses.add(responses.GET, data["download"], body=f"clip {i}".encode())
+
+    reviewed = list(
+        review.prefetch_clips(example_pages, lambda data: data["download"], prefetch=2)
+    )
+
+    assert [data for data, _, _ in reviewed] == example_pages
+    assert all(preview.startswith("file://") for _, preview, _ in reviewed)
+
+
+@responses.activate
+def test_prefetch_clips_skips_failed_downloads(review_dirs):
+    for i, data in enumerate(example_pages):
+        responses.add(
+            responses.GET, data["download"], body=b"clip", status=404 if i == 1 else 200
+        )
+
+    reviewed = review.prefetch_clips(example_pages, lambda data: data["download"])
+
+    assert [data["url"] for data, _, _ in reviewed] == [
+        data["url"] for i, data in enumerate(example_pages) if i != 1
+    ]
+
+
+@responses.activate
+def test_promoted_clips_are_kept_and_the_rest_deleted(review_dirs):
+    for i, data in enumerate(example_pages):
+        responses.add(responses.GET, data["download"], body=f"clip {i}".encode())
+
+    reviewed = review.prefetch_clips(example_pages, lambda data: data["download"])
+    data, _, reviewed_clip = next(reviewed)
+    clip_path = review.promote_clip(data["url"], reviewed_clip)
+    reviewed.close()
+
+    assert open(clip_path, "rb").read() == b"clip 0"
+    assert clip_path == clip_cache.cached_clip_path("Clip0")
+    assert os.listdir(constants.REVIEW_DIR) == []
+
+
+@responses.activate
+def test_closing_a_review_keeps_other_reviews_files(review_dirs):
+    for i, data in enumerate(example_pages):
+        responses.add(responses.GET, data["download"], body=f"clip {i}".encode())
+
+    first = review.prefetch_clips(example_pages[:3], lambda data: data["download"])
+    second = review.prefetch_clips(example_pages[3:], lambda data: data["download"])
+    next(first)
+    data, preview, reviewed_clip = next(second)
+    first.close()
+
+    assert os.path.exists(reviewed_clip)
+    assert os.path.exists(preview[len("file://") :])
+    assert review.promote_clip(data["url"], reviewed_clip)
+    second.close()
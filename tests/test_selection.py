@@ -0,0 +1,36 @@
+import selection
+
+
+def clip(broadcaster, duration):
+    return {"broadcaster_name": broadcaster, "duration": duration}
+
+
+def test_budget_takes_clips_that_fit():
+    budget = selection.DurationBudget(100)
+
+    taken = [budget.take(clip(f"s{i}", d)) for i, d in enumerate([60, 50, 30, 20])]
+
+    assert taken == [True, False, True, False]
+    assert budget.length == 90
+    assert budget.full()
+
+
+def test_budget_caps_clips_per_broadcaster():
+    budget = selection.DurationBudget(per_broadcaster=2)
+
+    taken = [budget.take(clip(name, 30)) for name in ["a", "a", "b", "a"]]
+
+    assert taken == [True, True, True, False]
+    assert not budget.full()  # Without a duration, only the number of clips limits it
+
+
+def test_budget_gives_up_after_a_page_of_misses(monkeypatch):
+    monkeypatch.setattr(selection.constants, "SELECTION_PATIENCE", 3)
+    budget = selection.DurationBudget(100)
+    budget.take(clip("a", 60))
+
+    for _ in range(3):
+        assert not budget.full()
+        budget.take(clip("b", 50))
+
+    assert budget.full()
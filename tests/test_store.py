@@ -0,0 +1,85 @@
+import json
+import os
+
+import store
+
+
+def test_store_batches_writes(tmp_path):
+    path = tmp_path / "game_ids.json"
+    path.write_text(json.dumps({"rust": "263490"}))
+    game_ids = store.JsonStore(str(path), flush_delay=60)
+
+    game_ids.set("minecraft", "27471")
+    game_ids.set("fifa 23", "1745202732")
+
+    # Served from memory until the batch is flushed
+    assert game_ids.get("minecraft") == "27471"
+    assert "minecraft" not in json.loads(path.read_text())
+
+    game_ids.flush()
+
+    assert json.loads(path.read_text()) == {
+        "rust": "263490",
+        "minecraft": "27471",
+        "fifa 23": "1745202732",
+    }
+
+
+def test_store_merges_concurrent_writers(tmp_path):
+    path = str(tmp_path / "game_ids.json")
+    first, second = store.JsonStore(path), store.JsonStore(path)
+
+    first.set("rust", "263490")
+    second.set("minecraft", "27471")
+    first.flush()
+    second.flush()
+
+    assert json.loads(open(path).read()) == {"rust": "263490", "minecraft": "27471"}
+    # Keys added by another writer are picked up on a miss
+    assert first.get("minecraft") == "27471"
+
+
+def test_store_update_reads_latest(tmp_path):
+    path = str(tmp_path / "playlist_ids.json")
+    first, second = store.JsonStore(path), store.JsonStore(path)
+    first.update("27471", lambda entry: ["id", "title", 0])
+
+    first.update("27471", lambda entry: [*entry[:2], entry[2] + 1])
+    second.update("27471", lambda entry: [*entry[:2], entry[2] + 1])
+
+    assert json.loads(open(path).read()) == {"27471": ["id", "title", 2]}
+
+
+def test_store_keeps_corrupt_file(tmp_path):
+    path = tmp_path / "game_ids.json"
+    path.write_text('{"rust": ')
+
+    game_ids = store.JsonStore(str(path))
+
+    assert game_ids.get("rust") is None
+    backups = [file for file in os.listdir(tmp_path) if ".corrupt-" in file]
+    assert len(backups) == 1
+    assert (tmp_path / backups[0]).read_text() == '{"rust": '
+
+
+def test_store_delete_survives_reload(tmp_path):
+    path = tmp_path / "probes.json"
+    path.write_text(json.dumps({"a": 1, "b": 2}))
+    probes = store.JsonStore(str(path), flush_delay=60)
+
+    probes.delete("a")
+    probes.flush()
+
+    assert json.loads(path.read_text()) == {"b": 2}
+    assert store.JsonStore(str(path)).get("a") is None
+
+
+def test_store_drops_oldest_keys_beyond_max(tmp_path):
+    path = tmp_path / "probes.json"
+    probes = store.JsonStore(str(path), flush_delay=60, max_keys=2)
+
+    for key in ["a", "b", "c"]:
+        probes.set(key, 1)
+    probes.flush()
+
+    assert list(json.loads(path.read_text())) == ["b", "c"]
@@ -1,4 +1,5 @@
 import json
+import shutil
 
 import pytest
 import requests.exceptions
@@ -47,6 +48,15 @@ def test_request_oauth_raises_http_error():
         twitch.request_oauth(example_twitch_secret)
 
 
+@pytest.fixture(autouse=True)
+def game_ids(tmp_path, monkeypatch):
+    # Work on a copy, so tests never add games to the real game_ids.json
+    path = tmp_path / "game_ids.json"
+    shutil.copyfile(constants.GAME_IDS_PATH, path)
+    monkeypatch.setattr(constants, "GAME_IDS_PATH", str(path))
+    return path
+
+
 def test_read_game_id_from_cache_not_none():
     game = "rust"  # included by default in game_ids.json
 
@@ -66,3 +76,212 @@ def test_write_game_id_to_cache():
     twitch.__write_game_id_to_cache(game, game_id)
 
     assert twitch.__read_game_id_from_cache(game) == game_id
+
+
+@pytest.fixture
+def helix_client(tmp_path):
+    responses.add(
+        responses.POST,
+        constants.TWITCH_OAUTH_URL,
+        body=json.dumps(example_request_oauth_response),
+        status=200,
+        content_type="application/json",
+    )
+    with twitch.HelixClient(
+        example_twitch_secret, token_path=str(tmp_path / "token.json")
+    ) as client:
+        yield client
+
+
+def example_clip(i):
+    return {
+        "url": f"https://clips.twitch.tv/Clip{i}",
+        "thumbnail_url": f"https://clips-media-assets2.twitch.tv/clip-{i}-preview-480x272.jpg",
+        "broadcaster_name": f"streamer{i}",
+        "duration": 30,
+    }
+
+
+@responses.activate
+def test_helix_client_caches_token_on_disk(helix_client):
+    token = helix_client.token()
+    other_client = twitch.HelixClient(
+        example_twitch_secret, token_path=helix_client.token_path
+    )
+
+    assert other_client.token() == token
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_helix_client_refreshes_rejected_token(helix_client):
+    url = f"{constants.BASE_HELIX_URL}/games"
+    responses.add(responses.GET, url, status=401)
+    responses.add(responses.GET, url, json={"data": [{"id": "123"}]}, status=200)
+
+    assert helix_client.get("games")["data"] == [{"id": "123"}]
+    assert [call.request.method for call in responses.calls] == [
+        "POST",
+        "GET",
+        "POST",
+        "GET",
+    ]
+
+
+@responses.activate
+def test_helix_client_waits_for_rate_limit_reset(helix_client, monkeypatch):
+    url = f"{constants.BASE_HELIX_URL}/games"
+    sleeps = []
+    monkeypatch.setattr(twitch.time, "time", lambda: 1000.0)
+    monkeypatch.setattr(twitch.time, "sleep", sleeps.append)
+    headers = {"Ratelimit-Remaining": "0", "Ratelimit-Reset": "1005"}
+    responses.add(responses.GET, url, json={"data": []}, headers=headers)
+    responses.add(responses.GET, url, json={"data": []})
+
+    helix_client.get("games")
+    helix_client.get("games")
+
+    assert sleeps == [5.0]
+
+
+@responses.activate
+def test_get_clips_data_follows_pagination(helix_client):
+    url = f"{constants.BASE_HELIX_URL}/clips"
+    responses.add(
+        responses.GET,
+        url,
+        json={
+            "data": [example_clip(0), example_clip(1)],
+            "pagination": {"cursor": "a"},
+        },
+    )
+    responses.add(
+        responses.GET,
+        url,
+        json={
+            "data": [example_clip(2), example_clip(3)],
+            "pagination": {"cursor": "b"},
+        },
+    )
+
+    included = []
+    clips, slugs, names = twitch.get_clips_data(
+        "123", helix_client, 3, 7, included=included
+    )
+
+    assert clips == [
+        f"https://clips-media-assets2.twitch.tv/clip-{i}.mp4" for i in range(3)
+    ]
+    assert names == ["streamer0", "streamer1", "streamer2"]
+    assert included == [example_clip(i) for i in range(3)]
+    assert "after=a" in responses.calls[-1].request.url
+
+
+@responses.activate
+def test_get_clips_data_stops_paging_once_duration_is_filled(helix_client):
+    url = f"{constants.BASE_HELIX_URL}/clips"
+    responses.add(
+        responses.GET,
+        url,
+        json={
+            "data": [example_clip(i) for i in range(3)],
+            "pagination": {"cursor": "a"},
+        },
+    )
+
+    clips, _, _ = twitch.get_clips_data("123", helix_client, 0, 7, duration=60)
+
+    assert len(clips) == 2
+    assert "first=100" in responses.calls[-1].request.url
+    assert len([call for call in responses.calls if "/clips" in call.request.url]) == 1
+
+
+def test_normalize_game_name():
+    assert twitch.normalize_game_name(
+        "Counter-Strike: Global Offensive"
+    ) == twitch.normalize_game_name("counter strike  global offensive")
+    assert twitch.normalize_game_name("Ratchet & Clank") == "ratchet and clank"
+
+
+def test_read_game_id_from_cache_normalizes_name():
+    assert twitch.__read_game_id_from_cache("Battlefield-2042!") == "514974"
+
+
+@responses.activate
+def test_get_game_ids_requests_names_in_bulk(helix_client):
+    url = f"{constants.BASE_HELIX_URL}/games"
+    games = [f"game {i}" for i in range(60)]
+    responses.add(
+        responses.GET,
+        url,
+        json={"data": [{"name": f"Game {i}", "id": str(i)} for i in range(50)]},
+    )
+    responses.add(
+        responses.GET,
+        url,
+        json={"data": [{"name": f"Game {i}", "id": str(i)} for i in range(50, 60)]},
+    )
+
+    game_ids, suggestions = twitch.get_game_ids(["rust"] + games, helix_client)
+
+    assert game_ids == {
+        "rust": "263490",
+        **{game: str(i) for i, game in enumerate(games)},
+    }
+    assert not suggestions
+    # 120 names (as written and in title case) in requests of 100, plus the token request
+    assert len(responses.calls) == 3
+    assert twitch.__read_game_id_from_cache("Game 59") == "59"
+
+
+@responses.activate
+def test_get_game_ids_resolves_aliases(helix_client):
+    responses.add(
+        responses.GET,
+        f"{constants.BASE_HELIX_URL}/games",
+        json={"data": [{"name": "Counter-Strike: Global Offensive", "id": "32399"}]},
+    )
+
+    game_ids, _ = twitch.get_game_ids(["CSGO"], helix_client)
+
+    assert game_ids == {"CSGO": "32399"}
+    assert "Counter-Strike" in responses.calls[-1].request.url
+
+
+@responses.activate
+def test_get_game_ids_suggests_instead_of_prompting(helix_client, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda prompt: pytest.fail(prompt))
+    responses.add(responses.GET, f"{constants.BASE_HELIX_URL}/games", json={"data": []})
+    responses.add(
+        responses.GET,
+        f"{constants.BASE_HELIX_URL}/search/categories",
+        json={"data": [{"name": "Hogwarts Legacy"}, {"name": "Minecraft"}]},
+    )
+
+    game_ids, suggestions = twitch.get_game_ids(["hogwarts legcy"], helix_client)
+
+    assert game_ids == {}
+    assert suggestions["hogwarts legcy"][0].lower() == "hogwarts legacy"
+
+
+@responses.activate
+def test_get_game_id_fails_with_suggestions_instead_of_prompting(
+    helix_client, monkeypatch
+):
+    monkeypatch.setattr("builtins.input", lambda prompt: pytest.fail(prompt))
+    responses.add(responses.GET, f"{constants.BASE_HELIX_URL}/games", json={"data": []})
+    responses.add(
+        responses.GET,
+        f"{constants.BASE_HELIX_URL}/search/categories",
+        json={"data": [{"name": "Hogwarts Legacy"}]},
+    )
+
+    with pytest.raises(ValueError, match="(?i)did you mean: hogwarts legacy"):
+        twitch.get_game_id("hogwarts legcy", helix_client)
+
+
+def test_normalized_index_finds_newly_cached_names():
+    twitch.__read_game_id_from_cache("rust")  # Builds the index
+    twitch.__write_game_id_to_cache("Baldur's Gate 3", "123")
+
+    assert twitch.__read_game_id_from_cache("baldur-s gate: 3") == "123"
@@ -0,0 +1,197 @@
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import responses
+
+import clip_cache
+import constants
+import utils
+
+example_clip_urls = [
+    f"https://clips-media-assets2.twitch.tv/clip-{i}.mp4" for i in range(12)
+]
+
+
+@pytest.fixture
+def tmp_clip_dir(tmp_path, monkeypatch):
+    tmp_dir = tmp_path / "tmp"
+    monkeypatch.setattr(constants, "TMP_DIR", str(tmp_dir))
+    monkeypatch.setattr(constants, "CLIP_CACHE_DIR", str(tmp_path / "cache"))
+    # Test clips aren't real videos, so treat anything non-empty as playable
+    monkeypatch.setattr(
+        clip_cache, "probe_duration", lambda clip_path: os.path.getsize(clip_path)
+    )
+    return tmp_dir
+
+
+@responses.activate
+def test_download_clips_keeps_clip_order(tmp_clip_dir):
+    for i, url in enumerate(example_clip_urls):
+        responses.add(responses.GET, url, body=f"clip {i}".encode(), status=200)
+
+    utils.download_clips(example_clip_urls, workers=4)
+
+    for i in range(len(example_clip_urls)):
+        assert (tmp_clip_dir / f"{i}.mp4").read_bytes() == f"clip {i}".encode()
+
+
+@responses.activate
+def test_download_clips_skips_failed_clip(tmp_clip_dir):
+    responses.add(responses.GET, example_clip_urls[0], body=b"clip 0", status=200)
+    responses.add(responses.GET, example_clip_urls[1], body=b"", status=404)
+
+    utils.download_clips(example_clip_urls[:2], workers=2)
+
+    assert os.listdir(tmp_clip_dir) == ["0.mp4"]
+
+
+@responses.activate
+def test_download_clips_reuses_cached_clip(tmp_clip_dir):
+    responses.add(responses.GET, example_clip_urls[0], body=b"clip 0", status=200)
+
+    utils.download_clips(example_clip_urls[:1])
+    utils.download_clips(example_clip_urls[:1])
+
+    assert len(responses.calls) == 1
+    assert (tmp_clip_dir / "0.mp4").read_bytes() == b"clip 0"
+
+
+@responses.activate
+def test_download_clips_resumes_partial_clip(tmp_clip_dir):
+    key = clip_cache.clip_key(example_clip_urls[0])
+    os.makedirs(constants.CLIP_CACHE_DIR)
+    with open(clip_cache.cached_clip_path(key) + ".part", "wb") as f:
+        f.write(b"clip")
+    responses.add(
+        responses.GET,
+        example_clip_urls[0],
+        body=b" 0",
+        status=206,
+        headers={"Content-Range": "bytes 4-5/6"},
+    )
+
+    utils.download_clips(example_clip_urls[:1])
+
+    assert responses.calls[0].request.headers["Range"] == "bytes=4-"
+    assert (tmp_clip_dir / "0.mp4").read_bytes() == b"clip 0"
+
+
+@responses.activate
+def test_fetch_clip_shares_download_between_threads(tmp_clip_dir):
+    def slow_download(request):
+        time.sleep(0.2)  # Long enough for every thread to start fetching
+        return 200, {}, b"clip 0"
+
+    responses.add_callback(responses.GET, example_clip_urls[0], callback=slow_download)
+    os.makedirs(constants.CLIP_CACHE_DIR)
+    key = clip_cache.clip_key(example_clip_urls[0])
+
+    with utils.create_session(4) as session, ThreadPoolExecutor(4) as executor:
+        results = list(
+            executor.map(
+                lambda _: clip_cache.fetch_clip(session, example_clip_urls[0], key),
+                range(4),
+            )
+        )
+
+    assert {clip_path for clip_path, _ in results} == {clip_cache.cached_clip_path(key)}
+    assert len(responses.calls) == 1
+    assert os.listdir(constants.CLIP_CACHE_DIR) == [f"{key}.mp4"]
+    assert not getattr(clip_cache, "__path_locks")  # Dropped once unused
+
+
+@responses.activate
+def test_fetch_clip_waits_for_download_in_another_process(tmp_clip_dir):
+    os.makedirs(constants.CLIP_CACHE_DIR)
+    key = clip_cache.clip_key(example_clip_urls[0])
+    clip_path = clip_cache.cached_clip_path(key)
+    # Another run holds the partial download's lock until it has finished the clip
+    other_run = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import fcntl, os, sys, time\n"
+            "clip_path = sys.argv[1]\n"
+            "with open(clip_path + '.part', 'ab') as f:\n"
+            "    fcntl.flock(f, fcntl.LOCK_EX)\n"
+            "    print('locked', flush=True)\n"
+            "    time.sleep(0.5)\n"
+            "    f.write(b'clip 0')\n"
+            "    f.flush()\n"
+            "    os.replace(clip_path + '.part', clip_path)\n",
+            clip_path,
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert other_run.stdout.readline() == "locked\n"
+
+    with utils.create_session(1) as session:
+        result = clip_cache.fetch_clip(session, example_clip_urls[0], key)
+
+    assert other_run.wait() == 0
+    assert result == (clip_path, 0)
+    assert not responses.calls
+    assert os.listdir(constants.CLIP_CACHE_DIR) == [f"{key}.mp4"]
+
+
+def test_evict_removes_least_recently_used(tmp_clip_dir):
+    os.makedirs(constants.CLIP_CACHE_DIR)
+    for i in range(3):
+        path = clip_cache.cached_clip_path(str(i))
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+        os.utime(path, (i, i))
+
+    assert clip_cache.evict(20) == 1
+    assert sorted(os.listdir(constants.CLIP_CACHE_DIR)) == ["1.mp4", "2.mp4"]
+
+
+def test_clip_index_sorts_numerically():
+    clips = ["tmp/10.mp4", "tmp/2.mp4", "tmp/1.mp4"]
+
+    assert sorted(clips, key=utils.clip_index) == [
+        "tmp/1.mp4",
+        "tmp/2.mp4",
+        "tmp/10.mp4",
+    ]
+
+
+def test_resource_monitor_records_ffmpeg_high_water_mark(tmp_path):
+    # Processes are counted by name, so a sleep named ffmpeg stands in for an encoder
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.symlink_to(shutil.which("sleep"))
+
+    with utils.ResourceMonitor(interval=0.01) as monitor:
+        processes = [subprocess.Popen([str(ffmpeg), "5"]) for _ in range(2)]
+        time.sleep(0.3)
+        for process in processes:
+            process.kill()
+            process.wait()
+        time.sleep(0.1)
+
+    assert monitor.peak_ffmpeg_processes == 2
+    assert monitor.samples[-1][2] == 0
+    assert monitor.peak_rss >= max(rss for _, rss, _ in monitor.samples) > 0
+
+
+def test_concat_segments_lists_segments_in_order(tmp_path, monkeypatch):
+    commands = []
+    monkeypatch.setattr(
+        utils.subprocess, "run", lambda command, **_: commands.append(command)
+    )
+    segments = [str(tmp_path / name) for name in ["b.mp4", "a.mp4", "it's.mp4"]]
+
+    utils.concat_segments(segments, "final.mp4", str(tmp_path))
+
+    assert (tmp_path / "concat.txt").read_text().splitlines() == [
+        f"file '{tmp_path}/b.mp4'",
+        f"file '{tmp_path}/a.mp4'",
+        f"file '{tmp_path}/it'\\''s.mp4'",
+    ]
+    assert commands[0][-1] == "final.mp4"
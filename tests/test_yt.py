@@ -0,0 +1,206 @@
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httplib2
+import pytest
+from googleapiclient.http import HttpRequest, MediaFileUpload, build_http
+
+import yt
+
+CHUNK_SIZE = 256 * 1024
+
+
+class FakeResumableHandler(BaseHTTPRequestHandler):
+    # Just enough of YouTube's resumable upload protocol: POST starts a session, PUTs send chunks
+    def do_POST(self):
+        self.server.sessions += 1
+        self.server.received = b""
+        self.send_response(200)
+        self.send_header("Location", f"http://127.0.0.1:{self.server.server_port}/s")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.ranges.append(self.headers["Content-Range"])
+        match = re.match(r"bytes (\d+)-\d+/(\d+|\*)", self.headers["Content-Range"])
+        if match:
+            start, total = int(match[1]), match[2]
+            self.server.received = self.server.received[:start] + body
+        else:
+            # "bytes */total" asks how much of the upload the server already has
+            total = self.headers["Content-Range"].rsplit("/", 1)[-1]
+
+        # The total is "*" while the size of the upload isn't known yet
+        if total != "*" and len(self.server.received) == int(total):
+            content = json.dumps({"id": "video_id"}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_response(308)
+            if self.server.received:
+                self.send_header("Range", f"bytes=0-{len(self.server.received) - 1}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class CrashingHttp(httplib2.Http):
+    # Simulates the process being killed partway through the upload
+    def __init__(self, crash_after):
+        super().__init__()
+        self.redirect_codes = self.redirect_codes - {308}  # Same as build_http
+        self.crash_after = crash_after
+
+    def request(self, *args, **kwargs):
+        if self.crash_after == 0:
+            raise KeyboardInterrupt
+        self.crash_after -= 1
+        return super().request(*args, **kwargs)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeResumableHandler)
+    server.sessions = 0
+    server.received = b""
+    server.ranges = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "final.mp4"
+    path.write_bytes(bytes(range(256)) * (4 * CHUNK_SIZE // 256))
+    return str(path)
+
+
+def insert_request(server, video, http=None, media=None):
+    return HttpRequest(
+        http or build_http(),
+        lambda resp, content: json.loads(content),
+        f"http://127.0.0.1:{server.server_port}/upload",
+        method="POST",
+        body="{}",
+        headers={"content-type": "application/json"},
+        resumable=media or MediaFileUpload(video, chunksize=CHUNK_SIZE, resumable=True),
+    )
+
+
+def test_resumable_upload_uploads_in_chunks(server, video):
+    response = yt.resumable_upload(insert_request(server, video), video)
+
+    assert response == {"id": "video_id"}
+    assert server.received == open(video, "rb").read()
+    assert not os.path.exists(video + ".upload.json")
+
+
+def test_resumable_upload_resumes_interrupted_upload(server, video):
+    # Start the session, send two chunks, then die
+    with pytest.raises(KeyboardInterrupt):
+        yt.resumable_upload(insert_request(server, video, CrashingHttp(3)), video)
+    assert len(server.received) == 2 * CHUNK_SIZE
+    assert os.path.exists(video + ".upload.json")
+
+    response = yt.resumable_upload(insert_request(server, video), video)
+
+    assert response == {"id": "video_id"}
+    assert server.sessions == 1
+    assert server.received == open(video, "rb").read()
+    assert not os.path.exists(video + ".upload.json")
+
+
+def test_resumable_upload_ignores_state_of_other_file(server, video):
+    with pytest.raises(KeyboardInterrupt):
+        yt.resumable_upload(insert_request(server, video, CrashingHttp(2)), video)
+
+    # A new video with the same name must start a fresh session
+    with open(video, "ab") as f:
+        f.write(b"new")
+    yt.resumable_upload(insert_request(server, video), video)
+
+    assert server.sessions == 2
+    assert server.received == open(video, "rb").read()
+
+
+def test_resumable_upload_streams_growing_file(server, tmp_path):
+    video = str(tmp_path / "final.mp4")
+    data = bytes(range(256)) * (CHUNK_SIZE // 256)
+    open(video, "wb").close()
+    media = yt.GrowingFileUpload(video, chunksize=CHUNK_SIZE)
+
+    def encode():
+        # Write the video bit by bit, only finishing once two chunks have been uploaded
+        with open(video, "ab") as f:
+            for _ in range(3):
+                f.write(data)
+                f.flush()
+            f.write(b"end")
+        while len(server.ranges) < 2:
+            time.sleep(0.01)
+        media.finish()
+
+    encoder = threading.Thread(target=encode)
+    encoder.start()
+    response = yt.resumable_upload(insert_request(server, video, media=media))
+    encoder.join()
+
+    assert response == {"id": "video_id"}
+    assert server.received == open(video, "rb").read()
+    assert server.ranges[:2] == [
+        f"bytes 0-{CHUNK_SIZE - 1}/*",
+        f"bytes {CHUNK_SIZE}-{2 * CHUNK_SIZE - 1}/*",
+    ]
+    assert server.ranges[-1].endswith(f"/{3 * CHUNK_SIZE + 3}")
+
+
+def test_resumable_upload_stops_when_encoding_fails(server, tmp_path):
+    video = str(tmp_path / "final.mp4")
+    open(video, "wb").close()
+    media = yt.GrowingFileUpload(video, chunksize=CHUNK_SIZE)
+    media.finish(1)
+
+    with pytest.raises(RuntimeError):
+        yt.resumable_upload(insert_request(server, video, media=media))
+
+
+class FakeService:
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    def videos(self):
+        return self
+
+    def list(self, **kwargs):
+        return self
+
+    def execute(self):
+        return {"items": [{"status": {"uploadStatus": self.statuses.pop(0)}}]}
+
+
+def test_wait_for_processing_backs_off(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(yt.time, "sleep", sleeps.append)
+
+    service = FakeService(["uploaded", "uploaded", "uploaded", "processed"])
+
+    assert yt.wait_for_processing(service, "video_id")
+    assert sleeps == [5, 10, 20]
+
+
+def test_wait_for_processing_stops_on_failure(monkeypatch):
+    monkeypatch.setattr(yt.time, "sleep", lambda seconds: None)
+
+    assert not yt.wait_for_processing(FakeService(["uploaded", "failed"]), "video_id")
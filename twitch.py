@@ -1,14 +1,32 @@
+import asyncio
+import contextlib
 import datetime
+import difflib
+import json
+import re
+import threading
+import time
 import webbrowser
 from sys import exit as sys_exit
 
 import requests
 
 import constants
+import dedup
+import files
+import instrument
+import review
+import selection
+import store
 import utils
 
 
-def request_oauth(twitch_secret: dict, num_fails: int = 0) -> str:
+def request_oauth(twitch_secret: dict) -> str:
+    return request_oauth_response(twitch_secret)["access_token"]
+
+
+def request_oauth_response(twitch_secret: dict, num_fails: int = 0) -> dict:
+    # Full token response, including expires_in
     headers = {
         "Content-Type": "application/x-www-form-urlencoded",
     }
@@ -35,130 +53,330 @@ def request_oauth(twitch_secret: dict, num_fails: int = 0) -> str:
             sys_exit(1)
 
         print("Trying again...")
-        return request_oauth(twitch_secret, num_fails)
+        return request_oauth_response(twitch_secret, num_fails)
 
     if response.status_code == 200:
         print("Twitch OAuth received.")
-        return response.json()["access_token"]
+        return response.json()
 
     print(f"Unhandled exception occurred: {response.status_code=}\n\n{response.text=}")
     sys_exit(1)
 
 
-def get_game_id(game: str, headers: dict) -> str:
-    # Check if game ID is already stored
-    if game_id := __read_game_id_from_cache(game):
-        print("Game ID retrieved.")
-        return game_id
+class HelixClient:
+    # Authenticated Twitch API client sharing one connection pool, OAuth token and rate limit budget
+    MAX_RETRIES = 5
 
-    # If not, request game ID from Twitch
-    url = f"{constants.BASE_HELIX_URL}/games"
-    params = {
-        "name": game.title(),
-    }
+    def __init__(self, twitch_secret: dict, token_path: str = None):
+        self.twitch_secret = twitch_secret
+        self.token_path = token_path or constants.TWITCH_TOKEN_PATH
+        self.session = requests.Session()
+        self.session.mount(
+            "https://",
+            requests.adapters.HTTPAdapter(pool_maxsize=constants.DOWNLOAD_WORKERS),
+        )
+        self.session.headers["Client-Id"] = twitch_secret["client_id"]
+        self.__lock = threading.Lock()
+        self.__token = None
+        self.__ratelimit_remaining = None
+        self.__ratelimit_reset = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.session.close()
+
+    def token(self, refresh: bool = False) -> str:
+        # App access tokens last for weeks, so reuse the one on disk until it's about to expire
+        with self.__lock:
+            if refresh or not self.__token:
+                self.__token = None if refresh else self.__read_cached_token()
+                if not self.__token:
+                    with instrument.span("oauth"):
+                        response = request_oauth_response(self.twitch_secret)
+                    self.__token = response["access_token"]
+                    self.__write_cached_token(response)
+            return self.__token
+
+    def headers(self) -> dict:
+        # Headers for all Twitch API requests
+        return {
+            "Authorization": f"Bearer {self.token()}",
+            "Client-Id": self.twitch_secret["client_id"],
+        }
+
+    def get(self, endpoint: str, params=None) -> dict:
+        url = f"{constants.BASE_HELIX_URL}/{endpoint}"
+        for retry in range(self.MAX_RETRIES):
+            self.__wait_for_rate_limit()
+            response = self.session.get(
+                url, params=params, headers=self.headers(), timeout=10
+            )
+            self.__update_rate_limit(response)
+
+            if response.status_code == 401:
+                # Token was revoked or expired early
+                self.token(refresh=True)
+                continue
+            if response.status_code == 429:
+                # Rate limited; __wait_for_rate_limit sleeps until the bucket refills
+                print("Twitch rate limit reached. Waiting...")
+                if self.__ratelimit_remaining is None:
+                    time.sleep(2**retry)
+                continue
+
+            response.raise_for_status()
+            return response.json()
 
-    # Loop until response data is not empty
-    while not (
-        data := requests.get(url, params=params, headers=headers).json()["data"]
-    ):
-        # If data is empty, the name was wrong. Try again with another name.
-        # Note that game is not changed, so the informal name is saved in the game_ids file for easier future use.
-        game = input(
-            f'Could not find "{game}." What is the game\'s full name on Twitch? '
+        response.raise_for_status()
+        return response.json()
+
+    def paginate(self, endpoint: str, params: dict):
+        # Yields items one page at a time, requesting the next page only once the current one is used up
+        params = dict(params)
+        while True:
+            response = self.get(endpoint, params)
+            yield from response["data"]
+
+            cursor = response.get("pagination", {}).get("cursor")
+            if not cursor or not response["data"]:
+                return
+            params["after"] = cursor
+
+    async def apaginate(self, endpoint: str, params: dict):
+        # Same as paginate, but fetches pages in a worker thread so the event loop isn't blocked
+        pages = self.paginate(endpoint, params)
+        done = object()
+        while (item := await asyncio.to_thread(next, pages, done)) is not done:
+            yield item
+
+    def __wait_for_rate_limit(self):
+        with self.__lock:
+            if (
+                self.__ratelimit_remaining is not None
+                and self.__ratelimit_remaining <= 0
+            ):
+                delay = self.__ratelimit_reset - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                self.__ratelimit_remaining = None
+
+    def __update_rate_limit(self, response: requests.Response):
+        remaining = response.headers.get("Ratelimit-Remaining")
+        reset = response.headers.get("Ratelimit-Reset")
+        if remaining is None or reset is None:
+            return
+        with self.__lock:
+            self.__ratelimit_remaining = int(remaining)
+            self.__ratelimit_reset = float(reset)
+
+    def __read_cached_token(self) -> str | None:
+        try:
+            cached = utils.read_json(self.token_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None  # A broken cache is just rewritten with the next token
+        if (
+            cached.get("client_id") == self.twitch_secret["client_id"]
+            and cached.get("expires_at", 0) - constants.TWITCH_TOKEN_MARGIN
+            > time.time()
+        ):
+            return cached["access_token"]
+        return None
+
+    def __write_cached_token(self, response: dict):
+        files.write_json(
+            {
+                "client_id": self.twitch_secret["client_id"],
+                "access_token": response["access_token"],
+                "expires_at": time.time() + response["expires_in"],
+            },
+            self.token_path,
         )
-        params["name"] = game.title()
 
-    game_id = data[0]["id"]
+
+def get_game_id(game: str, client: HelixClient) -> str:
+    # Resolves a single game without prompting, so unattended runs never wait on input
+    # A game Twitch doesn't recognize raises a ValueError suggesting similarly named games
+    game_ids, suggestions = get_game_ids([game], client)
+    if game not in game_ids:
+        similar = suggestions[game]
+        hint = f' Did you mean: {", ".join(similar)}?' if similar else ""
+        raise ValueError(f'Could not find "{game}".{hint}')
     print("Game ID retrieved.")
+    return game_ids[game]
+
+
+def get_game_ids(
+    games: list[str], client: HelixClient
+) -> tuple[dict[str, str], dict[str, list[str]]]:
+    # Resolves many games at once without prompting: cached names are looked up locally and the
+    # rest are sent to Twitch up to 100 names per request. Returns the IDs found, and for every
+    # game that wasn't found, similarly named games ranked from most to least alike
+    game_ids = {}
+    missing = []
+    for game in games:
+        if game_id := __read_game_id_from_cache(game):
+            game_ids[game] = game_id
+        elif game not in missing:
+            missing.append(game)
+
+    # Ask for both the name as written and in title case, like "fifa 23" and "Fifa 23"
+    names = list(
+        dict.fromkeys(
+            name
+            for game in missing
+            for name in (__canonical_name(game), __canonical_name(game).title())
+        )
+    )
+    found = {}  # normalized name: game ID
+    for i in range(0, len(names), constants.HELIX_GAMES_PER_REQUEST):
+        params = {"name": names[i : i + constants.HELIX_GAMES_PER_REQUEST]}
+        for data in client.get("games", params)["data"]:
+            found[normalize_game_name(data["name"])] = data["id"]
+            __write_game_id_to_cache(data["name"], data["id"])
+
+    suggestions = {}
+    for game in missing:
+        if game_id := found.get(normalize_game_name(__canonical_name(game))):
+            game_ids[game] = game_id
+            __write_game_id_to_cache(game, game_id)
+        else:
+            suggestions[game] = suggest_games(game, client)
+    return game_ids, suggestions
+
+
+def suggest_games(game: str, client: HelixClient = None, limit: int = 5) -> list[str]:
+    # Names of known games (and Twitch search results, given a client) closest to game
+    candidates = set(store.get_store(constants.GAME_IDS_PATH).keys())
+    if client:
+        params = {"query": game, "first": 20}
+        candidates.update(
+            data["name"] for data in client.get("search/categories", params)["data"]
+        )
+
+    normalized = normalize_game_name(game)
+    ranked = sorted(
+        candidates,
+        key=lambda name: difflib.SequenceMatcher(
+            None, normalized, normalize_game_name(name)
+        ).ratio(),
+        reverse=True,
+    )
+    return ranked[:limit]
 
-    __write_game_id_to_cache(game, game_id)
 
-    return game_id
+def normalize_game_name(game: str) -> str:
+    # Case and punctuation don't matter, so "Counter-Strike: Global Offensive" matches "counter strike global offensive"
+    game = game.casefold().replace("&", " and ")
+    return " ".join(re.sub(r"[^\w\s]|_", " ", game).split())
 
 
 def get_clips_data(
     game_id: str,
-    headers: dict,
+    client: HelixClient,
     num_clips: int,
     days_ago: int,
-    cursor: str = None,
-    video_length: int = 0,
+    review_mode: str = None,
+    skip_duplicates: bool = True,
+    included: list = None,
+    duration: float = None,
+    per_broadcaster: int = None,
 ) -> tuple[list[str], list[str], list[str]]:
-    # Whether to manually choose clips one-by-one or simply get the top num_clips clips
-    manual_mode = num_clips <= 0
+    # Whether to manually choose clips one-by-one or simply get the top clips, up to num_clips
+    # clips and/or about duration seconds of video
+    manual_mode = num_clips <= 0 and not duration
 
     # Get date and time from days_ago days ago (in Twitch's format)
     started_at = utils.get_past_datetime(days_ago)
 
-    # Request clips from Twitch
+    # Request clips from Twitch, one page at a time as they're needed
     print("Requesting clips...")
-    url = f"{constants.BASE_HELIX_URL}/clips"
-    params = {
-        "game_id": game_id,
-        "first": 20 if manual_mode else num_clips,
-        "started_at": started_at,
-        "after": cursor,
-    }
-    response = requests.get(url, params=params, headers=headers).json()
+    # Helix allows 100 per page. Clips that don't fit the duration are skipped, so as many as
+    # possible are requested at once
+    page_size = 20 if manual_mode else 100 if duration else min(num_clips, 100)
+    params = {"game_id": game_id, "first": page_size, "started_at": started_at}
 
     clips = []  # download URLs
     slugs = []  # public Twitch clip URLs
     names = []  # streamer names
-    for data in response["data"]:
-        if manual_mode:
-            # Open clip in browser
-            webbrowser.open(data["url"])
-
-            print(
-                f"Current length of video: {datetime.timedelta(seconds=video_length)}\n"
-                f'With current clip:       {datetime.timedelta(seconds=video_length+data["duration"])}'
-            )
+    video_length = 0
+    # Helix data of included clips, also kept in included if it's given
+    included = [] if included is None else included
+    duplicates = 0
+    budget = selection.DurationBudget(duration, per_broadcaster)
+    pages = client.paginate("clips", params)
+    if manual_mode and review_mode:
+        # Clips are downloaded and previewed ahead of the one being reviewed, so each opens instantly
+        candidates = review.prefetch_clips(pages, __download_url, review_mode)
+    else:
+        candidates = ((data, data["url"], None) for data in pages)
+    with contextlib.closing(candidates):
+        for data, preview, reviewed in candidates:
+            # Several people often clip the same moment; one copy is enough
+            if skip_duplicates and dedup.is_duplicate(data, included):
+                duplicates += 1
+                if manual_mode:
+                    print("Skipping a clip of a moment that's already included.")
+                continue
+
+            if manual_mode:
+                # Open clip (or its preview) in browser
+                webbrowser.open(preview)
+
+                print(
+                    f"Current length of video: {datetime.timedelta(seconds=video_length)}\n"
+                    f'With current clip:       {datetime.timedelta(seconds=video_length+data["duration"])}'
+                )
 
-            choice = input("Include this clip in the video? (y, yf, n, nf): ").lower()
-            while choice not in {"y", "n", "yf", "nf"}:
-                print("Invalid choice.")
                 choice = input(
                     "Include this clip in the video? (y, yf, n, nf): "
                 ).lower()
-            if "y" in choice:
-                # update video length
-                video_length += data["duration"]
+                while choice not in {"y", "n", "yf", "nf"}:
+                    print("Invalid choice.")
+                    choice = input(
+                        "Include this clip in the video? (y, yf, n, nf): "
+                    ).lower()
+                if "y" in choice:
+                    # update video length
+                    video_length += data["duration"]
+
+                    # Keep the reviewed download so it isn't downloaded again
+                    if reviewed:
+                        review.promote_clip(data["url"], reviewed)
+
+                    # Append data to lists
+                    __save_clip_data(data, clips, slugs, names)
+                    included.append(data)
+                if "f" in choice:
+                    print("Clips chosen.")
+                    return clips, slugs, names
+            else:
+                # Stop requesting pages once no more clips would be included
+                if not budget.take(data):
+                    if budget.full():
+                        break
+                    continue
 
                 # Append data to lists
                 __save_clip_data(data, clips, slugs, names)
-            if "f" in choice:
-                print("Clips chosen.")
-                return clips, slugs, names
-        else:
-            # Append data to lists
-            __save_clip_data(data, clips, slugs, names)
-
-    if manual_mode or len(clips) < num_clips:
-        # If we're in manual mode and haven't finished ('f' in choice) OR we're in automatic mode and the response did not include all clips, make another request
-        # I don't like that this is recursive... maybe I'll revisit it later
-        cursor = response["pagination"]["cursor"]
-        num_clips -= len(clips)
-        new_clips, new_slugs, new_names = get_clips_data(
-            game_id, headers, num_clips, days_ago, cursor, video_length
-        )
-        clips.extend(new_clips)
-        slugs.extend(new_slugs)
-        names.extend(new_names)
-
-        return clips, slugs, names
+                included.append(data)
+                if 0 < num_clips <= len(clips) or budget.full():
+                    break
 
+    if duplicates:
+        print(f"Skipped {duplicates} duplicate clips.")
+    if duration:
+        print(
+            f"Chose {len(clips)} clips, {datetime.timedelta(seconds=round(budget.length))} of video."
+        )
     print("Clips received.")
     return clips, slugs, names
 
 
 def __save_clip_data(data, clips, slugs, names):
-    # Get download url
-    url = data["thumbnail_url"]
-    splice_index = url.index("-preview")
-    url = url[:splice_index] + ".mp4"
-
     # Save download url
-    clips.append(url)
+    clips.append(__download_url(data))
 
     # Save public clip url (a.k.a. slug)
     slugs.append(data["url"])
@@ -167,12 +385,44 @@ def __save_clip_data(data, clips, slugs, names):
     names.append(data["broadcaster_name"])
 
 
+def __download_url(data) -> str:
+    url = data["thumbnail_url"]
+    splice_index = url.index("-preview")
+    return url[:splice_index] + ".mp4"
+
+
 def __read_game_id_from_cache(game: str) -> str | None:
-    game_ids = utils.read_json(constants.GAME_IDS_PATH)
-    return game_ids.get(game.lower())
+    game_ids = store.get_store(constants.GAME_IDS_PATH)
+    if game_id := game_ids.get(game.lower()):
+        return game_id
+
+    # Fall back to the normalized index, which also knows common aliases
+    if name := __game_index().get(normalize_game_name(__canonical_name(game))):
+        return game_ids.get(name)
+    return None
+
+
+# Game ID cache path: {normalized name: cached name}, built once per process and then kept up
+# to date as names are cached
+__game_indexes = {}
+__game_indexes_lock = threading.Lock()
+
+
+def __game_index() -> dict[str, str]:
+    with __game_indexes_lock:
+        if constants.GAME_IDS_PATH not in __game_indexes:
+            __game_indexes[constants.GAME_IDS_PATH] = {
+                normalize_game_name(name): name
+                for name in store.get_store(constants.GAME_IDS_PATH).keys()
+            }
+        return __game_indexes[constants.GAME_IDS_PATH]
+
+
+def __canonical_name(game: str) -> str:
+    # Full name of games usually called by an abbreviation, like "csgo"
+    return constants.GAME_ALIASES.get(normalize_game_name(game), game)
 
 
 def __write_game_id_to_cache(game: str, game_id: str):
-    game_ids = utils.read_json(constants.GAME_IDS_PATH)
-    game_ids[game.lower()] = game_id
-    utils.write_json(game_ids, constants.GAME_IDS_PATH)
+    store.get_store(constants.GAME_IDS_PATH).set(game.lower(), game_id)
+    __game_index()[normalize_game_name(game)] = game.lower()
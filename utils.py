@@ -1,91 +1,169 @@
+import collections
 import datetime
 import json
 import os
 import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import psutil
 import requests
-from moviepy.editor import (
-    CompositeVideoClip,
-    ImageClip,
-    TextClip,
-    VideoFileClip,
-    concatenate_videoclips,
-)
 
+import clip_cache
 import constants
+import instrument
+import overlays
+import probe
 
 
 def read_json(filename):
-    try:
-        with open(filename, "r") as f:
-            return json.loads(f.read())
-    except json.decoder.JSONDecodeError:
-        write_json({}, filename)
-        return read_json(filename)
+    # Raises json.JSONDecodeError for a broken file; callers decide whether it can be replaced,
+    # since many are the user's own files
+    with open(filename, "r") as f:
+        return json.loads(f.read())
 
 
-def write_json(json_dict, filename):
-    with open(filename, "wt") as f:
-        json.dump(json_dict, f)
+def create_session(pool_size: int = constants.DOWNLOAD_WORKERS) -> requests.Session:
+    # One pooled session shared by every download so connections to the clip CDN are reused
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 
+def reset_tmp_dir(tmp_dir: str = None):
+    # Make an empty tmp directory for clips, deleting any clips and segments left by a previous run
+    tmp_dir = tmp_dir or constants.TMP_DIR
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
 
-def download_clips(clip_urls):
+
+def download_clips(
+    clip_urls,
+    workers: int = constants.DOWNLOAD_WORKERS,
+    slugs=None,
+    cache_size: int = constants.CLIP_CACHE_SIZE,
+    tmp_dir: str = None,
+):
     print("Downloading clips...")
 
-    # Make tmp directory for clips
-    try:
-        os.mkdir(constants.TMP_DIR)
-    except FileExistsError:
-        # tmp directory already exists, so delete any existing clips
-        for file in os.listdir(constants.TMP_DIR):
-            os.remove(os.path.join(constants.TMP_DIR, file))
-
-    for i, url in enumerate(clip_urls):
-        try:
-            # Download clip
-            response = requests.get(url, stream=True, timeout=5)
-            response.raise_for_status()
-            filename = f"{i}.mp4"
-            clip_path = os.path.join(constants.TMP_DIR, filename)
-            with open(clip_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
-        except requests.exceptions.HTTPError as err:
-            print(f"{url} returned HTTP Error")
-            print(err.args[0])
-        except requests.exceptions.Timeout:
-            print(f"{url} timed out")
-        except requests.exceptions.ConnectionError:
-            print(f"Error connecting to {url}")
-        except requests.exceptions.RequestException:
-            print(f"{url} caused a catastrophic error")
-
-    print("Clips downloaded.")
-
-
-def concatenate_clips(names):
+    tmp_dir = tmp_dir or constants.TMP_DIR
+    reset_tmp_dir(tmp_dir)
+    os.makedirs(constants.CLIP_CACHE_DIR, exist_ok=True)
+
+    # Clips are cached by slug (or download URL if no slugs are given), so each is fetched at most once
+    keys = [clip_cache.clip_key(slug) for slug in (slugs or clip_urls)]
+    urls = dict(zip(keys, clip_urls))
+
+    workers = max(1, min(workers, len(urls)))
+    start = time.perf_counter()
+    with instrument.span("download", clips=len(urls)) as span, create_session(
+        workers
+    ) as session, ThreadPoolExecutor(workers) as executor:
+        futures = {
+            key: executor.submit(clip_cache.fetch_clip, session, url, key)
+            for key, url in urls.items()
+        }
+        results = {key: future.result() for key, future in futures.items()}
+        span["bytes"] = sum(written for _, written in results.values())
+    elapsed = time.perf_counter() - start
+
+    # Each clip keeps its index in the file name, so completion order doesn't matter
+    for i, key in enumerate(keys):
+        if clip_path := results[key][0]:
+            clip_cache.link_clip(clip_path, os.path.join(tmp_dir, f"{i}.mp4"))
+
+    total_bytes = sum(written for _, written in results.values())
+    hits = sum(1 for key in urls if results[key][0] and not results[key][1])
+    print(
+        f"Clips downloaded: {len(urls) - hits} fetched, {hits} from cache, "
+        f"{total_bytes / 1e6:.1f} MB in {elapsed:.1f}s "
+        f"({total_bytes / 1e6 / max(elapsed, 1e-6):.1f} MB/s)."
+    )
+
+    used = {clip_path for clip_path, _ in results.values() if clip_path}
+    if evicted := clip_cache.evict(cache_size, keep=used):
+        print(f"Evicted {evicted} clips from cache.")
+
+
+def clip_index(clip_path: str) -> int:
+    # Clips are saved as {i}.mp4, so sort them numerically rather than lexicographically
+    return int(os.path.splitext(os.path.basename(clip_path))[0])
+
+
+def list_clips(tmp_dir: str = None) -> list[str]:
+    # Downloaded clips in video order, ignoring any other render artifacts in the tmp directory
+    tmp_dir = tmp_dir or constants.TMP_DIR
+    return sorted(
+        [
+            os.path.join(tmp_dir, file)
+            for file in os.listdir(tmp_dir)
+            if file.endswith(".mp4")
+        ],
+        key=clip_index,
+    )
+
+
+def render_profile(name: str = None) -> dict:
+    # Encoder settings of a profile in constants.RENDER_PROFILES, with its name
+    name = name or constants.DEFAULT_RENDER_PROFILE
+    if name not in constants.RENDER_PROFILES:
+        raise ValueError(
+            f'Unknown render profile "{name}"; choose from {", ".join(constants.RENDER_PROFILES)}'
+        )
+    return {"name": name, **constants.RENDER_PROFILES[name]}
+
+
+def concatenate_clips(
+    names,
+    streaming: bool = False,
+    cpus: int = None,
+    tmp_dir: str = None,
+    output: str = "final.mp4",
+    profile: str = None,
+):
+    cpus = cpus or psutil.cpu_count()
+    settings = render_profile(profile)
+    if streaming:
+        return __stream_clips(
+            names, cpus, tmp_dir or constants.TMP_DIR, output, settings
+        )
+
+    # MoviePy takes most of a second to import, so it's only loaded when it renders a video
+    from moviepy.editor import (
+        CompositeVideoClip,
+        ImageClip,
+        VideoFileClip,
+        concatenate_videoclips,
+    )
+
     vfcs = []  # VideoFileClips
-    txts = []  # TextClips
+    txts = []  # Name badge ImageClips
     cvcs = []  # CompositeVideoClips
     timestamps = [0]
 
-    twitch_img = ImageClip("twitch.jpg").resize(0.15).set_position(("left", "top"))
-
-    clips = sorted(
-        [
-            os.path.join(constants.TMP_DIR, file)
-            for file in os.listdir(constants.TMP_DIR)
-        ]
+    # Logo and name badges are pre-rendered and cached, so they're only rasterized once
+    twitch_img = ImageClip(overlays.overlay_array(overlays.logo_path())).set_position(
+        ("left", "top")
     )
-    for i, clip in enumerate(clips):
-        vfc = VideoFileClip(clip, target_resolution=(1080, 1920))
+
+    clips = list_clips(tmp_dir)
+    plan = probe.render_plan(clips)
+    probe.print_plan(plan)
+    for clip, entry in zip(clips, plan["clips"]):
+        vfc = VideoFileClip(clip, target_resolution=__target_resolution(entry))
         vfcs.append(vfc)
 
-        txt = TextClip(txt=names[i], font="Helvetica-Bold", fontsize=50, color="black")
+        # Clips that failed to download leave gaps, so names are looked up by file name
         txt = (
-            txt.on_color(size=(txt.w + 8, twitch_img.h), color=(255, 255, 255))
+            ImageClip(
+                overlays.overlay_array(overlays.badge_path(names[clip_index(clip)]))
+            )
             .set_position((twitch_img.w, "top"))
             .set_duration(vfc.duration)
         )
@@ -100,14 +178,19 @@ def concatenate_clips(names):
             # Add most recent timestamp to current clip's duration for next timestamp
             timestamps.append(timestamps[-1] + vfc.duration)
 
+    # Clips are decoded and composited as the video is written, so this is one stage
     final_clip = concatenate_videoclips(cvcs)
-    final_clip.write_videofile(
-        "final.mp4",
-        temp_audiofile="temp-audio.m4a",
-        remove_temp=True,
-        audio_codec="aac",
-        threads=psutil.cpu_count(),
-    )
+    with instrument.span("encode", clips=len(clips), profile=settings["name"]):
+        final_clip.write_videofile(
+            output,
+            temp_audiofile=os.path.splitext(output)[0] + "-temp-audio.m4a",
+            remove_temp=True,
+            audio_codec="aac",
+            audio_bitrate=settings["audio_bitrate"],
+            preset=settings["preset"],
+            ffmpeg_params=["-crf", str(settings["crf"]), "-g", str(settings["gop"])],
+            threads=cpus,
+        )
     print("Final video created.")
 
     # Close all MoviePy objects
@@ -122,10 +205,171 @@ def concatenate_clips(names):
     return timestamps
 
 
-def delete_videos(include_final=False):
-    shutil.rmtree(constants.TMP_DIR)
+def __stream_clips(names, cpus: int, tmp_dir: str, output: str, settings: dict):
+    # Only one clip (and its ffmpeg readers) is open at a time: each is composited and written
+    # to its own segment, closed, and the segments are joined without re-encoding
+    from moviepy.editor import CompositeVideoClip, ImageClip, VideoFileClip
+
+    clips = list_clips(tmp_dir)
+
+    # Segments need a common frame rate to be joined, and MoviePy renders at the highest one
+    plan = probe.render_plan(clips)
+    probe.print_plan(plan)
+    fps = plan["fps"]
+    twitch_img = ImageClip(overlays.overlay_array(overlays.logo_path())).set_position(
+        ("left", "top")
+    )
+
+    segment_dir = os.path.join(tmp_dir, "segments")
+    os.makedirs(segment_dir, exist_ok=True)
+    segments = []
+    timestamps = [0]
+    for i, (clip, entry) in enumerate(zip(clips, plan["clips"])):
+        segment = os.path.join(segment_dir, f"{i}.mp4")
+        with instrument.span(
+            "render_clip", clip=i, profile=settings["name"]
+        ), VideoFileClip(clip, target_resolution=__target_resolution(entry)) as vfc:
+            txt = (
+                ImageClip(
+                    overlays.overlay_array(overlays.badge_path(names[clip_index(clip)]))
+                )
+                .set_position((twitch_img.w, "top"))
+                .set_duration(vfc.duration)
+            )
+            with CompositeVideoClip(
+                [vfc, twitch_img.set_duration(vfc.duration), txt]
+            ) as cvc:
+                cvc.write_videofile(
+                    segment,
+                    fps=fps,
+                    temp_audiofile=os.path.join(segment_dir, f"{i}.m4a"),
+                    remove_temp=True,
+                    audio_codec="aac",
+                    audio_fps=constants.AUDIO_FPS,
+                    audio_bitrate=settings["audio_bitrate"],
+                    preset=settings["preset"],
+                    ffmpeg_params=[
+                        "-video_track_timescale",
+                        "90000",
+                        "-crf",
+                        str(settings["crf"]),
+                        "-g",
+                        str(settings["gop"]),
+                    ],
+                    threads=cpus,
+                    logger=None,
+                )
+            txt.close()
+        segments.append(segment)
+        print(f"Clip {i + 1}/{len(clips)} rendered.")
+
+        if clip is not clips[-1]:  # No need for last clip's duration
+            timestamps.append(timestamps[-1] + probe.probe(segment)["duration"])
+    twitch_img.close()
+
+    concat_segments(segments, output, tmp_dir)
+    print("Final video created.")
+
+    return timestamps
+
+
+def __target_resolution(entry: dict) -> tuple[int, int] | None:
+    # MoviePy resizes every frame it's given a target for, even to the size it already is
+    if "scale" not in entry["steps"]:
+        return None
+    width, height = constants.VIDEO_RESOLUTION
+    return height, width
+
+
+class ResourceMonitor:
+    # Samples memory and ffmpeg subprocesses in the background to record their high-water marks
+    # Only the latest max_samples samples are kept, but the peaks cover the whole time
+    def __init__(self, interval: float = 0.1, max_samples: int = None):
+        self.interval = interval
+        self.peak_rss = 0  # Bytes, this process plus its children
+        self.peak_ffmpeg_processes = 0
+        # (time.time(), rss, ffmpeg processes)
+        self.samples = collections.deque(maxlen=max_samples)
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__sample, daemon=True)
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.__stop.set()
+        self.__thread.join()
+
+    def __sample(self):
+        process = psutil.Process()
+        while True:
+            rss = process.memory_info().rss
+            ffmpeg_processes = 0
+            for child in process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                    if "ffmpeg" in child.name():
+                        ffmpeg_processes += 1
+                except psutil.Error:
+                    continue  # Child exited while being sampled
+            self.samples.append((time.time(), rss, ffmpeg_processes))
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_ffmpeg_processes = max(
+                self.peak_ffmpeg_processes, ffmpeg_processes
+            )
+            if self.__stop.wait(self.interval):
+                return
+
+    def report(self) -> str:
+        return (
+            f"Peak memory: {self.peak_rss / 1024**2:.0f} MB, "
+            f"peak ffmpeg processes: {self.peak_ffmpeg_processes}"
+        )
+
+
+def ffmpeg_binary() -> str:
+    # The FFmpeg that MoviePy found (or downloaded). Its config is imported on first use,
+    # since importing it loads imageio and numpy
+    from moviepy.config import get_setting
+
+    return get_setting("FFMPEG_BINARY")
+
+
+def concat_segments(segments: list[str], output: str, tmp_dir: str = None):
+    # Stream-copy with the concat demuxer; segments must share codec parameters (see render.__encoder_args)
+    concat_list = os.path.join(tmp_dir or constants.TMP_DIR, "concat.txt")
+    with open(concat_list, "wt") as f:
+        for segment in segments:
+            escaped = os.path.abspath(segment).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    command = [
+        ffmpeg_binary(),
+        "-y",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        concat_list,
+        "-c",
+        "copy",
+        output,
+    ]
+    with instrument.span("concat", segments=len(segments)):
+        subprocess.run(command, check=True)
+
+
+def delete_videos(include_final=False, tmp_dir: str = None, output: str = "final.mp4"):
+    # Either may be gone already if an earlier attempt got this far
+    if os.path.exists(tmp_dir := tmp_dir or constants.TMP_DIR):
+        shutil.rmtree(tmp_dir)
     if include_final and os.path.exists(
-        file := os.path.join(constants.SCRIPT_DIR, "final.mp4")
+        file := os.path.join(constants.SCRIPT_DIR, output)
     ):
         os.remove(file)
     print("Videos deleted.")
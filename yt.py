@@ -1,8 +1,10 @@
 import datetime
 import http.client
+import json
 import os
 import pickle
 import random
+import threading
 import time
 
 import httplib2
@@ -10,9 +12,12 @@ from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaFileUpload, MediaUpload
 
 import constants
+import files
+import instrument
+import store
 import utils
 
 
@@ -63,40 +68,147 @@ def generate_description(timestamps, slugs):
 
 
 def generate_tags(game_id, names):
-    all_tags = utils.read_json("tags.json")
-    game_tags = all_tags[game_id]
+    # Copy, so the game's tags in the store aren't changed
+    game_tags = list(store.get_store(constants.TAGS_PATH)[game_id])
     game_tags.extend([name.lower() for name in names])
     video_tags = list(set(game_tags))
     return video_tags
 
 
-def upload_video(game_id, timestamps, slugs, names):
+def create_youtube_service():
     API_NAME = "youtube"
     API_VERSION = "v3"
     SCOPES = ["https://www.googleapis.com/auth/youtube"]
 
-    service = create_service(
-        constants.YOUTUBE_SECRET_PATH, API_NAME, API_VERSION, SCOPES
-    )
+    return create_service(constants.YOUTUBE_SECRET_PATH, API_NAME, API_VERSION, SCOPES)
+
+
+def upload_video(
+    game_id,
+    timestamps,
+    slugs,
+    names,
+    service=None,
+    video_path="final.mp4",
+    chunk_size=constants.UPLOAD_CHUNK_SIZE,
+    media=None,
+    video_id=None,
+    on_upload=None,
+):
+    # Pass in a service to reuse one authenticated client across several uploads
+    # Given the ID of a video that's already uploaded, only adds it to its playlist. on_upload
+    # is called with the new video's ID as soon as the upload finishes
+    service = service or create_youtube_service()
 
     # Get playlist ID, title, and video count
     playlist_id, playlist_title, video_count = get_playlist(game_id, service)
 
-    upload_request_body = {
-        "snippet": {
-            "categoryId": 20,
-            "title": generate_title(playlist_title, video_count),
-            "description": generate_description(timestamps, slugs),
-            "tags": generate_tags(game_id, names),
-        },
-        "status": {"privacyStatus": "private", "selfDeclaredMadeForKids": False},
-    }
+    if video_id is None:
+        upload_request_body = {
+            "snippet": {
+                "categoryId": 20,
+                "title": generate_title(playlist_title, video_count),
+                "description": generate_description(timestamps, slugs),
+                "tags": generate_tags(game_id, names),
+            },
+            "status": {"privacyStatus": "private", "selfDeclaredMadeForKids": False},
+        }
+
+        # A GrowingFileUpload media uploads the video while it's still being encoded
+        mediaFile = media or MediaFileUpload(
+            video_path, chunksize=chunk_size, resumable=True
+        )
 
-    mediaFile = MediaFileUpload("final.mp4", chunksize=-1, resumable=True)
+        video_insert_request = service.videos().insert(
+            part="snippet,status", body=upload_request_body, media_body=mediaFile
+        )
+        with instrument.span("upload") as span:
+            response = resumable_upload(
+                video_insert_request, None if media else video_path
+            )
+            span["bytes"] = os.path.getsize(video_path)
+        video_id = response["id"]
+        if on_upload:
+            on_upload(video_id)
 
-    video_insert_request = service.videos().insert(
-        part="snippet,status", body=upload_request_body, media_body=mediaFile
-    )
+    # Wait for YouTube to process the upload
+    with instrument.span("youtube_processing"):
+        wait_for_processing(service, video_id)
+    # Insert video into playlist and update local playlist info
+    insert_to_playlist(service, game_id, playlist_id, video_id)
+    return video_id
+
+
+class GrowingFileUpload(MediaUpload):
+    # A video that ffmpeg is still writing. A chunk is only sent once bytes exist past its end
+    # (or the encode has finished), so every byte range YouTube receives is final
+    def __init__(
+        self, path, chunksize=constants.UPLOAD_CHUNK_SIZE, mimetype="video/mp4"
+    ):
+        super().__init__()
+        self._path = path
+        self._chunksize = chunksize
+        self._mimetype = mimetype
+        self._size = None
+        self._returncode = None
+        self._finished = threading.Event()
+
+    def finish(self, returncode=0):
+        # Called by whoever is writing the file once it's complete
+        self._returncode = returncode
+        if returncode == 0:
+            self._size = os.path.getsize(self._path)
+        self._finished.set()
+
+    def wait_for_chunk(self, begin):
+        while not self._finished.wait(constants.STREAM_UPLOAD_POLL):
+            if os.path.getsize(self._path) > begin + self._chunksize:
+                return
+        if self._returncode:
+            raise RuntimeError(
+                f"Encoding {self._path} failed with exit code {self._returncode}"
+            )
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._size  # Unknown until the encode finishes
+
+    def resumable(self):
+        return True
+
+    def getbytes(self, begin, length):
+        with open(self._path, "rb") as f:
+            f.seek(begin)
+            return f.read(length)
+
+    def has_stream(self):
+        return False
+
+
+def resumable_upload(request, video_path=None) -> dict:
+    # Uploads in chunks, saving the upload session next to the video so a killed process can
+    # pick up from the last byte YouTube acknowledged instead of starting over
+    # Without a video path (e.g. the video is still being encoded) nothing is saved
+    state_path = video_path and video_path + ".upload.json"
+    if video_path:
+        stat = os.stat(video_path)
+        fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if state_path and os.path.exists(state_path):
+        try:
+            state = utils.read_json(state_path)
+        except json.JSONDecodeError:
+            state = {}  # Start the upload over rather than trust a broken state file
+        if {key: state.get(key) for key in fingerprint} == fingerprint:
+            print("Resuming interrupted upload...")
+            request.resumable_uri = state["resumable_uri"]
+            # Makes the next chunk ask YouTube how much of the video it already has
+            request._in_error_state = True
+    saved_uri = request.resumable_uri
 
     # Explicitly tell the underlying HTTP transport library not to retry, since
     # we are handling retry logic ourselves.
@@ -123,20 +235,17 @@ def upload_video(game_id, timestamps, slugs, names):
     RETRIABLE_STATUS_CODES = [500, 502, 503, 504]
 
     # Upload the video... finally.
+    print("Uploading video...")
     response = None
-    error = None
     retry = 0
-    video_id = ""
+    start = time.perf_counter()
+    start_progress = None
     while response is None:
+        error = None
+        if isinstance(request.resumable, GrowingFileUpload):
+            request.resumable.wait_for_chunk(request.resumable_progress)
         try:
-            print("Uploading video...")
-            status, response = video_insert_request.next_chunk()
-            if response is not None:
-                if "id" in response:
-                    video_id = response["id"]
-                    print("Video id '%s' was successfully uploaded." % response["id"])
-            else:
-                exit("The upload failed with an unexpected response: %s" % response)
+            status, response = request.next_chunk()
         except HttpError as e:
             if e.resp.status in RETRIABLE_STATUS_CODES:
                 error = "A retriable HTTP error %d occurred:\n%s" % (
@@ -148,6 +257,10 @@ def upload_video(game_id, timestamps, slugs, names):
         except RETRIABLE_EXCEPTIONS as e:
             error = "A retriable error occurred: %s" % e
 
+        if state_path and request.resumable_uri and request.resumable_uri != saved_uri:
+            saved_uri = request.resumable_uri
+            files.write_json({"resumable_uri": saved_uri, **fingerprint}, state_path)
+
         if error is not None:
             print(error)
             retry += 1
@@ -158,16 +271,57 @@ def upload_video(game_id, timestamps, slugs, names):
             sleep_seconds = random.random() * max_sleep
             print("Sleeping %f seconds and then retrying..." % sleep_seconds)
             time.sleep(sleep_seconds)
+        elif status:
+            if start_progress is None:
+                # Don't count bytes uploaded by an earlier process towards throughput
+                start_progress = request.resumable_progress - status.resumable_progress
+            elapsed = max(time.perf_counter() - start, 1e-6)
+            rate = (status.resumable_progress - start_progress) / 1e6 / elapsed
+            if status.total_size:
+                total = f"{status.total_size / 1e6:.1f} MB ({status.progress():.0%}"
+            else:
+                total = "? MB (still encoding"
+            print(
+                f"Uploaded {status.resumable_progress / 1e6:.1f} of {total}, {rate:.1f} MB/s)"
+            )
+
+    if "id" not in response:
+        exit("The upload failed with an unexpected response: %s" % response)
+    print("Video id '%s' was successfully uploaded." % response["id"])
+
+    if state_path and os.path.exists(state_path):
+        os.remove(state_path)
+    return response
+
+
+def wait_for_processing(
+    service, video_id, timeout=constants.YOUTUBE_PROCESSING_TIMEOUT
+):
+    # Poll with exponential backoff instead of sleeping for a fixed time
+    delay = 5
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        items = (
+            service.videos().list(part="status", id=video_id).execute().get("items", [])
+        )
+        upload_status = items[0]["status"]["uploadStatus"] if items else None
+        if upload_status == "processed":
+            print("Video processed.")
+            return True
+        if upload_status in {"failed", "rejected", "deleted"}:
+            print(f"YouTube could not process the video: {upload_status}")
+            return False
 
-    # Wait for YouTube to process the upload
-    time.sleep(60)
-    # Insert video into playlist and update local playlist info
-    insert_to_playlist(service, game_id, playlist_id, video_id)
+        time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        delay = min(delay * 2, 60)
+
+    print("Timed out waiting for YouTube to process the video.")
+    return False
 
 
 def get_playlist(game_id, service, pToken=None, playlist=None):
     # Check if playlist_id exists for game_id
-    playlist_ids = utils.read_json("playlist_ids.json")
+    playlist_ids = store.get_store(constants.PLAYLIST_IDS_PATH)
     if game_id in playlist_ids:
         return playlist_ids[game_id]
 
@@ -194,8 +348,7 @@ def get_playlist(game_id, service, pToken=None, playlist=None):
         if playlist.lower() in playlist_title.lower():
             playlist_id = item["id"]
             count = item["contentDetails"]["itemCount"]
-            playlist_ids[game_id] = playlist_id, playlist_title, video_count
-            utils.write_json(playlist_ids, "playlist_ids.json")
+            playlist_ids[game_id] = [playlist_id, playlist_title, video_count]
             return playlist_id, playlist_title, video_count
     if playlist_id == "0":
         if "nextPageToken" in playlist_list_response:
@@ -223,6 +376,7 @@ def insert_to_playlist(service, game_id, playlist_id, video_id):
         pass
 
     # Increment local playlist video count
-    playlist_ids = utils.read_json("playlist_ids.json")
-    playlist_ids[game_id][2] += 1
-    utils.write_json(playlist_ids, "playlist_ids.json")
+    # Written straight away, since another run may be uploading to the same playlist
+    store.get_store(constants.PLAYLIST_IDS_PATH).update(
+        game_id, lambda entry: [*entry[:2], entry[2] + 1]
+    )